@@ -0,0 +1,236 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from .services import gemini_client, trip_advisor_client, async_gemini_client, async_trip_advisor_client
+
+
+logger = logging.getLogger(__name__)
+
+
+# Recorded Gemini and TripAdvisor responses, one cassette per destination
+CASSETTES_DIR = Path(__file__).resolve().parent / 'benchmark_fixtures'
+
+# Characters of generated text per event of a streamed Gemini answer
+GEMINI_STREAM_CHUNK_SIZE = 100
+
+
+def load_cassette(name : str) -> Dict[str, Any]:
+    """
+    Load recorded upstream responses.
+
+    Args:
+        name (str): Name of the cassette in benchmark_fixtures, without extension.
+
+    Returns:
+        dict: The raw Gemini response under gemini, and the TripAdvisor search results keyed
+            by place name, details and photos keyed by location ID under tripadvisor.
+    """
+    with open(CASSETTES_DIR / f'{name}.json') as cassette:
+        return json.load(cassette)
+
+
+class StubUpstreamServer:
+    """
+    Local HTTP server replaying a cassette in place of the Gemini and TripAdvisor APIs.
+
+    Every response is delayed by the injected latency of its upstream, plus or minus a
+    uniform jitter, so that the benchmark sees realistic network waits without network.
+    Streamed Gemini answers are spread over that delay, one event per chunk of text.
+    """
+
+    def __init__(self, cassette : Dict[str, Any], gemini_latency : float, tripadvisor_latency : float, jitter : float = 0.0):
+        """
+        Initialize the server.
+
+        Args:
+            cassette (dict): Recorded responses, see load_cassette.
+            gemini_latency (float): Seconds to wait before answering a Gemini request.
+            tripadvisor_latency (float): Seconds to wait before answering a TripAdvisor request.
+            jitter (float): Maximum random deviation from the latency, in seconds.
+        """
+        self.cassette = cassette
+        self.latencies = {'gemini': gemini_latency, 'tripadvisor': tripadvisor_latency}
+        self.jitter = jitter
+        self.request_counts = {'gemini': 0, 'tripadvisor': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'StubUpstreamServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def respond(self, method : str, path : str, query : Dict[str, List[str]]) -> Tuple[str, int, Any]:
+        """
+        Find the recorded response of a request.
+
+        Returns:
+            tuple: The upstream answering the request, the status code and the JSON body.
+        """
+        recorded = self.cassette['tripadvisor']
+        if method == 'POST' and path.endswith((':generateContent', ':streamGenerateContent')):
+            return 'gemini', 200, self.cassette['gemini']
+        if method == 'GET' and path.endswith('/location/search'):
+            search_query = query.get('searchQuery', [''])[0]
+            results = next(
+                (results for place_name, results in recorded['search'].items() if search_query.startswith(f'{place_name}, ')),
+                []
+            )
+            return 'tripadvisor', 200, {'data': results}
+        match = re.search(r'/location/(\d+)/(details|photos)$', path) if method == 'GET' else None
+        if match and match.group(1) in recorded[match.group(2)]:
+            return 'tripadvisor', 200, recorded[match.group(2)][match.group(1)]
+        return 'tripadvisor', 404, {'error': {'message': 'Not recorded', 'code': 404}}
+
+    def _handler_class(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real APIs, so that connection pooling is exercised
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._replay()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self._replay()
+
+            def _replay(self):
+                url = urlparse(self.path)
+                upstream, status, body = stub.respond(self.command, url.path, parse_qs(url.query))
+                with stub._lock:
+                    stub.request_counts[upstream] += 1
+                delay = stub.latencies[upstream] + random.uniform(-stub.jitter, stub.jitter)
+                if url.path.endswith(':streamGenerateContent'):
+                    self._stream(body, max(0.0, delay))
+                    return
+                time.sleep(max(0.0, delay))
+
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _stream(self, body, delay):
+                # Server-Sent Events in chunked encoding, each carrying the next part of the text
+                text = body['candidates'][0]['content']['parts'][0]['text']
+                chunks = [text[start:start + GEMINI_STREAM_CHUNK_SIZE] for start in range(0, len(text), GEMINI_STREAM_CHUNK_SIZE)]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for chunk in chunks:
+                    time.sleep(delay / len(chunks))
+                    event = {'candidates': [{'content': {'parts': [{'text': chunk}], 'role': 'model'}}]}
+                    content = f"data: {json.dumps(event)}\r\n\r\n".encode()
+                    self.wfile.write(f"{len(content):x}\r\n".encode() + content + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@contextmanager
+def stub_upstreams(base_url : str) -> Iterator[None]:
+    """Point the shared Gemini and TripAdvisor clients, sync and async, at a stub server for the duration of the block."""
+    gemini_urls = {
+        'BASE_URL': f"{base_url}/v1beta/models/gemini-1.5-flash:generateContent",
+        'STREAM_URL': f"{base_url}/v1beta/models/gemini-1.5-flash:streamGenerateContent",
+    }
+    trip_advisor_urls = {
+        'BASE_SEARCH_URL': f"{base_url}/api/v1/location/search",
+        'BASE_DETAILS_URL': f"{base_url}/api/v1/location/{{place_id}}/details",
+        'BASE_IMAGE_URL': f"{base_url}/api/v1/location/{{place_id}}/photos",
+    }
+    overrides = {
+        gemini_client: gemini_urls,
+        async_gemini_client: gemini_urls,
+        trip_advisor_client: trip_advisor_urls,
+        async_trip_advisor_client: trip_advisor_urls,
+    }
+    for client, urls in overrides.items():
+        vars(client).update(urls)
+    try:
+        yield
+    finally:
+        for client, urls in overrides.items():
+            for name in urls:
+                vars(client).pop(name, None)
+
+
+def run_load(request : Callable[[int], bool], num_requests : int, concurrency : int) -> Dict[str, Any]:
+    """
+    Send requests from a pool of threads and measure them.
+
+    Args:
+        request (callable): Sends the request of the given index, returning whether it succeeded.
+            Exceptions are counted as failed requests.
+        num_requests (int): Number of requests to send.
+        concurrency (int): Number of requests in flight at once.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, the average number of database queries per
+            request, the throughput in requests per second and the number of failed requests.
+    """
+    def measure(index : int) -> Tuple[float, int, bool]:
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                try:
+                    succeeded = request(index)
+                except Exception as e:
+                    logger.warning("Benchmark request %s failed: %s", index, e)
+                    succeeded = False
+                elapsed = time.perf_counter() - start
+            return elapsed, len(queries), succeeded
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(measure, range(num_requests)))
+    wall_time = time.perf_counter() - start
+
+    latencies = np.array([elapsed for elapsed, _, _ in samples]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if num_requests else (0.0, 0.0, 0.0)
+    return {
+        'requests': num_requests,
+        'failed': sum(1 for _, _, succeeded in samples if not succeeded),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'queries': float(np.mean([count for _, count, _ in samples])) if num_requests else 0.0,
+        'throughput': num_requests / wall_time if wall_time else 0.0,
+    }
@@ -0,0 +1,295 @@
+import copy
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PlaceSearchResult, GeminiResponse, Itinerary, ItineraryPayload
+from .serializers import ItineraryResponseSerializer
+from .instrumentation import span
+
+
+# Sentinel returned on cache misses, so that None can be cached as a value
+MISSING = object()
+
+# Longest search cache key, the length of the PlaceSearchResult.query column
+MAX_QUERY_LENGTH = PlaceSearchResult._meta.get_field('query').max_length
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after a time-to-live."""
+
+    def __init__(self, maxsize : int, ttl : float):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize (int): Maximum number of entries, the least recently used entry is evicted first.
+            ttl (float): Default time-to-live of an entry in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key : Hashable, default : Any = MISSING) -> Any:
+        """Return the cached value for the key, or the default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key : Hashable, value : Any, ttl : Optional[float] = None) -> None:
+        """Store the value for the key, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PlaceSearchCache:
+    """
+    Cache of TripAdvisor search results keyed by normalized (place_name, destination).
+
+    Lookups go through an in-process LRU first and fall back to the PlaceSearchResult table,
+    which is shared by all workers. Searches without a match are cached too, for a shorter time.
+    """
+
+    def __init__(self, maxsize : int, ttl : float, negative_ttl : float):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize (int): Maximum number of queries kept in memory.
+            ttl (float): Time-to-live in seconds of a resolved location id.
+            negative_ttl (float): Time-to-live in seconds of a search without a match.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def normalize(place_name : str, destination : str) -> str:
+        """
+        Build the cache key, ignoring case and redundant whitespace.
+
+        Place names are generated by Gemini and unbounded, so keys longer than MAX_QUERY_LENGTH
+        are cut and end with the SHA-256 of the whole key instead.
+        """
+        key = "|".join(" ".join(part.lower().split()) for part in (place_name, destination))
+        if len(key) > MAX_QUERY_LENGTH:
+            digest = hashlib.sha256(key.encode()).hexdigest()
+            key = f"{key[:MAX_QUERY_LENGTH - len(digest) - 1]}#{digest}"
+        return key
+
+    def get_many(self, queries : Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Look up cached search results.
+
+        Args:
+            queries (Iterable[str]): Normalized queries.
+
+        Returns:
+            dict: Location id (None for cached misses) keyed by query, unknown queries are left out.
+        """
+        queries = set(queries)
+        results = {}
+        for query in queries:
+            location_id = self.memory.get(query)
+            if location_id is not MISSING:
+                results[query] = location_id
+
+        unknown = queries - results.keys()
+        if unknown:
+            now = timezone.now()
+            rows = PlaceSearchResult.objects.filter(query__in=unknown).filter(
+                Q(location_id__isnull=False, updatedAt__gte=now - timedelta(seconds=self.ttl)) |
+                Q(location_id__isnull=True, updatedAt__gte=now - timedelta(seconds=self.negative_ttl))
+            )
+            for row in rows:
+                location_id = str(row.location_id) if row.location_id is not None else None
+                self._remember(row.query, location_id, age=(now - row.updatedAt).total_seconds())
+                results[row.query] = location_id
+        return results
+
+    def set_many(self, results : Dict[str, Optional[str]]) -> None:
+        """
+        Store search results in memory and in the database.
+
+        Args:
+            results (dict): Location id (None for a search without a match) keyed by normalized query.
+        """
+        if not results:
+            return
+        for query, location_id in results.items():
+            self._remember(query, location_id)
+        PlaceSearchResult.objects.bulk_create(
+            [
+                PlaceSearchResult(query=query, location_id=int(location_id) if location_id else None)
+                for query, location_id in results.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['query'],
+            update_fields=['location_id', 'updatedAt'],
+        )
+
+    def _remember(self, query : str, location_id : Optional[str], age : float = 0.0) -> None:
+        """Keep a result in the in-process cache for what is left of the TTL matching its kind, given its age in seconds."""
+        self.memory.set(query, location_id, (self.ttl if location_id else self.negative_ttl) - age)
+
+
+class GeminiResponseCache:
+    """
+    Cache of parsed Gemini itineraries keyed by prompt fingerprint.
+
+    Lookups go through an in-process LRU first and fall back to the GeminiResponse table,
+    which keeps about max_entries of the most recently stored responses: each process
+    evicts the expired and oldest responses every EVICTION_INTERVAL writes.
+    """
+
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, maxsize : int, max_entries : int, ttl : float):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize (int): Maximum number of responses kept in memory.
+            max_entries (int): Maximum number of responses kept in the database.
+            ttl (float): Time-to-live of a response in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self._writes = itertools.count(1)
+
+    def get(self, fingerprint : str) -> Optional[dict]:
+        """Return a copy of the cached response, or None if it is missing or expired."""
+        response = self.memory.get(fingerprint)
+        if response is MISSING:
+            now = timezone.now()
+            row = GeminiResponse.objects.filter(
+                fingerprint=fingerprint,
+                updatedAt__gte=now - timedelta(seconds=self.ttl),
+            ).first()
+            if row is None:
+                return None
+            response = row.response
+            # Kept in memory only for what is left of its TTL
+            self.memory.set(fingerprint, response, self.ttl - (now - row.updatedAt).total_seconds())
+        return copy.deepcopy(response)
+
+    def set(self, fingerprint : str, response : dict) -> None:
+        """Store the response, evicting old responses every EVICTION_INTERVAL writes."""
+        self.memory.set(fingerprint, copy.deepcopy(response))
+        GeminiResponse.objects.update_or_create(fingerprint=fingerprint, defaults={'response': response})
+        if next(self._writes) % self.EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete the expired responses, then the oldest ones beyond max_entries."""
+        GeminiResponse.objects.filter(updatedAt__lt=timezone.now() - timedelta(seconds=self.ttl)).delete()
+        excess = GeminiResponse.objects.count() - self.max_entries
+        if excess > 0:
+            oldest = GeminiResponse.objects.order_by('updatedAt').values_list('fingerprint', flat=True)[:excess]
+            GeminiResponse.objects.filter(fingerprint__in=list(oldest)).delete()
+
+
+class ItineraryPayloadCache:
+    """
+    Store of rendered itinerary detail responses in the ItineraryPayload table.
+
+    Payloads are built when an itinerary is generated, or on the first read after an
+    invalidation. The signals in api/signals.py invalidate them whenever an itinerary,
+    one of its activities, or a linked location or image is saved or deleted.
+    Bulk updates bypass those signals and must call invalidate themselves.
+    """
+
+    def get(self, itinerary_id : int) -> Dict[str, Any]:
+        """
+        Return the detail payload of an itinerary, building it if it is not stored.
+
+        Raises:
+            Itinerary.DoesNotExist: If the itinerary does not exist.
+        """
+        return self.get_versioned(itinerary_id)[0]
+
+    def get_versioned(self, itinerary_id : int) -> Tuple[Dict[str, Any], datetime]:
+        """
+        Return the detail payload of an itinerary with its version, building it if it is not stored.
+
+        Raises:
+            Itinerary.DoesNotExist: If the itinerary does not exist.
+        """
+        stored = ItineraryPayload.objects.filter(itinerary_id=itinerary_id).values_list('data', 'updatedAt').first()
+        if stored is None:
+            payload = self._store(Itinerary.objects.get(id=itinerary_id))
+            return payload.data, payload.updatedAt
+        return stored
+
+    def version(self, itinerary_id : int) -> Optional[datetime]:
+        """
+        Return when the stored detail payload of an itinerary was built, without loading it.
+
+        A payload is rebuilt after every change of its itinerary, so this identifies its content.
+
+        Returns:
+            datetime: The version of the payload, or None if it is not stored.
+        """
+        return ItineraryPayload.objects.filter(itinerary_id=itinerary_id).values_list('updatedAt', flat=True).first()
+
+    def rebuild(self, itinerary : Itinerary) -> Dict[str, Any]:
+        """Render the detail payload of an itinerary and store it."""
+        return self._store(itinerary).data
+
+    def _store(self, itinerary : Itinerary) -> ItineraryPayload:
+        """Render the detail payload of an itinerary and store it, returning the stored row."""
+        with span('serialization'):
+            data = ItineraryResponseSerializer(itinerary).data
+        payload, _ = ItineraryPayload.objects.update_or_create(itinerary=itinerary, defaults={'data': data})
+        return payload
+
+    def invalidate(self, itinerary_ids : Iterable[int]) -> None:
+        """Drop the stored payloads of the given itineraries."""
+        ItineraryPayload.objects.filter(itinerary_id__in=itinerary_ids).delete()
+
+    def invalidate_locations(self, location_ids : Iterable[int]) -> None:
+        """Drop the stored payloads of every itinerary visiting one of the given locations."""
+        ItineraryPayload.objects.filter(itinerary__activity__location_id__in=location_ids).delete()
+
+
+# Initialize cache instances
+place_search_cache = PlaceSearchCache(
+    settings.PLACE_SEARCH_CACHE_SIZE,
+    settings.PLACE_SEARCH_CACHE_TTL,
+    settings.PLACE_SEARCH_NEGATIVE_CACHE_TTL,
+)
+gemini_response_cache = GeminiResponseCache(
+    settings.GEMINI_CACHE_SIZE,
+    settings.GEMINI_CACHE_MAX_ENTRIES,
+    settings.GEMINI_CACHE_TTL,
+)
+
+itinerary_payload_cache = ItineraryPayloadCache()
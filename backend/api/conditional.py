@@ -0,0 +1,62 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+
+# Content codings applied by CompressionMiddleware, each tagging the ETag of the responses it compresses
+ENCODINGS = ('br', 'gzip')
+
+
+def make_etag(*version : Any) -> str:
+    """
+    Build a strong ETag from the data identifying the version of a representation.
+
+    Args:
+        *version: JSON-serializable values that change whenever the representation does,
+            like the last update of the stored data and the query parameters shaping it.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    key = json.dumps(version, default=str, separators=(',', ':'))
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def encoded_etag(etag : str, encoding : str) -> str:
+    """ETag of a representation once compressed with a content coding, distinct so that it stays strong."""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def not_modified(request : HttpRequest, etag : str) -> Optional[HttpResponse]:
+    """
+    Answer a conditional GET whose If-None-Match lists the ETag, in any of its encodings.
+
+    Views call this with the ETag of the current version before loading or serializing anything.
+
+    Returns:
+        HttpResponse: A 304 response, or None if the client does not have the current version.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in client_etags:
+        return set_etag(HttpResponseNotModified(), etag)
+    current_etags = {etag, *(encoded_etag(etag, encoding) for encoding in ENCODINGS)}
+    for client_etag in client_etags:
+        # If-None-Match uses the weak comparison
+        client_etag = client_etag.removeprefix('W/')
+        if client_etag in current_etags:
+            # The ETag of the representation the client has, compressed or not
+            return set_etag(HttpResponseNotModified(), client_etag)
+    return None
+
+
+def set_etag(response : HttpResponse, etag : str) -> HttpResponse:
+    """Add the ETag to a response of private data, that clients must revalidate before reusing it."""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,773 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.conf import settings
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import logging
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+
+from .serializers import (
+    ItinerarySerializer,
+    ImageBulkSerializer,
+    ActivityBulkSerializer,
+    LocationDetailsBulkSerializer,
+    LocationDetailsSerializer,
+    ImageSerializer,
+)
+from .models import Itinerary, LocationDetails, Image
+from .images import IMAGE_SIZES, join_image_urls
+from .services import gemini_client, trip_advisor_client, async_gemini_client, async_trip_advisor_client
+from .cache import place_search_cache, itinerary_payload_cache
+from .routing import optimize_route
+from .ratelimit import RateLimitExceeded
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .instrumentation import span, with_current_trace
+
+
+logger = logging.getLogger(__name__)
+
+# TripAdvisor lookups in flight in this process, shared by concurrent generations:
+# searches are keyed by normalized query, details and images by place_id
+searches_in_flight = SingleFlight('tripadvisor.search')
+details_in_flight = SingleFlight('tripadvisor.details')
+images_in_flight = SingleFlight('tripadvisor.images')
+async_searches_in_flight = AsyncSingleFlight('tripadvisor.search')
+async_details_in_flight = AsyncSingleFlight('tripadvisor.details')
+async_images_in_flight = AsyncSingleFlight('tripadvisor.images')
+
+
+class ItineraryGenerationError(Exception):
+    """Raised when an itinerary cannot be generated."""
+
+
+class PlaceLookups:
+    """
+    TripAdvisor lookups of the places of an itinerary, started while Gemini is still generating it.
+
+    The places of activities are searched as soon as the activities are added, and the details
+    and images of a place are requested as soon as its search is matched, in a thread pool.
+    Cached searches are answered locally, with one cache lookup per batch of added activities,
+    places already stored are not fetched again, and a lookup already in flight for a concurrent
+    generation of this process is waited for, not repeated.
+
+    Database work, matching included, happens in the thread adding activities and matching searches.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, destination: str):
+        """
+        Initialize the lookups.
+
+        Args:
+            executor: Thread pool running the TripAdvisor requests.
+            destination: The destination of the itinerary, searched with every place name.
+        """
+        self.executor = executor
+        self.destination = destination
+        # Search query of every added activity, in order
+        self.queries = []
+        # Resolved place_id by query, None when no search result matched
+        self.place_ids = {}
+        # (place_name, search future) by query, until the search is matched
+        self.searches = {}
+        self.search_count = 0
+        # (results dict, place_id) by future, for the details and images requests
+        self.fetches = {}
+        self.location_details = {}
+        self.place_images = {}
+        # place_ids whose details and images were requested, or are stored
+        self.requested_place_ids = set()
+
+    def add_many(self, place_names: List[str]) -> None:
+        """
+        Start resolving the places of a batch of activities, unless the same places are already being resolved.
+
+        The cached searches of the whole batch are looked up at once.
+        """
+        new_queries = self._add_queries(place_names)
+        if not new_queries:
+            return
+        cached = place_search_cache.get_many(new_queries)
+        for query, place_name in new_queries.items():
+            if query in cached:
+                self.place_ids[query] = cached[query]
+            else:
+                future = self.executor.submit(with_current_trace(searches_in_flight.do), query, self._search_places, place_name)
+                self.searches[query] = (place_name, future)
+                self.search_count += 1
+        self._fetch(cached.values())
+
+    def match_completed(self) -> None:
+        """Match the finished searches to their place_id, then request the details and images of their places."""
+        searched = {query: future.result() for query, (_, future) in self.searches.items() if future.done()}
+        if not searched:
+            return
+        place_names = {query: self.searches.pop(query)[0] for query in searched}
+        place_ids = self._match_searches(place_names, searched)
+        self.place_ids.update(place_ids)
+        self._fetch(place_ids.values())
+
+    def activity_place_ids(self) -> List[Optional[str]]:
+        """The place_id of every added activity, in order, once all searches are matched."""
+        return [self.place_ids[query] for query in self.queries]
+
+    def _add_queries(self, place_names: List[str]) -> Dict[str, str]:
+        """Record the search query of every activity, returning the place name of each query not resolved yet."""
+        new_queries = {}
+        for place_name in place_names:
+            query = place_search_cache.normalize(place_name, self.destination)
+            self.queries.append(query)
+            if query not in self.place_ids and query not in self.searches:
+                new_queries.setdefault(query, place_name)
+        return new_queries
+
+    def cancel(self) -> None:
+        """Cancel the requests that did not start yet."""
+        for _, future in self.searches.values():
+            future.cancel()
+        for future in self.fetches:
+            future.cancel()
+
+    def _fetch(self, place_ids: Iterable[Optional[str]]) -> None:
+        """Request the details and images of places that were not requested yet and are not stored."""
+        new_ids = {place_id for place_id in place_ids if place_id} - self.requested_place_ids
+        if not new_ids:
+            return
+        self.requested_place_ids |= new_ids
+        stored_locations, stored_images = self._stored_place_ids(new_ids)
+        for place_id in new_ids - stored_locations:
+            future = self.executor.submit(
+                with_current_trace(details_in_flight.do), place_id, trip_advisor_client.get_place_details, place_id
+            )
+            self.fetches[future] = (self.location_details, place_id)
+        for place_id in new_ids - stored_images:
+            future = self.executor.submit(
+                with_current_trace(images_in_flight.do), place_id, trip_advisor_client.get_place_images, place_id
+            )
+            self.fetches[future] = (self.place_images, place_id)
+
+    def _match_searches(
+        self,
+        place_names: Dict[str, str],
+        searches: Dict[str, Tuple[Optional[List[Dict[str, Any]]], bool]]
+    ) -> Dict[str, Optional[str]]:
+        """Pick the place_id of every searched query, and cache the searches that succeeded."""
+        # Every search result of every finished search is scored in one batch
+        matches = trip_advisor_client.match_place_names(
+            [place_names[query] for query in searches],
+            [[result['name'] for result in results or []] for results, _ in searches.values()]
+        )
+        searched_ids = {
+            query: results[match['index']]['location_id'] if match['index'] is not None else None
+            for (query, (results, _)), match in zip(searches.items(), matches)
+        }
+
+        # Failed searches are not cached, they may succeed on the next request
+        place_search_cache.set_many({
+            query: place_id for query, place_id in searched_ids.items() if searches[query][1]
+        })
+        return searched_ids
+
+    def _search_places(self, place_name: str) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+        """Search a place on TripAdvisor, returning the search results and whether the search succeeded."""
+        try:
+            return trip_advisor_client.search_places(place_name, self.destination), True
+        except (requests.RequestException, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor search request: %s", e)
+            return None, False
+
+    @staticmethod
+    def _stored_place_ids(place_ids: set) -> Tuple[set, set]:
+        """Return the place_ids whose details are stored, and those with stored images."""
+        stored_locations = {
+            str(location_id)
+            for location_id in LocationDetails.objects.filter(id__in=place_ids).values_list('id', flat=True)
+        }
+        stored_images = {
+            str(location_id)
+            for location_id in Image.objects.filter(location_id__in=place_ids).values_list('location_id', flat=True).distinct()
+        }
+        return stored_locations, stored_images
+
+
+class AsyncPlaceLookups(PlaceLookups):
+    """
+    Asyncio counterpart of PlaceLookups.
+
+    Requests are tasks on the event loop, bounded by a semaphore instead of a thread pool,
+    and a search is matched, and its place requested, as soon as it finished.
+    """
+
+    def __init__(self, limit: asyncio.Semaphore, destination: str):
+        """
+        Initialize the lookups.
+
+        Args:
+            limit: Bound on the TripAdvisor requests in flight.
+            destination: The destination of the itinerary, searched with every place name.
+        """
+        super().__init__(None, destination)
+        self.limit = limit
+
+    async def add_many(self, place_names: List[str]) -> None:
+        """Start resolving the places of a batch of activities, see PlaceLookups.add_many."""
+        new_queries = self._add_queries(place_names)
+        if not new_queries:
+            return
+        cached = await sync_to_async(place_search_cache.get_many)(new_queries)
+        for query, place_name in new_queries.items():
+            if query in cached:
+                self.place_ids[query] = cached[query]
+            else:
+                # Searches stay listed once matched, their tasks are awaited by the generator
+                self.searches[query] = (place_name, asyncio.ensure_future(self._search(query, place_name)))
+                self.search_count += 1
+        await self._fetch(cached.values())
+
+    def cancel(self) -> None:
+        """Cancel the requests in flight."""
+        for _, task in self.searches.values():
+            task.cancel()
+        for task in self.fetches:
+            task.cancel()
+
+    async def _search(self, query: str, place_name: str) -> None:
+        """Search a place, match it, then request the details and images of the matched place."""
+        async with self.limit:
+            search = await async_searches_in_flight.do(query, self._search_places, place_name)
+        place_ids = await sync_to_async(self._match_searches)({query: place_name}, {query: search})
+        self.place_ids.update(place_ids)
+        await self._fetch(place_ids.values())
+
+    async def _fetch(self, place_ids: Iterable[Optional[str]]) -> None:
+        """Request the details and images of places that were not requested yet and are not stored."""
+        new_ids = {place_id for place_id in place_ids if place_id} - self.requested_place_ids
+        if not new_ids:
+            return
+        self.requested_place_ids |= new_ids
+        stored_locations, stored_images = await sync_to_async(self._stored_place_ids)(new_ids)
+        for place_id in new_ids - stored_locations:
+            task = asyncio.ensure_future(self._limited(async_details_in_flight, async_trip_advisor_client.get_place_details, place_id))
+            self.fetches[task] = (self.location_details, place_id)
+        for place_id in new_ids - stored_images:
+            task = asyncio.ensure_future(self._limited(async_images_in_flight, async_trip_advisor_client.get_place_images, place_id))
+            self.fetches[task] = (self.place_images, place_id)
+
+    async def _limited(self, in_flight: AsyncSingleFlight, fetch_place: Callable, place_id: str) -> Any:
+        """Request a place once fewer requests than the limit are in flight, or wait for the same request in flight."""
+        async with self.limit:
+            return await in_flight.do(place_id, fetch_place, place_id)
+
+    async def _search_places(self, place_name: str) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+        """Search a place on TripAdvisor, returning the search results and whether the search succeeded."""
+        try:
+            return await async_trip_advisor_client.search_places(place_name, self.destination), True
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor search request: %s", e)
+            return None, False
+
+
+class ItineraryGenerator:
+    """
+    Pipeline generating and saving itineraries.
+
+    Terms:
+    - Itinerary: Represents the overall trip plan, which includes multiple activities..
+    - Activity: A single activity in the itinerary, like visiting a place at a specific time.
+    - Location: A place visited during the trip.
+    - Image: Photo of a location.
+
+    Events, reported through the on_event callback for streaming clients:
+    - plan: The activities generated by Gemini, before any TripAdvisor lookup.
+    - activity: An activity of the plan, by index, with its place details and images,
+      as soon as its place is resolved.
+
+    Stages, reported through the on_progress callback:
+    - planning: The itinerary is generated by Gemini. Its answer is streamed, and the
+      TripAdvisor lookups of the activities start as soon as they are parsed, see PlaceLookups.
+    - searching: Activities are matched to TripAdvisor places.
+    - fetching: Details and images of new places are fetched from TripAdvisor.
+    - saving: Activities are regrouped and ordered along short routes, then the itinerary
+      is written to the database.
+
+    Network calls happen outside of any database transaction; only the final writes are atomic.
+    Every stage is timed as a generation.<stage> span of the current trace.
+    """
+
+    def __init__(
+        self,
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None
+    ):
+        """
+        Initialize the generator.
+
+        Args:
+            on_progress: Called with (stage, completed, total) as the generation advances.
+            on_event: Called with (event, data) as parts of the itinerary become available.
+                Without it, the stored places are not serialized for events.
+        """
+        self.on_progress = on_progress or (lambda stage, completed, total: None)
+        self.on_event = on_event
+
+    def generate(self, user: User, itinerary_params: Dict[str, Any]) -> Itinerary:
+        """
+        Generate and save an itinerary.
+
+        Args:
+            user: The owner of the itinerary.
+            itinerary_params: Validated ItineraryRequestSerializer data.
+
+        Returns:
+            Itinerary: The saved itinerary.
+
+        Raises:
+            ItineraryGenerationError: If Gemini could not generate the itinerary.
+        """
+        lookups, activities, place_ids = self._resolve(itinerary_params)
+
+        self.on_progress('saving', 0, 1)
+        with span('generation.saving'):
+            itinerary = self._save(user, itinerary_params, activities, place_ids, lookups.location_details, lookups.place_images)
+        self.on_progress('saving', 1, 1)
+        return itinerary
+
+    def warm(self, itinerary_params: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Generate an itinerary without saving it, so that the next generations of the same plan run on local data.
+
+        The Gemini answer and the place searches are cached as for any generation, and the details
+        and images of new places are stored. Places whose details could not be fetched are left
+        for a later generation to retry.
+
+        Args:
+            itinerary_params: The destination, num_of_days, must_includes and use_cache of the plan.
+
+        Returns:
+            dict: Number of activities, of places they visit, of TripAdvisor searches and of place requests.
+
+        Raises:
+            ItineraryGenerationError: If Gemini could not generate the itinerary.
+        """
+        lookups, activities, place_ids = self._resolve(itinerary_params)
+        location_details = {place_id: details for place_id, details in lookups.location_details.items() if details}
+        place_images = {
+            place_id: images for place_id, images in lookups.place_images.items()
+            if place_id in location_details or place_id not in lookups.location_details
+        }
+
+        self.on_progress('saving', 0, 1)
+        with span('generation.saving'), transaction.atomic():
+            self._store_places(location_details, place_images)
+        self.on_progress('saving', 1, 1)
+        return {
+            'activities': len(activities),
+            'places': len({place_id for place_id in place_ids if place_id}),
+            'searches': lookups.search_count,
+            'requests': len(lookups.fetches),
+        }
+
+    def _resolve(self, itinerary_params: Dict[str, Any]) -> Tuple[PlaceLookups, List[Dict[str, Any]], List[Optional[str]]]:
+        """
+        Run the planning, searching and fetching stages.
+
+        Returns:
+            tuple: The finished lookups, holding the fetched places, the activities and the place_id of every activity.
+
+        Raises:
+            ItineraryGenerationError: If Gemini could not generate the itinerary.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, settings.TRIPADVISOR_MAX_WORKERS)) as executor:
+            lookups = PlaceLookups(executor, itinerary_params['destination'])
+            self.on_progress('planning', 0, 1)
+            with span('generation.planning'):
+                activities = self._plan(itinerary_params, lookups)
+            self.on_progress('planning', 1, 1)
+
+            self._emit('plan', {'activities': activities})
+            with span('generation.searching'):
+                place_ids = self._resolve_place_ids(lookups)
+            with span('generation.fetching'):
+                self._resolve_place_data(lookups, activities, place_ids)
+        return lookups, activities, place_ids
+
+    def _plan(self, itinerary_params: Dict[str, Any], lookups: PlaceLookups) -> List[Dict[str, Any]]:
+        """
+        Stream the activities generated by Gemini, starting the lookups of each batch as soon as it is parsed.
+
+        Raises:
+            ItineraryGenerationError: If Gemini could not generate the itinerary.
+        """
+        activities = []
+        try:
+            for batch in gemini_client.stream_activity_batches(
+                itinerary_params['destination'],
+                itinerary_params['num_of_days'],
+                itinerary_params['must_includes'],
+                use_cache=itinerary_params.get('use_cache', True)
+            ):
+                activities.extend(batch)
+                lookups.add_many([activity['place_name'] for activity in batch])
+                lookups.match_completed()
+        except (requests.RequestException, RateLimitExceeded, ValueError) as e:
+            logger.warning("Error in Gemini API request: %s", e)
+            activities = []
+        if not activities:
+            lookups.cancel()
+            raise ItineraryGenerationError("Failed to generate itinerary")
+        return activities
+
+    def _save(
+        self,
+        user: User,
+        itinerary_params: Dict[str, Any],
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]],
+        location_details: Dict[str, Any],
+        place_images: Dict[str, Any]
+    ) -> Itinerary:
+        """Save the itinerary with its resolved activities at once, then store its detail payload."""
+        with transaction.atomic():
+            itinerary = self._create_itinerary(user, itinerary_params)
+            self._process_activities(itinerary, activities, place_ids, location_details, place_images)
+        itinerary_payload_cache.rebuild(itinerary)
+        return itinerary
+
+    def _create_itinerary(self, user: User, itinerary_params: Dict[str, Any]) -> Itinerary:
+        """Create and save a new Itinerary instance."""
+        itinerary_data = {
+            'user': user.id,
+            'start_date': itinerary_params['start_date'],
+            'end_date': itinerary_params['end_date'],
+            'total_days': itinerary_params['num_of_days'],
+            'destination': itinerary_params['destination'],
+            'image_url': None,
+            'name': (
+                itinerary_params['destination'].split(',')[0] +
+                ' Itinerary for ' +
+                str(itinerary_params['num_of_days']) +
+                ' days'
+            )
+        }
+        serializer = ItinerarySerializer(data=itinerary_data)
+        if serializer.is_valid():
+            return serializer.save()
+        else:
+            raise Exception(serializer.errors)
+
+    def _process_activities(
+        self,
+        itinerary: Itinerary,
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]],
+        location_details: Dict[str, Any],
+        place_images: Dict[str, Any]
+    ) -> None:
+        """
+        Save the resolved activities, their new locations and images.
+
+        Each kind of row is validated as one batch and written with a single bulk INSERT.
+        """
+        self._check_location_details(location_details)
+        self._store_places(location_details, place_images)
+
+        resolved = [(activity, place_id) for activity, place_id in zip(activities, place_ids) if place_id]
+        route = self._optimize_route(resolved)
+        self._bulk_create(ActivityBulkSerializer, [
+            self._activity_data(itinerary, activity, place_id, stop)
+            for (activity, place_id), stop in zip(resolved, route)
+        ])
+
+        itinerary.image_url = self._cover_image_url(place_ids)
+        if itinerary.image_url:
+            itinerary.save(update_fields=['image_url', 'updatedAt'])
+
+    def _store_places(self, location_details: Dict[str, Any], place_images: Dict[str, Any]) -> None:
+        """Save the fetched details and images of new places, each kind with a single bulk INSERT."""
+        self._bulk_create(LocationDetailsBulkSerializer, [details for details in location_details.values() if details])
+
+        new_images = self._unstored_images([image for images in place_images.values() if images for image in images])
+        self._bulk_create(ImageBulkSerializer, new_images)
+        # Earlier itineraries visiting these places were rendered without their images
+        itinerary_payload_cache.invalidate_locations({int(image['location']) for image in new_images})
+
+    def _resolve_place_ids(self, lookups: PlaceLookups) -> List[Optional[str]]:
+        """Wait for the searches still running once the plan is complete, and return the place_id of every activity."""
+        total = lookups.search_count
+        self.on_progress('searching', total - len(lookups.searches), total)
+        for _ in as_completed([future for _, future in lookups.searches.values()]):
+            lookups.match_completed()
+            self.on_progress('searching', total - len(lookups.searches), total)
+        return lookups.activity_place_ids()
+
+    def _resolve_place_data(
+        self,
+        lookups: PlaceLookups,
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Wait for the details and images of the places that were not stored yet.
+
+        An activity event is emitted for each activity once its place is complete.
+
+        Returns:
+            tuple: Place details and place images, both keyed by place_id.
+        """
+        stored_places, pending_requests = self._pending_places(lookups, activities, place_ids)
+        total = len(lookups.fetches)
+        self.on_progress('fetching', 0, total)
+        for completed, future in enumerate(as_completed(lookups.fetches), 1):
+            fetched, place_id = lookups.fetches[future]
+            fetched[place_id] = future.result()
+            self.on_progress('fetching', completed, total)
+            pending_requests[place_id] -= 1
+            if pending_requests[place_id] == 0:
+                self._emit_activities(activities, place_ids, place_id, stored_places, lookups.location_details, lookups.place_images)
+        return lookups.location_details, lookups.place_images
+
+    def _pending_places(
+        self,
+        lookups: PlaceLookups,
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]]
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int]]:
+        """
+        Count the requests each place is waiting for, emitting the activities of the places waiting for none.
+
+        Returns:
+            tuple: The stored places, serialized for events, and the number of pending requests by place_id.
+        """
+        unique_ids = {place_id for place_id in place_ids if place_id}
+        stored_places = self._stored_places(unique_ids) if self.on_event else {}
+        pending_requests = {place_id: 0 for place_id in unique_ids}
+        for _, place_id in lookups.fetches.values():
+            pending_requests[place_id] += 1
+        for place_id, count in pending_requests.items():
+            if count == 0:
+                self._emit_activities(activities, place_ids, place_id, stored_places, {}, {})
+        return stored_places, pending_requests
+
+    def _stored_places(self, place_ids: set) -> Dict[str, Dict[str, Any]]:
+        """Serialize the stored details and images of places, keyed by place_id."""
+        return {
+            str(location.id): {
+                'place_details': LocationDetailsSerializer(location).data,
+                'place_images': ImageSerializer(location.image_set.all(), many=True).data,
+            }
+            for location in LocationDetails.objects.filter(id__in=place_ids).prefetch_related('image_set')
+        }
+
+    def _emit_activities(
+        self,
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]],
+        place_id: str,
+        stored_places: Dict[str, Dict[str, Any]],
+        location_details: Dict[str, Any],
+        place_images: Dict[str, Any]
+    ) -> None:
+        """Emit an activity event for every activity visiting a place whose details and images are resolved."""
+        if not self.on_event:
+            return
+        stored = stored_places.get(place_id, {})
+        details = location_details.get(place_id)
+        images = place_images.get(place_id)
+        place = {
+            'place_details': (
+                LocationDetailsSerializer(LocationDetails(**{
+                    field: details.get(field) for field in LocationDetailsSerializer.Meta.fields
+                })).data if details else stored.get('place_details')
+            ),
+            'place_images': (
+                [{'location': int(place_id), **{size: image.get(size) for size in IMAGE_SIZES}} for image in images]
+                if images else stored.get('place_images', [])
+            ),
+        }
+        for index, (activity, activity_place_id) in enumerate(zip(activities, place_ids)):
+            if activity_place_id == place_id:
+                self._emit('activity', {'index': index, **activity, **place})
+
+    def _emit(self, event: str, data: Dict[str, Any]) -> None:
+        """Report an event to the on_event callback, if any."""
+        if self.on_event:
+            self.on_event(event, data)
+
+    def _check_location_details(self, location_details: Dict[str, Any]) -> None:
+        """Raise if the details of a place could not be fetched and it is not stored either."""
+        failed_ids = {place_id for place_id, details in location_details.items() if not details}
+        if failed_ids:
+            failed_ids -= {
+                str(location_id)
+                for location_id in LocationDetails.objects.filter(id__in=failed_ids).values_list('id', flat=True)
+            }
+        if failed_ids:
+            raise Exception(f"Could not fetch details for place_id: {failed_ids.pop()}")
+
+    def _unstored_images(self, new_images: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Leave out the images of places whose images were stored by a concurrent generation.
+
+        The locations are locked until the end of the transaction, so that of two generations
+        fetching the same place, the second waits for the first to commit and then skips its images.
+        """
+        location_ids = {int(image['location']) for image in new_images}
+        if not location_ids:
+            return new_images
+        list(LocationDetails.objects.select_for_update().filter(id__in=location_ids).values_list('id', flat=True))
+        stored = set(Image.objects.filter(location_id__in=location_ids).values_list('location_id', flat=True).distinct())
+        return [image for image in new_images if int(image['location']) not in stored]
+
+    def _optimize_route(self, resolved: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        """Regroup and order the resolved activities by the coordinates of their stored locations."""
+        coordinates = {
+            str(location_id): (latitude, longitude)
+            for location_id, latitude, longitude in LocationDetails.objects.filter(
+                id__in={place_id for _, place_id in resolved}
+            ).values_list('id', 'latitude', 'longitude')
+        }
+        return optimize_route([
+            {
+                'day': activity['day_number'],
+                'time_of_day': activity['time_of_day'],
+                'latitude': coordinates.get(place_id, (None, None))[0],
+                'longitude': coordinates.get(place_id, (None, None))[1],
+            }
+            for activity, place_id in resolved
+        ])
+
+    def _activity_data(self, itinerary: Itinerary, activity_data: Dict[str, Any], place_id: str, stop: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the ActivitySerializer data of a generated activity at its optimized stop."""
+        return {
+            'name': activity_data['place_name'],
+            'itinerary': itinerary.id,
+            'description': activity_data['description'],
+            'location': int(place_id),
+            'duration': activity_data['duration'],
+            'day': stop['day'],
+            'time_of_day': activity_data['time_of_day'],
+            'position': stop['position'],
+            'travel_distance_km': stop['travel_distance_km']
+        }
+
+    def _bulk_create(self, serializer_class: type, data: List[Dict[str, Any]]) -> List[Any]:
+        """Validate the rows as one batch and insert them with a single query."""
+        if not data:
+            return []
+        serializer = serializer_class(data=data, many=True)
+        if serializer.is_valid():
+            return serializer.save()
+        else:
+            raise Exception(serializer.errors)
+
+    def _cover_image_url(self, place_ids: List[Optional[str]]) -> Optional[str]:
+        """Pick the original size of the first image of the first activity that has one."""
+        first_images = {}
+        for location_id, url_prefix, url_suffix, variants in (
+            Image.objects.filter(location_id__in={place_id for place_id in place_ids if place_id})
+            .order_by('id')
+            .values_list('location_id', 'url_prefix', 'url_suffix', 'variants')
+        ):
+            first_images.setdefault(str(location_id), join_image_urls(url_prefix, url_suffix, variants)['original'])
+
+        for place_id in place_ids:
+            if first_images.get(place_id):
+                return first_images[place_id]
+        return None
+
+
+class AsyncItineraryGenerator(ItineraryGenerator):
+    """
+    Asyncio counterpart of ItineraryGenerator, for async views.
+
+    Upstream calls are made concurrently on the event loop with the async clients instead
+    of a thread pool; database work still runs in threads through sync_to_async. The
+    on_progress and on_event callbacks are called from the event loop and must not block.
+    """
+
+    async def agenerate(self, user: User, itinerary_params: Dict[str, Any]) -> Itinerary:
+        """
+        Generate and save an itinerary, see ItineraryGenerator.generate.
+
+        Raises:
+            ItineraryGenerationError: If Gemini could not generate the itinerary.
+        """
+        # Same bound on concurrent TripAdvisor calls per itinerary as the thread pool
+        lookups = AsyncPlaceLookups(asyncio.Semaphore(max(1, settings.TRIPADVISOR_MAX_WORKERS)), itinerary_params['destination'])
+        try:
+            self.on_progress('planning', 0, 1)
+            with span('generation.planning'):
+                activities = await self._aplan(itinerary_params, lookups)
+            self.on_progress('planning', 1, 1)
+
+            self._emit('plan', {'activities': activities})
+            with span('generation.searching'):
+                place_ids = await self._aresolve_place_ids(lookups)
+            with span('generation.fetching'):
+                location_details, place_images = await self._aresolve_place_data(lookups, activities, place_ids)
+        except BaseException:
+            lookups.cancel()
+            raise
+
+        self.on_progress('saving', 0, 1)
+        with span('generation.saving'):
+            itinerary = await sync_to_async(self._save)(
+                user, itinerary_params, activities, place_ids, location_details, place_images
+            )
+        self.on_progress('saving', 1, 1)
+        return itinerary
+
+    async def _aplan(self, itinerary_params: Dict[str, Any], lookups: AsyncPlaceLookups) -> List[Dict[str, Any]]:
+        """Stream the activities generated by Gemini, see ItineraryGenerator._plan."""
+        activities = []
+        try:
+            async for batch in async_gemini_client.stream_activity_batches(
+                itinerary_params['destination'],
+                itinerary_params['num_of_days'],
+                itinerary_params['must_includes'],
+                use_cache=itinerary_params.get('use_cache', True)
+            ):
+                activities.extend(batch)
+                await lookups.add_many([activity['place_name'] for activity in batch])
+        except (httpx.HTTPError, RateLimitExceeded, ValueError) as e:
+            logger.warning("Error in Gemini API request: %s", e)
+            activities = []
+        if not activities:
+            raise ItineraryGenerationError("Failed to generate itinerary")
+        return activities
+
+    async def _aresolve_place_ids(self, lookups: AsyncPlaceLookups) -> List[Optional[str]]:
+        """Wait for the searches still running once the plan is complete, see ItineraryGenerator._resolve_place_ids."""
+        tasks = [task for _, task in lookups.searches.values()]
+        self.on_progress('searching', 0, len(tasks))
+        for completed, task in enumerate(asyncio.as_completed(tasks), 1):
+            await task
+            self.on_progress('searching', completed, len(tasks))
+        return lookups.activity_place_ids()
+
+    async def _aresolve_place_data(
+        self,
+        lookups: AsyncPlaceLookups,
+        activities: List[Dict[str, Any]],
+        place_ids: List[Optional[str]]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Wait for the details and images of the places that were not stored yet, see ItineraryGenerator._resolve_place_data."""
+        stored_places, pending_requests = await sync_to_async(self._pending_places)(lookups, activities, place_ids)
+        total = len(lookups.fetches)
+        self.on_progress('fetching', 0, total)
+        completed = 0
+
+        async def collect(task: asyncio.Task) -> None:
+            nonlocal completed
+            fetched, place_id = lookups.fetches[task]
+            fetched[place_id] = await task
+            completed += 1
+            self.on_progress('fetching', completed, total)
+            pending_requests[place_id] -= 1
+            if pending_requests[place_id] == 0:
+                self._emit_activities(activities, place_ids, place_id, stored_places, lookups.location_details, lookups.place_images)
+
+        await asyncio.gather(*(collect(task) for task in lookups.fetches))
+        return lookups.location_details, lookups.place_images
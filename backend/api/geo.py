@@ -0,0 +1,68 @@
+import math
+from typing import List, Tuple
+
+from .models import LocationDetails
+
+
+# Mean Earth radius in kilometres
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(latitude1 : float, longitude1 : float, latitude2 : float, longitude2 : float) -> float:
+    """Great-circle distance in kilometres between two points given in degrees."""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude : float, longitude : float, radius_km : float) -> Tuple[float, float, float, float]:
+    """
+    Compute the latitude/longitude box enclosing a circle.
+
+    Returns:
+        tuple: (min_latitude, max_latitude, min_longitude, max_longitude). The longitudes are
+            not normalized, min_longitude < -180 or max_longitude > 180 when the circle crosses
+            the antimeridian, and the box spans every longitude when it contains a pole.
+    """
+    d_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_latitude, max_latitude = latitude - d_latitude, latitude + d_latitude
+    if min_latitude <= -90 or max_latitude >= 90:
+        return max(min_latitude, -90), min(max_latitude, 90), -180.0, 180.0
+    d_longitude = math.degrees(math.asin(math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))))
+    return min_latitude, max_latitude, longitude - d_longitude, longitude + d_longitude
+
+
+def nearby_locations(latitude : float, longitude : float, radius_km : float, limit : int) -> List[LocationDetails]:
+    """
+    Find the stored locations within a radius of a point, closest first.
+
+    Candidates are selected by bounding box through location_lat_lng_idx, then filtered
+    and ordered by their exact great-circle distance, set as distance_km on each location.
+
+    Args:
+        latitude (float): Latitude of the point in degrees.
+        longitude (float): Longitude of the point in degrees.
+        radius_km (float): Search radius in kilometres.
+        limit (int): Maximum number of locations returned.
+
+    Returns:
+        list: The nearby locations.
+    """
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_km)
+    candidates = LocationDetails.objects.filter(latitude__range=(min_latitude, max_latitude))
+    if min_longitude < -180:
+        candidates = candidates.filter(longitude__gte=min_longitude + 360) | candidates.filter(longitude__lte=max_longitude)
+    elif max_longitude > 180:
+        candidates = candidates.filter(longitude__gte=min_longitude) | candidates.filter(longitude__lte=max_longitude - 360)
+    else:
+        candidates = candidates.filter(longitude__range=(min_longitude, max_longitude))
+
+    locations = []
+    for location in candidates:
+        location.distance_km = haversine_km(latitude, longitude, location.latitude, location.longitude)
+        if location.distance_km <= radius_km:
+            locations.append(location)
+    locations.sort(key=lambda location: location.distance_km)
+    return locations[:limit]
@@ -0,0 +1,105 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from django.http import QueryDict
+
+
+# Sizes of every image, smallest first
+IMAGE_SIZES = ['thumbnail', 'small', 'medium', 'large', 'original']
+
+
+def split_image_urls(urls : Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """
+    Split the URLs of the sizes of an image into the parts they share and the segment of each size.
+
+    The sizes of a TripAdvisor photo only differ by one path segment, like photo-t and photo-o,
+    so an image is stored as the common prefix and suffix of its URLs plus a short variant by size.
+
+    Args:
+        urls (dict): URL by size, missing or None for the sizes the image does not have.
+
+    Returns:
+        dict: The url_prefix, url_suffix and variants fields of an Image.
+    """
+    present = [url for url in (urls.get(size) for size in IMAGE_SIZES) if url]
+    prefix = os.path.commonprefix(present) if present else ''
+    # The suffix is searched after the prefix only, so that both never overlap
+    suffix = os.path.commonprefix([url[len(prefix):][::-1] for url in present])[::-1] if present else ''
+    return {
+        'url_prefix': prefix,
+        'url_suffix': suffix,
+        'variants': [
+            urls[size][len(prefix):len(urls[size]) - len(suffix)] if urls.get(size) else None
+            for size in IMAGE_SIZES
+        ],
+    }
+
+
+def join_image_urls(url_prefix : str, url_suffix : str, variants : List[Optional[str]]) -> Dict[str, Optional[str]]:
+    """Rebuild the URL of every size of an image from its stored parts, None for the sizes it does not have."""
+    return {
+        size: url_prefix + variant + url_suffix if variant is not None else None
+        for size, variant in zip(IMAGE_SIZES, variants or [None] * len(IMAGE_SIZES))
+    }
+
+
+class ImageSelection:
+    """
+    Sizes and number of images by place that a client wants in an itinerary response.
+
+    Itinerary payloads are stored with every size of every image; a selection trims a copy
+    of them, so that clients showing one size or a few photos do not download the others.
+    """
+
+    def __init__(self, sizes : Optional[List[str]] = None, max_images : Optional[int] = None):
+        """
+        Initialize the selection.
+
+        Args:
+            sizes (list): Sizes to include, all of them if None.
+            max_images (int): Maximum number of images by place, all of them if None.
+        """
+        self.sizes = sizes
+        self.max_images = max_images
+
+    @classmethod
+    def from_query(cls, query : QueryDict) -> 'ImageSelection':
+        """
+        Parse the image_sizes (comma-separated sizes) and max_images parameters of a request.
+
+        Raises:
+            ValueError: If a size is unknown or max_images is not a non-negative integer.
+        """
+        sizes = query.get('image_sizes')
+        if sizes is not None:
+            sizes = [size.strip() for size in sizes.split(',') if size.strip()]
+            unknown = set(sizes) - set(IMAGE_SIZES)
+            if unknown:
+                raise ValueError(f"Unknown image size {sorted(unknown)[0]!r}, expected one of {', '.join(IMAGE_SIZES)}")
+
+        max_images = query.get('max_images')
+        if max_images is not None:
+            max_images = int(max_images)
+            if max_images < 0:
+                raise ValueError("Maximum number of images must not be negative")
+        return cls(sizes, max_images)
+
+    def apply(self, itinerary : Dict[str, Any]) -> Dict[str, Any]:
+        """Return the detail payload of an itinerary with the selected images only, leaving the payload untouched."""
+        if self.sizes is None and self.max_images is None:
+            return itinerary
+        return {
+            **itinerary,
+            'activities': {
+                day: [{**activity, 'place_images': self._select(activity['place_images'])} for activity in activities]
+                for day, activities in itinerary['activities'].items()
+            },
+        }
+
+    def _select(self, images : List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep the selected sizes of the first images of a place."""
+        if self.max_images is not None:
+            images = images[:self.max_images]
+        if self.sizes is not None:
+            images = [{'location': image['location'], **{size: image.get(size) for size in self.sizes}} for image in images]
+        return images
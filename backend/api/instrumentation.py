@@ -0,0 +1,349 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-process counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Every process keeps its own registry: the web server exposes it on the metrics
+    endpoint and the process_itinerary_jobs worker on its --metrics-port.
+    """
+
+    def __init__(self, buckets : Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initialize the registry.
+
+        Args:
+            buckets (tuple): Upper bounds in seconds of the histogram buckets.
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def describe(self, name : str, help_text : str) -> None:
+        """Set the HELP line of a metric."""
+        self._help[name] = help_text
+
+    def increment(self, name : str, labels : Dict[str, str], amount : float = 1.0) -> None:
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def set(self, name : str, labels : Dict[str, str], value : float) -> None:
+        """Set a gauge to its current value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = float(value)
+
+    def observe(self, name : str, labels : Dict[str, str], value : float) -> None:
+        """Record a value, in seconds, in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][bisect_left(self.buckets, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition, one sample per line.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()}
+
+        lines = []
+        for kind, samples in (('counter', counters), ('gauge', gauges), ('histogram', histograms)):
+            for name in sorted({name for name, _ in samples}):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (sample_name, labels), value in sorted(samples.items()):
+                    if sample_name != name:
+                        continue
+                    if kind != 'histogram':
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), value['buckets']):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {value['sum']}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels : Tuple[Tuple[str, str], ...]) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Trace:
+    """
+    Timing spans of one unit of work, such as an HTTP request or an itinerary job.
+
+    Spans are aggregated by name into a count and a total duration, so that repeated
+    calls, like the TripAdvisor requests of an itinerary or its ORM queries, add up.
+    """
+
+    def __init__(self, name : str):
+        """
+        Initialize the trace.
+
+        Args:
+            name (str): What is being traced, e.g. http or itinerary_job.
+        """
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.fields = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name : str, seconds : float) -> None:
+        """Add one occurrence of a span."""
+        with self._lock:
+            count, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (count + 1, total + seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the trace.
+
+        Returns:
+            dict: The total duration in milliseconds, and the count and duration in
+                milliseconds of every span.
+        """
+        with self._lock:
+            spans = dict(self.spans)
+        duration = self.duration if self.duration is not None else time.perf_counter() - self.started
+        return {
+            'duration_ms': round(duration * 1000, 3),
+            'spans': {
+                name: {'count': count, 'duration_ms': round(total * 1000, 3)}
+                for name, (count, total) in sorted(spans.items())
+            },
+        }
+
+    def server_timing(self) -> str:
+        """
+        Format the spans as a Server-Timing header value.
+
+        Returns:
+            str: One metric per span, with its count as description, then the total.
+        """
+        summary = self.summary()
+        timings = [
+            f'{name};dur={span["duration_ms"]};desc="{span["count"]}"'
+            for name, span in summary['spans'].items()
+        ]
+        timings.append(f'total;dur={summary["duration_ms"]}')
+        return ", ".join(timings)
+
+
+# Process-wide metrics and the trace of the work running in the current context
+metrics = MetricsRegistry()
+metrics.describe('planmyitinerary_span_seconds', "Duration of instrumented stages, upstream calls and ORM queries.")
+metrics.describe('planmyitinerary_trace_seconds', "Duration of HTTP requests and itinerary jobs.")
+metrics.describe('planmyitinerary_http_request_seconds', "Duration of HTTP requests by view, method and status.")
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Return the trace of the current context, if any."""
+    return _current_trace.get()
+
+
+class SpanTimer:
+    """Running span, whose paused blocks are left out of its duration."""
+
+    def __init__(self):
+        """Initialize the timer of a span that has just started."""
+        self.paused_seconds = 0.0
+        self.raised_while_paused = False
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """
+        Leave a block out of the span, such as the caller consuming what a generator yielded.
+
+        An exception raised by the block is not counted as an error of the span.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.raised_while_paused = True
+            raise
+        finally:
+            self.paused_seconds += time.perf_counter() - start
+
+
+@contextmanager
+def span(name : str) -> Iterator[SpanTimer]:
+    """
+    Time a block as a span of the current trace, and in the span metrics.
+
+    The outcome label of the metric is error when the block raises.
+
+    Args:
+        name (str): Name of the span, e.g. gemini.generate or db.
+
+    Yields:
+        SpanTimer: Timer of the span, to pause it around the parts of the block that are not part of the stage.
+    """
+    outcome = 'ok'
+    timer = SpanTimer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    except BaseException:
+        if not timer.raised_while_paused:
+            outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start - timer.paused_seconds
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, elapsed)
+        metrics.observe('planmyitinerary_span_seconds', {'span': name, 'outcome': outcome}, elapsed)
+
+
+@contextmanager
+def trace(name : str, **fields : Any) -> Iterator[Trace]:
+    """
+    Start a new trace for the current context, and log its summary once the block is done.
+
+    Args:
+        name (str): What is being traced, e.g. http or itinerary_job.
+        **fields: Fields identifying the work, logged with the summary. Fields added to the
+            fields of the yielded trace during the block are logged as well.
+
+    Yields:
+        Trace: The new trace.
+    """
+    new_trace = Trace(name)
+    new_trace.fields.update(fields)
+    token = _current_trace.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        _current_trace.reset(token)
+        new_trace.duration = time.perf_counter() - new_trace.started
+        metrics.observe('planmyitinerary_trace_seconds', {'trace': name}, new_trace.duration)
+        logger.info(name, extra={'trace': new_trace.summary(), **new_trace.fields})
+
+
+def with_current_trace(fn : Callable) -> Callable:
+    """
+    Bind a function to the trace of the current context.
+
+    Thread pools do not inherit context variables, so functions submitted to them are
+    wrapped with this to record their spans in the trace of the submitting request.
+    """
+    bound_trace = _current_trace.get()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        token = _current_trace.set(bound_trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+
+    return run
+
+
+def serve_metrics(port : int, registry : MetricsRegistry = metrics) -> ThreadingHTTPServer:
+    """
+    Expose a registry on its own port from a background thread, for processes without a web server.
+
+    Args:
+        port (int): Port to listen on, on all interfaces.
+        registry (MetricsRegistry): The metrics to expose.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def time_query(execute : Callable, sql : str, params : Any, many : bool, context : Dict[str, Any]) -> Any:
+    """Database execute wrapper recording every ORM query as a db span."""
+    with span('db'):
+        return execute(sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs) -> None:
+    """connection_created receiver adding time_query to the execute wrappers of a new connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, with the extra fields of the record."""
+
+    # Attributes every LogRecord has, anything else was passed as extra
+    RESERVED_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record : logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({
+            key: value for key, value in vars(record).items()
+            if key not in self.RESERVED_ATTRIBUTES
+        })
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
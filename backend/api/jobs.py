@@ -0,0 +1,159 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .generation import ItineraryGenerator
+from .models import ItineraryJob
+from .instrumentation import trace
+
+
+logger = logging.getLogger(__name__)
+
+
+class ItineraryJobQueue:
+    """Database-backed queue of itinerary generation jobs, drained by the process_itinerary_jobs command."""
+
+    def __init__(self, stale_timeout : float, max_attempts : int):
+        """
+        Initialize the queue.
+
+        Args:
+            stale_timeout (float): Seconds without a heartbeat after which a running job is considered abandoned.
+            max_attempts (int): Maximum number of times a job is started before it is marked as failed.
+        """
+        self.stale_timeout = stale_timeout
+        self.max_attempts = max_attempts
+        # Running jobs beat several times per stale timeout, so a late beat does not get them requeued
+        self.heartbeat_interval = stale_timeout / 3
+
+    def enqueue(self, user : User, itinerary_params : Dict[str, Any]) -> ItineraryJob:
+        """
+        Queue the generation of an itinerary.
+
+        Args:
+            user (User): The owner of the itinerary.
+            itinerary_params (dict): ItineraryRequestSerializer data, in its JSON representation.
+
+        Returns:
+            ItineraryJob: The pending job.
+        """
+        return ItineraryJob.objects.create(user=user, params=itinerary_params)
+
+    def claim(self) -> Optional[ItineraryJob]:
+        """
+        Mark the oldest pending job as running and return it.
+
+        Rows locked by other workers are skipped, so several workers can drain the queue at once.
+
+        Returns:
+            ItineraryJob: The claimed job, or None if the queue is empty.
+        """
+        with transaction.atomic():
+            job = (
+                ItineraryJob.objects.select_for_update(skip_locked=True)
+                .filter(status=ItineraryJob.PENDING)
+                .order_by('createdAt')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = ItineraryJob.RUNNING
+            job.attempts += 1
+            job.save(update_fields=['status', 'attempts', 'updatedAt'])
+            return job
+
+    def requeue_stale(self) -> int:
+        """
+        Return abandoned running jobs to the queue, or fail them once they ran out of attempts.
+
+        Returns:
+            int: Number of stale jobs found.
+        """
+        stale_jobs = ItineraryJob.objects.filter(
+            status=ItineraryJob.RUNNING,
+            updatedAt__lt=timezone.now() - timedelta(seconds=self.stale_timeout),
+        )
+        failed = stale_jobs.filter(attempts__gte=self.max_attempts).update(
+            status=ItineraryJob.FAILED,
+            error="Itinerary generation did not complete",
+            updatedAt=timezone.now(),
+        )
+        requeued = stale_jobs.update(status=ItineraryJob.PENDING, updatedAt=timezone.now())
+        return failed + requeued
+
+    @contextmanager
+    def heartbeat(self, job : ItineraryJob):
+        """
+        Keep a claimed job from being considered stale while the block runs, however long its stages take.
+
+        A background thread refreshes the updatedAt of the job every heartbeat_interval seconds, as long as it is
+        still the running attempt claimed by this worker.
+
+        Args:
+            job (ItineraryJob): A running job.
+        """
+        stopped = threading.Event()
+
+        def beat() -> None:
+            try:
+                while not stopped.wait(self.heartbeat_interval):
+                    ItineraryJob.objects.filter(
+                        pk=job.pk,
+                        status=ItineraryJob.RUNNING,
+                        attempts=job.attempts,
+                    ).update(updatedAt=timezone.now())
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=beat, name=f"itinerary-job-heartbeat-{job.pk}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def run(self, job : ItineraryJob) -> ItineraryJob:
+        """
+        Generate the itinerary of a claimed job, recording its progress and outcome.
+
+        The job sends heartbeats while it runs, and is traced: its stage, upstream call and query timings are logged once it finished.
+
+        Args:
+            job (ItineraryJob): A running job.
+
+        Returns:
+            ItineraryJob: The finished job.
+        """
+        def on_progress(stage : str, completed : int, total : int) -> None:
+            ItineraryJob.objects.filter(pk=job.pk).update(
+                stage=stage,
+                progress_completed=completed,
+                progress_total=total,
+                updatedAt=timezone.now(),
+            )
+
+        with self.heartbeat(job), trace('itinerary_job', job_id=str(job.pk), attempt=job.attempts) as job_trace:
+            try:
+                job.itinerary = ItineraryGenerator(on_progress=on_progress).generate(job.user, job.params)
+                job.status = ItineraryJob.SUCCEEDED
+            except Exception as e:
+                logger.exception("Itinerary job %s failed", job.pk)
+                job.status = ItineraryJob.FAILED
+                job.error = str(e)
+            job_trace.fields.update(status=job.status, itinerary_id=job.itinerary_id)
+
+        job.refresh_from_db(fields=['stage', 'progress_completed', 'progress_total'])
+        job.save(update_fields=['itinerary', 'status', 'error', 'updatedAt'])
+        return job
+
+
+# Initialize queue instance
+itinerary_job_queue = ItineraryJobQueue(settings.ITINERARY_JOB_STALE_TIMEOUT, settings.ITINERARY_JOB_MAX_ATTEMPTS)
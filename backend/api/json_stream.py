@@ -0,0 +1,139 @@
+import json
+import re
+from typing import Any, Dict, List
+
+
+# Characters changing the structure of a JSON document, outside of strings
+STRUCTURAL_CHARACTERS = re.compile(r'["{}\[\]]')
+# Characters ending or escaping inside of a JSON string
+STRING_CHARACTERS = re.compile(r'["\\]')
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser of the objects listed in a JSON document that arrives in chunks.
+
+    The objects of the parsed array, either the document itself or the value of one key of
+    the top-level object like {"itinerary": [...]}, are decoded as soon as their closing brace
+    arrives, without waiting for the rest of the document. Other arrays are skipped, and text
+    around the document, like the ```json fences of a Gemini answer, is ignored.
+
+    Only the structure is tracked between chunks; the text of an object, or of a top-level
+    key, is kept until it is complete, then decoded with json.loads.
+    """
+
+    def __init__(self, key : str = 'itinerary'):
+        """
+        Initialize the parser before the first chunk.
+
+        Args:
+            key (str): Key of the top-level object whose array is parsed, when the document is not an array.
+        """
+        self.key = key
+        self._text = ''
+        self._position = 0
+        self._containers = []
+        self._in_string = False
+        self._array_depth = None
+        self._object_start = None
+        self._key_start = None
+        self._last_key = None
+        self._complete = False
+
+    def feed(self, chunk : str) -> List[Dict[str, Any]]:
+        """
+        Parse the next chunk of the document.
+
+        Args:
+            chunk (str): Text following the previous chunk.
+
+        Returns:
+            list: The objects of the array completed by this chunk, in order.
+
+        Raises:
+            ValueError: If the document or one of its objects is not valid JSON.
+        """
+        if self._complete:
+            return []
+        self._text += chunk
+        objects = []
+        while not self._complete:
+            if self._in_string:
+                match = STRING_CHARACTERS.search(self._text, self._position)
+                if match is None:
+                    self._position = len(self._text)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(self._text):
+                        # The escaped character is in the next chunk
+                        self._position = match.start()
+                        break
+                    self._position = match.end() + 1
+                    continue
+                self._in_string = False
+                self._position = match.end()
+                if self._key_start is not None:
+                    # Strings of the top-level object alternate between keys and values, so the
+                    # last one read before an array is its key
+                    self._last_key = json.loads(self._text[self._key_start:self._position])
+                    self._key_start = None
+                continue
+
+            match = STRUCTURAL_CHARACTERS.search(self._text, self._position)
+            if match is None:
+                self._position = len(self._text)
+                break
+            self._position = match.end()
+            character = match.group()
+            if not self._containers and character not in '{[':
+                # Text before the document
+                continue
+
+            if character == '"':
+                self._in_string = True
+                if self._containers == ['{']:
+                    self._key_start = match.start()
+            elif character in '{[':
+                if character == '{' and self._is_array_item():
+                    self._object_start = match.start()
+                if character == '[' and self._array_depth is None and self._is_parsed_array():
+                    self._array_depth = len(self._containers) + 1
+                self._containers.append(character)
+            else:
+                if self._containers.pop() != ('{' if character == '}' else '['):
+                    raise ValueError(f"Unexpected {character!r} in JSON document")
+                if character == ']' and len(self._containers) + 1 == self._array_depth:
+                    # A repeated key is not parsed again
+                    self._array_depth = -1
+                if character == '}' and self._is_array_item():
+                    objects.append(json.loads(self._text[self._object_start:self._position]))
+                    self._object_start = None
+                self._complete = not self._containers
+
+        # Only the object or key being read is needed to parse the next chunks
+        keep_from = min(start for start in (self._object_start, self._key_start, self._position) if start is not None)
+        self._text = self._text[keep_from:]
+        self._position -= keep_from
+        if self._object_start is not None:
+            self._object_start -= keep_from
+        if self._key_start is not None:
+            self._key_start -= keep_from
+        return objects
+
+    def close(self) -> None:
+        """
+        Check that the whole document was parsed.
+
+        Raises:
+            ValueError: If the document is missing or was cut off.
+        """
+        if not self._complete:
+            raise ValueError("Incomplete JSON document")
+
+    def _is_parsed_array(self) -> bool:
+        """Whether an array opening now is the document itself or the value of the parsed key."""
+        return not self._containers or (self._containers == ['{'] and self._last_key == self.key)
+
+    def _is_array_item(self) -> bool:
+        """Whether the innermost open container is the array whose objects are parsed."""
+        return self._array_depth is not None and len(self._containers) == self._array_depth and self._containers[-1] == '['
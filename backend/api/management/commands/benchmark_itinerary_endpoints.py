@@ -0,0 +1,160 @@
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ...benchmark import StubUpstreamServer, load_cassette, run_load, stub_upstreams
+from ...jobs import itinerary_job_queue
+from ...models import ItineraryJob
+
+
+# Seconds after which a generation job still running is counted as failed
+JOB_TIMEOUT = 300
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the generate, recent and detail itinerary endpoints against recorded "
+        "Gemini and TripAdvisor responses, in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cassette',
+            default='paris',
+            help="Recorded upstream responses to replay, from api/benchmark_fixtures.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help="Number of requests in flight at once.",
+        )
+        parser.add_argument(
+            '--generate-requests',
+            type=int,
+            default=8,
+            help="Number of itineraries to generate.",
+        )
+        parser.add_argument(
+            '--read-requests',
+            type=int,
+            default=200,
+            help="Number of requests sent to each of the recent and detail endpoints.",
+        )
+        parser.add_argument(
+            '--gemini-latency',
+            type=float,
+            default=1000,
+            help="Milliseconds the stub Gemini API waits before answering.",
+        )
+        parser.add_argument(
+            '--tripadvisor-latency',
+            type=float,
+            default=150,
+            help="Milliseconds the stub TripAdvisor API waits before answering.",
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0,
+            help="Maximum random deviation from the injected latencies, in milliseconds.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        cassette = load_cassette(options['cassette'])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User.objects.create_user(username="benchmark@example.com", password="benchmark")
+            with StubUpstreamServer(
+                cassette,
+                options['gemini_latency'] / 1000,
+                options['tripadvisor_latency'] / 1000,
+                options['jitter'] / 1000,
+            ) as server, stub_upstreams(server.url):
+                results = self._run(user, concurrency, options)
+                self.stdout.write(
+                    f"Upstream requests: {server.request_counts['gemini']} Gemini, "
+                    f"{server.request_counts['tripadvisor']} TripAdvisor"
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'endpoint':<10} {'requests':>8} {'failed':>6} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'queries':>8} {'req/s':>8}"
+        )
+        for endpoint, result in results.items():
+            self.stdout.write(
+                f"{endpoint:<10} {result['requests']:>8} {result['failed']:>6} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['queries']:>8.1f} "
+                f"{result['throughput']:>8.1f}"
+            )
+
+    def _run(self, user, concurrency, options):
+        """Generate itineraries, then read them back, returning the measurements of each endpoint."""
+        start_date = date.today() + timedelta(days=30)
+        generate_body = {
+            "destination": "Paris, France",
+            "num_of_days": 3,
+            "must_includes": ["Museums"],
+            "start_date": str(start_date),
+            "end_date": str(start_date + timedelta(days=2)),
+            # Every request reaches the stub Gemini API instead of the response cache
+            "use_cache": False,
+        }
+
+        authorization = f"Bearer {AccessToken.for_user(user)}"
+
+        def client():
+            api_client = APIClient()
+            api_client.credentials(HTTP_AUTHORIZATION=authorization)
+            return api_client
+
+        def generate(index):
+            # Each request thread also acts as a worker until its job finished, so that as many
+            # jobs run at once as requests are in flight; latency is measured until then
+            api_client = client()
+            response = api_client.post('/api/itinerary/generate/', generate_body, format='json')
+            if response.status_code != 202:
+                return False
+
+            job_url = response.headers['Location']
+            deadline = time.monotonic() + JOB_TIMEOUT
+            while time.monotonic() < deadline:
+                claimed_job = itinerary_job_queue.claim()
+                if claimed_job is not None:
+                    itinerary_job_queue.run(claimed_job)
+                job = api_client.get(job_url).json()['data']
+                if job['status'] in (ItineraryJob.SUCCEEDED, ItineraryJob.FAILED):
+                    return job['status'] == ItineraryJob.SUCCEEDED
+                if claimed_job is None:
+                    time.sleep(0.05)
+            return False
+
+        results = {'generate': run_load(generate, options['generate_requests'], concurrency)}
+
+        itinerary_ids = list(user.itinerary_set.values_list('id', flat=True))
+        if not itinerary_ids:
+            return results
+
+        results['recent'] = run_load(
+            lambda index: client().get('/api/itinerary/recent/').status_code == 200,
+            options['read_requests'],
+            concurrency,
+        )
+        results['detail'] = run_load(
+            lambda index: client().get(f'/api/itinerary/{itinerary_ids[index % len(itinerary_ids)]}/').status_code == 200,
+            options['read_requests'],
+            concurrency,
+        )
+        return results
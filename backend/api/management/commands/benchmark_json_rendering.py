@@ -0,0 +1,153 @@
+import io
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import JsonResponse as DjangoJsonResponse
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from ...benchmark import load_cassette
+from ...images import split_image_urls
+from ...models import Activity, Image, Itinerary, LocationDetails
+from ...renderers import FastJSONParser, FastJSONRenderer, JsonResponse, orjson
+from ...serializers import ItineraryResponseSerializer
+from ...services import TripAdvisorAPIClient
+
+
+# Activities of each day of the benchmarked itinerary, as Gemini plans them
+TIMES_OF_DAY = ['morning', 'afternoon', 'afternoon', 'evening']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rendering and parsing the JSON of an itinerary detail response with the json "
+        "module and with orjson, in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cassette',
+            default='paris',
+            help="Recorded upstream responses the places of the itinerary come from, from api/benchmark_fixtures.",
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help="Number of days of the itinerary.",
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=500,
+            help="Number of times each payload is rendered or parsed.",
+        )
+
+    def handle(self, *args, **options):
+        cassette = load_cassette(options['cassette'])
+        iterations = max(1, options['iterations'])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            itinerary = self._create_itinerary(cassette, max(1, options['days']))
+            data = ItineraryResponseSerializer(itinerary).data
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        content = JSONRenderer().render(data)
+        cases = {
+            'render json': lambda: JSONRenderer().render(data),
+            'render orjson': lambda: FastJSONRenderer().render(data),
+            'response json': lambda: DjangoJsonResponse(data),
+            'response orjson': lambda: JsonResponse(data),
+            'parse json': lambda: JSONParser().parse(io.BytesIO(content)),
+            'parse orjson': lambda: FastJSONParser().parse(io.BytesIO(content)),
+        }
+
+        if orjson is None:
+            self.stdout.write("orjson is not installed, the orjson cases use the json module.")
+        self.stdout.write(
+            f"Payload: {options['days']} days, {itinerary.activity_set.count()} activities, {len(content)} bytes"
+        )
+        self.stdout.write(f"{'case':<16} {'mean us':>9} {'p95 us':>9} {'alloc KiB':>10}")
+        for case, run in cases.items():
+            result = self._measure(run, iterations)
+            self.stdout.write(
+                f"{case:<16} {result['mean_us']:>9.1f} {result['p95_us']:>9.1f} {result['alloc_kib']:>10.1f}"
+            )
+
+    def _create_itinerary(self, cassette, days):
+        """Create an itinerary visiting the places of the cassette in turn, with their details and photos."""
+        tripadvisor = cassette['tripadvisor']
+        planned = json.loads(
+            cassette['gemini']['candidates'][0]['content']['parts'][0]['text'].strip().strip('`').removeprefix('json')
+        )['itinerary']
+
+        locations = []
+        for location_id, details in tripadvisor['details'].items():
+            location = LocationDetails.objects.create(**TripAdvisorAPIClient._parse_place_details(details))
+            for photo in tripadvisor['photos'].get(location_id, {}).get('data', []):
+                urls = TripAdvisorAPIClient._parse_image(photo, location_id)
+                urls.pop('location')
+                Image.objects.create(location=location, **split_image_urls(urls))
+            locations.append(location)
+
+        user = User.objects.create_user(username="benchmark@example.com", password="benchmark")
+        start_date = date.today() + timedelta(days=30)
+        itinerary = Itinerary.objects.create(
+            user=user,
+            start_date=start_date,
+            end_date=start_date + timedelta(days=days - 1),
+            total_days=days,
+            destination="Paris, France",
+            name=f"Paris Itinerary for {days} days",
+        )
+        activities = []
+        for day in range(1, days + 1):
+            for position, time_of_day in enumerate(TIMES_OF_DAY):
+                index = (day - 1) * len(TIMES_OF_DAY) + position
+                location = locations[index % len(locations)]
+                activities.append(Activity(
+                    name=location.name,
+                    itinerary=itinerary,
+                    description=planned[index % len(planned)]['description'],
+                    location=location,
+                    duration=planned[index % len(planned)]['duration'],
+                    day=str(day),
+                    time_of_day=time_of_day,
+                    position=position,
+                    travel_distance_km=round(1.5 * position, 3) if position else None,
+                ))
+        Activity.objects.bulk_create(activities)
+        return itinerary
+
+    @staticmethod
+    def _measure(run, iterations):
+        """Time a case over the iterations, then measure the memory it allocates at its peak in one more."""
+        durations = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'mean_us': statistics.fmean(durations) * 1e6,
+            'p95_us': statistics.quantiles(durations, n=20)[-1] * 1e6 if iterations > 1 else durations[0] * 1e6,
+            'alloc_kib': peak / 1024,
+        }
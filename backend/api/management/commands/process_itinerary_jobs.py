@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from ...jobs import itinerary_job_queue
+from ...instrumentation import serve_metrics
+
+
+class Command(BaseCommand):
+    help = "Process queued itinerary generation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            choices=range(1, 33),
+            default=1,
+            metavar='{1..32}',
+            help="Number of jobs to process at once.",
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            help="Serve the Prometheus metrics of the worker on this port.",
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            serve_metrics(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        if options['concurrency'] == 1:
+            self.work(options)
+            return
+
+        with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='itinerary-job-worker') as executor:
+            workers = [executor.submit(self.work, options) for _ in range(options['concurrency'])]
+            for worker in workers:
+                worker.result()
+
+    def work(self, options):
+        """Claim and run jobs one at a time, until the queue is empty in burst mode."""
+        try:
+            while True:
+                close_old_connections()
+                requeued = itinerary_job_queue.requeue_stale()
+                if requeued:
+                    self.stdout.write(f"Found {requeued} stale job(s)")
+
+                job = itinerary_job_queue.claim()
+                if job is None:
+                    if options['burst']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"Processing job {job.pk}")
+                job = itinerary_job_queue.run(job)
+                self.stdout.write(f"Job {job.pk} {job.status}")
+        finally:
+            if options['concurrency'] > 1:
+                connection.close()
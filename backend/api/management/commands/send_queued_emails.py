@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...outbox import email_outbox
+from ...instrumentation import serve_metrics
+
+
+class Command(BaseCommand):
+    help = "Send queued emails in batches over one reused mail server connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty outbox again.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help="Maximum number of emails claimed at once.",
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            help="Serve the Prometheus metrics of the sender on this port.",
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help="Exit once no email is due instead of waiting for new ones.",
+        )
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            serve_metrics(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        # Opened on the first batch, then kept open and authenticated until idle
+        connection = get_connection(fail_silently=False)
+        last_sent = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                email_outbox.depth()
+
+                emails = email_outbox.claim(options['batch_size'])
+                if not emails:
+                    if time.monotonic() - last_sent > settings.EMAIL_OUTBOX_IDLE_TIMEOUT:
+                        connection.close()
+                    if options['burst']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                outcomes = email_outbox.send(emails, connection)
+                last_sent = time.monotonic()
+                self.stdout.write(
+                    f"Sent {outcomes['sent']} email(s), {outcomes['retried']} to retry, {outcomes['failed']} failed"
+                )
+        finally:
+            connection.close()
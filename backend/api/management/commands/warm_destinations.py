@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...generation import ItineraryGenerator
+from ...instrumentation import trace
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-generate the plans of popular destinations and store their places, so that "
+        "generating these itineraries runs on cached Gemini answers and stored TripAdvisor data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'destinations',
+            nargs='+',
+            help="Destinations to warm, as users enter them, e.g. \"Paris, France\".",
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            nargs='+',
+            default=[3],
+            help="Trip lengths to warm for every destination, in days.",
+        )
+        parser.add_argument(
+            '--must-include',
+            action='append',
+            default=[],
+            dest='must_includes',
+            help="Interest the plans must include, repeat for several. Plans are cached by destination, days and interests.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=2,
+            help="Number of plans warmed at once, each with its own TripAdvisor request pool.",
+        )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help="Generate new plans even if cached ones have not expired.",
+        )
+
+    def handle(self, *args, **options):
+        plans = [(destination, days) for destination in options['destinations'] for days in options['days']]
+        warmed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+            futures = {
+                executor.submit(self._warm, destination, days, options): (destination, days)
+                for destination, days in plans
+            }
+            for completed, future in enumerate(as_completed(futures), 1):
+                destination, days = futures[future]
+                prefix = f"[{completed}/{len(plans)}] {destination}, {days} day(s)"
+                try:
+                    counts, duration = future.result()
+                except Exception as e:
+                    self.stderr.write(f"{prefix}: failed: {e}")
+                    continue
+                warmed += 1
+                self.stdout.write(
+                    f"{prefix}: {counts['activities']} activities at {counts['places']} places, "
+                    f"{counts['searches']} searches and {counts['requests']} place requests in {duration:.1f}s"
+                )
+        self.stdout.write(f"Warmed {warmed} of {len(plans)} plan(s)")
+
+    def _warm(self, destination, num_of_days, options):
+        """Warm one plan in a thread of the pool, returning its counts and duration in seconds."""
+        def on_progress(stage, completed, total):
+            if options['verbosity'] >= 2:
+                self.stdout.write(f"{destination}, {num_of_days} day(s): {stage} {completed}/{total}")
+
+        try:
+            with trace('warm_destination', destination=destination, num_of_days=num_of_days) as warm_trace:
+                counts = ItineraryGenerator(on_progress=on_progress).warm({
+                    'destination': destination,
+                    'num_of_days': num_of_days,
+                    'must_includes': options['must_includes'],
+                    'use_cache': not options['refresh'],
+                })
+            return counts, warm_trace.duration
+        finally:
+            # Every thread of the pool opened its own database connection
+            connection.close()
@@ -0,0 +1,158 @@
+import gzip
+import time
+from typing import Callable, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .conditional import encoded_etag
+from .instrumentation import Trace, metrics, span, trace
+
+try:
+    import brotli
+except ImportError:  # Optional, responses are only compressed with gzip without it
+    brotli = None
+
+
+# Bodies shorter than this are sent as they are, compressing them saves less than the headers cost
+MIN_COMPRESSED_SIZE = 200
+# Brotli quality suited to compressing every response on the fly, 11 is for static files
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+class ServerTimingMiddleware:
+    """
+    Trace every request, log its spans and report them in a Server-Timing header.
+
+    Place it first in MIDDLEWARE so that the other middleware are timed as well. It runs
+    natively under both WSGI and ASGI; for streaming responses the header only covers
+    the time until the response starts.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response : Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request : HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with trace('http', method=request.method, path=request.path) as request_trace:
+            response = self.get_response(request)
+            self._report(request, response, request_trace)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request : HttpRequest) -> HttpResponse:
+        start = time.perf_counter()
+        with trace('http', method=request.method, path=request.path) as request_trace:
+            response = await self.get_response(request)
+            self._report(request, response, request_trace)
+        self._observe(request, response, start)
+        return response
+
+    def _report(self, request : HttpRequest, response : HttpResponse, request_trace : Trace) -> None:
+        """Add the view and status to the logged fields, and the spans to the response."""
+        request_trace.fields.update(view=self._view_name(request), status=response.status_code)
+        response['Server-Timing'] = request_trace.server_timing()
+
+    def _observe(self, request : HttpRequest, response : HttpResponse, start : float) -> None:
+        metrics.observe(
+            'planmyitinerary_http_request_seconds',
+            {'view': self._view_name(request) or 'unresolved', 'method': request.method, 'status': str(response.status_code)},
+            time.perf_counter() - start,
+        )
+
+    @staticmethod
+    def _view_name(request : HttpRequest) -> str:
+        return request.resolver_match.url_name if request.resolver_match else None
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli or gzip, as negotiated with the Accept-Encoding header.
+
+    Like django.middleware.gzip.GZipMiddleware, with brotli when the brotli package is
+    installed. Streaming responses are left alone, so that Server-Sent Events reach the
+    client as they are sent. ETags stay strong: the coding is appended to the ETag of a
+    compressed response, see api/conditional.py.
+
+    Place it right after ServerTimingMiddleware so that compression is timed as well.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response : Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request : HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._compress(request, self.get_response(request))
+
+    async def __acall__(self, request : HttpRequest) -> HttpResponse:
+        return self._compress(request, await self.get_response(request))
+
+    def _compress(self, request : HttpRequest, response : HttpResponse) -> HttpResponse:
+        """Compress the body of a response in the coding accepted by the client, if any."""
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or 'no-transform' in response.get('Cache-Control', '')
+        ):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self._negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        if len(response.content) < MIN_COMPRESSED_SIZE:
+            return response
+
+        with span('compression'):
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=GZIP_LEVEL, mtime=0)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        self._tag_etag(response, encoding)
+        return response
+
+    @staticmethod
+    def _negotiate(accept_encoding : str) -> Optional[str]:
+        """Pick the supported coding the client prefers, brotli on a tie, or None for no compression."""
+        preferences = {}
+        for item in accept_encoding.split(','):
+            coding, _, parameters = item.strip().partition(';')
+            quality = 1.0
+            if parameters.strip().lower().startswith('q='):
+                try:
+                    quality = float(parameters.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            preferences[coding.strip().lower()] = quality
+
+        supported = ['br', 'gzip'] if brotli else ['gzip']
+        qualities = {coding: preferences.get(coding, preferences.get('*', 0.0)) for coding in supported}
+        encoding = max(supported, key=lambda coding: qualities[coding])
+        return encoding if qualities[encoding] > 0 else None
+
+    @staticmethod
+    def _tag_etag(response : HttpResponse, encoding : str) -> None:
+        """Make the strong ETag of a response specific to its coding."""
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = encoded_etag(etag, encoding)
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_activity_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceSearchResult',
+            fields=[
+                ('query', models.CharField(max_length=511, primary_key=True, serialize=False)),
+                ('location_id', models.IntegerField(blank=True, null=True)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
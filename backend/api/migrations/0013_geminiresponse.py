@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_placesearchresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiResponse',
+            fields=[
+                ('fingerprint', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('response', models.JSONField()),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
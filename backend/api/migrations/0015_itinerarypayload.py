@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_itineraryjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItineraryPayload',
+            fields=[
+                ('itinerary', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='api.itinerary')),
+                ('data', models.JSONField()),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_itinerarypayload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['itinerary', 'day', 'time_of_day'], name='activity_itinerary_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itinerary',
+            index=models.Index(fields=['user', '-createdAt'], name='itinerary_user_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='itinerary',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.itinerary'),
+        ),
+        migrations.AlterField(
+            model_name='itinerary',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
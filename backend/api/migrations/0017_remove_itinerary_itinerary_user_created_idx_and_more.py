@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_alter_activity_itinerary_alter_itinerary_user_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='itinerary',
+            name='itinerary_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='itinerary',
+            index=models.Index(fields=['user', '-createdAt', '-id'], name='itinerary_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:40
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rating(value):
+    try:
+        return Decimal(value).quantize(Decimal('0.1'))
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+
+def parse_ranking_position(value):
+    match = re.search(r'#\s*([\d,]+)', value or '')
+    return int(match.group(1).replace(',', '')) if match else None
+
+
+def backfill_numeric_columns(apps, schema_editor):
+    LocationDetails = apps.get_model('api', 'LocationDetails')
+    batch = []
+    for location in LocationDetails.objects.only('id', 'latitude', 'longitude', 'rating', 'ranking').iterator(chunk_size=1000):
+        location.latitude_value = parse_float(location.latitude)
+        location.longitude_value = parse_float(location.longitude)
+        location.rating_value = parse_rating(location.rating)
+        location.ranking_position = parse_ranking_position(location.ranking)
+        batch.append(location)
+        if len(batch) == 1000:
+            LocationDetails.objects.bulk_update(batch, ['latitude_value', 'longitude_value', 'rating_value', 'ranking_position'])
+            batch = []
+    LocationDetails.objects.bulk_update(batch, ['latitude_value', 'longitude_value', 'rating_value', 'ranking_position'])
+
+
+def backfill_text_columns(apps, schema_editor):
+    LocationDetails = apps.get_model('api', 'LocationDetails')
+    batch = []
+    for location in LocationDetails.objects.only('id', 'latitude_value', 'longitude_value', 'rating_value').iterator(chunk_size=1000):
+        location.latitude = None if location.latitude_value is None else str(location.latitude_value)
+        location.longitude = None if location.longitude_value is None else str(location.longitude_value)
+        location.rating = None if location.rating_value is None else str(location.rating_value)
+        batch.append(location)
+        if len(batch) == 1000:
+            LocationDetails.objects.bulk_update(batch, ['latitude', 'longitude', 'rating'])
+            batch = []
+    LocationDetails.objects.bulk_update(batch, ['latitude', 'longitude', 'rating'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_remove_itinerary_itinerary_user_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locationdetails',
+            name='ranking',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationdetails',
+            name='latitude_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationdetails',
+            name='longitude_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationdetails',
+            name='rating_value',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=2, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationdetails',
+            name='ranking_position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_numeric_columns, backfill_text_columns),
+        migrations.RemoveField(
+            model_name='locationdetails',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='locationdetails',
+            name='longitude',
+        ),
+        migrations.RemoveField(
+            model_name='locationdetails',
+            name='rating',
+        ),
+        migrations.RenameField(
+            model_name='locationdetails',
+            old_name='latitude_value',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='locationdetails',
+            old_name='longitude_value',
+            new_name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='locationdetails',
+            old_name='rating_value',
+            new_name='rating',
+        ),
+        migrations.AddIndex(
+            model_name='locationdetails',
+            index=models.Index(fields=['latitude', 'longitude'], name='location_lat_lng_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_locationdetails_numeric_geo_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='travel_distance_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.1 on 2026-10-17 17:02
+
+import os
+
+from django.db import migrations, models
+
+
+IMAGE_SIZES = ['thumbnail', 'small', 'medium', 'large', 'original']
+# Images converted per query
+BATCH_SIZE = 2000
+
+
+def split_image_urls(urls):
+    present = [url for url in (urls.get(size) for size in IMAGE_SIZES) if url]
+    prefix = os.path.commonprefix(present) if present else ''
+    suffix = os.path.commonprefix([url[len(prefix):][::-1] for url in present])[::-1] if present else ''
+    return {
+        'url_prefix': prefix,
+        'url_suffix': suffix,
+        'variants': [
+            urls[size][len(prefix):len(urls[size]) - len(suffix)] if urls.get(size) else None
+            for size in IMAGE_SIZES
+        ],
+    }
+
+
+def join_image_urls(url_prefix, url_suffix, variants):
+    return {
+        size: url_prefix + variant + url_suffix if variant is not None else None
+        for size, variant in zip(IMAGE_SIZES, variants or [None] * len(IMAGE_SIZES))
+    }
+
+
+def split_urls(apps, schema_editor):
+    Image = apps.get_model('api', 'Image')
+    batch = []
+    for image in Image.objects.only('id', *IMAGE_SIZES).iterator(chunk_size=BATCH_SIZE):
+        for field, value in split_image_urls({size: getattr(image, size) for size in IMAGE_SIZES}).items():
+            setattr(image, field, value)
+        batch.append(image)
+        if len(batch) == BATCH_SIZE:
+            Image.objects.bulk_update(batch, ['url_prefix', 'url_suffix', 'variants'])
+            batch = []
+    Image.objects.bulk_update(batch, ['url_prefix', 'url_suffix', 'variants'])
+
+
+def join_urls(apps, schema_editor):
+    Image = apps.get_model('api', 'Image')
+    batch = []
+    for image in Image.objects.only('id', 'url_prefix', 'url_suffix', 'variants').iterator(chunk_size=BATCH_SIZE):
+        for size, url in join_image_urls(image.url_prefix, image.url_suffix, image.variants).items():
+            setattr(image, size, url)
+        batch.append(image)
+        if len(batch) == BATCH_SIZE:
+            Image.objects.bulk_update(batch, IMAGE_SIZES)
+            batch = []
+    Image.objects.bulk_update(batch, IMAGE_SIZES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='url_prefix',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='url_suffix',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='variants',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(split_urls, join_urls),
+        migrations.RemoveField(
+            model_name='image',
+            name='thumbnail',
+        ),
+        migrations.RemoveField(
+            model_name='image',
+            name='small',
+        ),
+        migrations.RemoveField(
+            model_name='image',
+            name='medium',
+        ),
+        migrations.RemoveField(
+            model_name='image',
+            name='large',
+        ),
+        migrations.RemoveField(
+            model_name='image',
+            name='original',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-17 17:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_compact_image_urls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itinerary',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
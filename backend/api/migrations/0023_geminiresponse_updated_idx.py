@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-17 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_itinerary_updatedat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='geminiresponse',
+            index=models.Index(fields=['updatedAt'], name='gemini_response_updated_idx'),
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from typing import Dict, Optional
 import uuid
 
+from .images import join_image_urls
+
 
 # Model for email verification tokens
 class EmailVerificationToken(models.Model):
@@ -12,27 +16,42 @@ class EmailVerificationToken(models.Model):
 
 # Model for user itineraries
 class Itinerary(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # Covered by itinerary_user_created_idx
     start_date = models.DateField()
     end_date = models.DateField()
     total_days = models.IntegerField()
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)  # Version of the itinerary in the ETags of the recent itineraries
     destination = models.CharField(max_length=255, null=True, blank=True)
     image_url = models.URLField(null=True, blank=True)
     name = models.CharField(max_length=255, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Recent itineraries of a user, newest first, paginated on (createdAt, id)
+            models.Index(fields=['user', '-createdAt', '-id'], name='itinerary_user_created_idx'),
+        ]
+
 
 # Model for activities within an itinerary
 class Activity(models.Model):
     name = models.CharField(max_length=255, null=True)
-    itinerary = models.ForeignKey(Itinerary, on_delete=models.CASCADE)
+    itinerary = models.ForeignKey(Itinerary, on_delete=models.CASCADE, db_index=False)  # Covered by activity_itinerary_day_idx
     description = models.TextField()
     location = models.ForeignKey('LocationDetails', on_delete=models.CASCADE, null=True)
     duration = models.CharField(max_length=50)
     day = models.CharField(max_length=50)
     time_of_day = models.CharField(max_length=50)
+    position = models.IntegerField(default=0)  # Order of the activity within its day
+    travel_distance_km = models.FloatField(null=True, blank=True)  # From the previous activity of the day
     createdAt = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        indexes = [
+            # Activities of an itinerary, grouped by day and time of day
+            models.Index(fields=['itinerary', 'day', 'time_of_day'], name='activity_itinerary_day_idx'),
+        ]
+
 
 # Model for storing details about locations
 class LocationDetails(models.Model):
@@ -45,19 +64,111 @@ class LocationDetails(models.Model):
     country = models.CharField(max_length=255, null=True, blank=True)
     postalcode = models.CharField(max_length=50, null=True, blank=True)
     address_string = models.TextField(null=True, blank=True)
-    latitude = models.CharField(max_length=50, null=True, blank=True)
-    longitude = models.CharField(max_length=50, null=True, blank=True)
-    ranking = models.CharField(max_length=50, null=True, blank=True)
-    rating = models.CharField(max_length=10, null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    ranking = models.CharField(max_length=255, null=True, blank=True)
+    ranking_position = models.IntegerField(null=True, blank=True)  # Parsed from ranking, e.g. 3 for "#3 of 250 things to do"
+    rating = models.DecimalField(max_digits=2, decimal_places=1, null=True, blank=True)
     createdAt = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Bounding-box lookups of nearby places
+            models.Index(fields=['latitude', 'longitude'], name='location_lat_lng_idx'),
+        ]
+
 
-# Model for storing images associated with locations
+# Model for storing images associated with locations, as the parts of their URLs (see api/images.py)
 class Image(models.Model):
     location = models.ForeignKey(LocationDetails, on_delete=models.CASCADE)
-    thumbnail = models.URLField(null=True)
-    small = models.URLField(null=True)
-    medium = models.URLField(null=True)
-    large = models.URLField(null=True)
-    original = models.URLField(null=True)
+    url_prefix = models.CharField(max_length=255, blank=True, default='')
+    url_suffix = models.CharField(max_length=255, blank=True, default='')
+    variants = models.JSONField(default=list)  # Segment of each size of IMAGE_SIZES, None for missing sizes
     createdAt = models.DateTimeField(auto_now_add=True)
+
+    def urls(self) -> Dict[str, Optional[str]]:
+        """The URL of every size of the image, None for the sizes it does not have."""
+        return join_image_urls(self.url_prefix, self.url_suffix, self.variants)
+
+
+# Model for caching TripAdvisor search results by normalized query
+class PlaceSearchResult(models.Model):
+    query = models.CharField(max_length=511, primary_key=True)
+    location_id = models.IntegerField(null=True, blank=True)  # None records a search without a match
+    updatedAt = models.DateTimeField(auto_now=True)
+
+
+# Model for caching Gemini itinerary responses by prompt fingerprint
+class GeminiResponse(models.Model):
+    fingerprint = models.CharField(max_length=64, primary_key=True)
+    response = models.JSONField()
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Expiry and eviction of the oldest responses
+            models.Index(fields=['updatedAt'], name='gemini_response_updated_idx'),
+        ]
+
+
+# Model for queued itinerary generation jobs
+class ItineraryJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    params = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=50, null=True, blank=True)
+    progress_completed = models.IntegerField(default=0)
+    progress_total = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    itinerary = models.ForeignKey(Itinerary, on_delete=models.SET_NULL, null=True, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'createdAt'])]
+
+
+# Model for storing the rendered detail response of an itinerary
+class ItineraryPayload(models.Model):
+    itinerary = models.OneToOneField(Itinerary, on_delete=models.CASCADE, primary_key=True)
+    data = models.JSONField()
+    updatedAt = models.DateTimeField(auto_now=True)
+
+
+# Model for queued outgoing emails, sent by the send_queued_emails command
+class OutboundEmail(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
@@ -0,0 +1,178 @@
+import logging
+import smtplib
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from .instrumentation import metrics, span
+from .models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+# Longest delay between two attempts at sending an email, in seconds
+MAX_RETRY_DELAY = 60 * 60
+
+
+class EmailOutbox:
+    """
+    Database-backed queue of outgoing emails, drained by the send_queued_emails command.
+
+    Emails are queued in the transaction of the request that produced them and sent in batches
+    over one SMTP connection, so that requests never wait for the mail server. Sending is at least
+    once: an email whose sender died before recording the outcome is sent again once its lease expired.
+    """
+
+    def __init__(self, max_attempts : int, retry_delay : float, lease_timeout : float):
+        """
+        Initialize the outbox.
+
+        Args:
+            max_attempts (int): Maximum number of times an email is sent before it is marked as failed.
+            retry_delay (float): Seconds before the first retry of an email, doubled after each failure.
+            lease_timeout (float): Seconds a claimed email waits before another sender may retry it.
+        """
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+
+    def enqueue(self, to : str, subject : str, body : str) -> OutboundEmail:
+        """
+        Queue a plain text email.
+
+        Args:
+            to (str): The recipient's email address.
+            subject (str): The subject of the email.
+            body (str): The text of the email.
+
+        Returns:
+            OutboundEmail: The pending email.
+        """
+        return OutboundEmail.objects.create(to=to, subject=subject, body=body)
+
+    def claim(self, batch_size : int) -> List[OutboundEmail]:
+        """
+        Lease the oldest pending emails that are due.
+
+        Rows locked by other senders are skipped, so several senders can drain the outbox at once.
+        The next attempt of the claimed emails is pushed back by the lease timeout, after which
+        they are claimed again unless their outcome was recorded.
+
+        Args:
+            batch_size (int): Maximum number of emails to claim.
+
+        Returns:
+            list: The claimed emails, oldest first.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(
+                OutboundEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:batch_size]
+            )
+            for email in emails:
+                email.attempts += 1
+                email.next_attempt_at = now + timedelta(seconds=self.lease_timeout)
+                email.updatedAt = now
+            OutboundEmail.objects.bulk_update(emails, ['attempts', 'next_attempt_at', 'updatedAt'])
+        return emails
+
+    def send(self, emails : List[OutboundEmail], connection : BaseEmailBackend) -> Dict[str, int]:
+        """
+        Send claimed emails over one connection and record their outcome.
+
+        The connection is opened if needed and left open for the next batches; a connection
+        closed by the server is reopened once.
+
+        Args:
+            emails (list): Emails returned by claim.
+            connection (BaseEmailBackend): Connection to the mail server, from get_connection.
+
+        Returns:
+            dict: Number of emails by outcome: sent, retried or failed.
+        """
+        outcomes = {'sent': 0, 'retried': 0, 'failed': 0}
+        try:
+            connection.open()
+        except (smtplib.SMTPException, OSError) as e:
+            # The server is unreachable: the whole batch is retried later
+            logger.warning("Could not connect to the mail server: %s", e)
+            for email in emails:
+                outcomes[self._record_failure(email, e)] += 1
+        else:
+            for email in emails:
+                try:
+                    self._send_message(email, connection)
+                except (smtplib.SMTPException, OSError) as e:
+                    outcome = self._record_failure(email, e)
+                else:
+                    email.status = OutboundEmail.SENT
+                    email.sent_at = timezone.now()
+                    email.error = None
+                    outcome = 'sent'
+                outcomes[outcome] += 1
+
+        now = timezone.now()
+        for email in emails:
+            email.updatedAt = now
+        OutboundEmail.objects.bulk_update(emails, ['status', 'next_attempt_at', 'error', 'sent_at', 'updatedAt'])
+        for outcome, count in outcomes.items():
+            if count:
+                metrics.increment('planmyitinerary_emails_total', {'outcome': outcome}, count)
+        return outcomes
+
+    def depth(self) -> int:
+        """Number of emails waiting to be sent, including the ones being retried."""
+        depth = OutboundEmail.objects.filter(status=OutboundEmail.PENDING).count()
+        metrics.set('planmyitinerary_email_queue_depth', {}, depth)
+        return depth
+
+    def _send_message(self, email : OutboundEmail, connection : BaseEmailBackend) -> None:
+        """Send one email, reconnecting once if the server closed the connection."""
+        message = EmailMessage(email.subject, email.body, settings.EMAIL_HOST_USER, [email.to])
+        for reconnected in (False, True):
+            try:
+                with span('email.send'):
+                    connection.send_messages([message])
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Servers drop connections that were idle or served too many messages
+                connection.close()
+                if reconnected:
+                    raise
+                connection.open()
+
+    def _record_failure(self, email : OutboundEmail, error : Exception) -> str:
+        """Schedule the retry of an email that could not be sent, or fail it, returning the outcome."""
+        email.error = str(error)
+        # 5xx replies, like an unknown recipient, fail the same way when retried
+        permanent = (
+            isinstance(error, smtplib.SMTPRecipientsRefused)
+            or isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+        )
+        if permanent or email.attempts >= self.max_attempts:
+            logger.error("Failed to send email %s to %s after %s attempt(s): %s", email.pk, email.to, email.attempts, error)
+            email.status = OutboundEmail.FAILED
+            return 'failed'
+
+        delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** (email.attempts - 1))
+        logger.warning("Failed to send email %s to %s, retrying in %ss: %s", email.pk, email.to, delay, error)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        return 'retried'
+
+
+metrics.describe('planmyitinerary_emails_total', "Attempts at sending queued emails, by outcome.")
+metrics.describe('planmyitinerary_email_queue_depth', "Emails waiting in the outbox, as last counted.")
+
+# Initialize outbox instance
+email_outbox = EmailOutbox(
+    settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    settings.EMAIL_OUTBOX_RETRY_DELAY,
+    settings.EMAIL_OUTBOX_LEASE_TIMEOUT,
+)
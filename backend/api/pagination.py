@@ -0,0 +1,86 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.db.models import Q, QuerySet
+
+
+class KeysetPagination:
+    """
+    Keyset (cursor) pagination over (createdAt, id), newest first.
+
+    Each page is fetched with a range condition on the key of the last row of the
+    previous page, so deep pages cost the same as the first one. The cursor is the
+    URL-safe base64 encoding of that key and should be treated as opaque by clients.
+    """
+
+    def __init__(self, default_page_size : int, max_page_size : int):
+        """
+        Initialize the pagination.
+
+        Args:
+            default_page_size (int): Page size when the client does not ask for one.
+            max_page_size (int): Largest page size served, bigger requests are capped.
+        """
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+
+    def get_page_size(self, requested : Optional[str]) -> int:
+        """
+        Parse the requested page size, capped to max_page_size.
+
+        Raises:
+            ValueError: If the page size is not a positive integer.
+        """
+        if requested is None:
+            return self.default_page_size
+        page_size = int(requested)
+        if page_size <= 0:
+            raise ValueError("Page size must be positive")
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def encode_cursor(created_at : datetime, pk : int) -> str:
+        """Encode the key of a row into an opaque cursor."""
+        key = json.dumps([created_at.isoformat(), pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor : str) -> Tuple[datetime, int]:
+        """
+        Decode a cursor into the key of a row.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+
+    def paginate(self, queryset : QuerySet, page_size : int, cursor : Optional[str] = None) -> Tuple[List, Optional[str]]:
+        """
+        Fetch one page of the queryset.
+
+        Args:
+            queryset (QuerySet): Rows with createdAt and id fields.
+            page_size (int): Number of rows in the page.
+            cursor (str): Cursor returned with the previous page, None for the first page.
+
+        Returns:
+            tuple: The rows of the page and the cursor of the next page, None on the last page.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(createdAt__lt=created_at) | Q(createdAt=created_at, id__lt=pk))
+
+        rows = list(queryset.order_by('-createdAt', '-id')[:page_size + 1])
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, self.encode_cursor(rows[-1].createdAt, rows[-1].id)
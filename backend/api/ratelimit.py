@@ -0,0 +1,120 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+from typing import Dict
+
+from .instrumentation import current_trace, metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, where buckets are only shared by the threads of a process
+    fcntl = None
+
+
+# Bucket state: tokens left and the time they were counted at
+BUCKET_STATE = struct.Struct('dd')
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request would wait longer than allowed for its rate limit."""
+
+
+class RateLimiter:
+    """
+    Token buckets limiting the request rate of each upstream endpoint, shared by every process of the host.
+
+    The state of a bucket is kept in a small file locked with flock while it is updated, so that
+    all gunicorn and process_itinerary_jobs processes draw from the same budget without a server.
+    A request reserves the next token even when the bucket is empty, then waits until the token
+    is due: bursts are queued in order and sent at the budgeted rate instead of running into 429s.
+    Retries of the HTTP clients take their tokens too, see UpstreamRetry in api/services.py.
+    """
+
+    def __init__(self, rates : Dict[str, float], burst : float, max_wait : float, directory : str):
+        """
+        Initialize the limiter.
+
+        Args:
+            rates (dict): Requests per second allowed by endpoint name, e.g. tripadvisor.search.
+                Endpoints without a positive rate are not limited.
+            burst (float): Seconds of budget a bucket accumulates while idle.
+            max_wait (float): Maximum seconds a request is queued before RateLimitExceeded is raised.
+            directory (str): Directory holding the bucket files, on a disk local to the host.
+        """
+        self.rates = {endpoint: rate for endpoint, rate in rates.items() if rate > 0}
+        self.burst = burst
+        self.max_wait = max_wait
+        self.directory = directory
+        # Serializes the threads of this process, which is all there is without flock
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint : str) -> None:
+        """
+        Wait until a request to an endpoint fits its budget.
+
+        Raises:
+            RateLimitExceeded: If the request would be queued for longer than max_wait.
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self, endpoint : str) -> None:
+        """Wait on the event loop until a request to an endpoint fits its budget, see acquire."""
+        # reserve blocks on the lock of the bucket, so it runs in a worker thread
+        delay = await asyncio.to_thread(self.reserve, endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def reserve(self, endpoint : str) -> float:
+        """
+        Take the next token of an endpoint.
+
+        The bucket is only locked while it is updated, never while waiting.
+
+        Returns:
+            float: Seconds to wait before sending the request.
+
+        Raises:
+            RateLimitExceeded: If the token is due in more than max_wait seconds; it is not taken.
+        """
+        rate = self.rates.get(endpoint)
+        if rate is None:
+            return 0.0
+
+        with self._lock, self._bucket_file(endpoint) as bucket:
+            if fcntl:
+                fcntl.flock(bucket, fcntl.LOCK_EX)
+            state = bucket.read(BUCKET_STATE.size)
+            now = time.time()
+            capacity = max(1.0, rate * self.burst)
+            tokens, counted_at = BUCKET_STATE.unpack(state) if len(state) == BUCKET_STATE.size else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - counted_at) * rate)
+
+            delay = max(0.0, (1 - tokens) / rate)
+            if delay > self.max_wait:
+                metrics.increment('planmyitinerary_rate_limit_rejected_total', {'endpoint': endpoint})
+                raise RateLimitExceeded(f"Rate limit of {endpoint} exceeded, next request in {delay:.1f}s")
+
+            # A negative balance is the queue of requests waiting for their token
+            bucket.seek(0)
+            bucket.write(BUCKET_STATE.pack(tokens - 1, now))
+
+        metrics.observe('planmyitinerary_rate_limit_wait_seconds', {'endpoint': endpoint}, delay)
+        trace = current_trace()
+        if trace is not None and delay > 0:
+            trace.add('rate_limit', delay)
+        return delay
+
+    def _bucket_file(self, endpoint : str):
+        """Open the state file of a bucket, creating it empty if needed."""
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor = os.open(os.path.join(self.directory, f'{endpoint}.bucket'), os.O_RDWR | os.O_CREAT, 0o600)
+        # Unbuffered, so that the state is written before the lock is released on close
+        return os.fdopen(descriptor, 'r+b', buffering=0)
+
+
+metrics.describe('planmyitinerary_rate_limit_wait_seconds', "Time requests were queued by the upstream rate limiter, by endpoint.")
+metrics.describe('planmyitinerary_rate_limit_rejected_total', "Requests rejected by the upstream rate limiter after waiting too long, by endpoint.")
@@ -0,0 +1,129 @@
+import json
+from typing import Any, Callable, Optional, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # Optional, JSON is rendered and parsed with the json module without it
+    orjson = None
+
+
+# U+2028 and U+2029 in UTF-8, escaped like DRF does so that the output is valid JavaScript
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+LINE_SEPARATOR_LEAD = b'\xe2'
+
+
+def dumps(data : Any, default : Callable[[Any], Any]) -> bytes:
+    """
+    Serialize data to compact UTF-8 JSON with orjson, or the json module without it.
+
+    Dates, times, UUIDs, Decimals and the other types JSON has no representation for are
+    converted by default, the default method of the encoder whose output is reproduced:
+    orjson's own formats for dates are skipped, so that the output does not change with
+    the backend. Dictionary keys that are not strings are converted like json does.
+
+    Args:
+        data: The data to serialize.
+        default: Converts a value of another type to a serializable one, or raises TypeError.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    if orjson is None:
+        return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode()
+    return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def loads(content : bytes) -> Any:
+    """
+    Parse a UTF-8 JSON document with orjson, or the json module without it.
+
+    Raises:
+        ValueError: If the document is not valid JSON.
+    """
+    if orjson is None:
+        return json.loads(content)
+    return orjson.loads(content)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer rendering with orjson, producing the same documents several times faster.
+
+    Indented output, requested by the browsable API or with an indent media type parameter,
+    is left to JSONRenderer. Unlike it, NaN and infinite floats are rendered as null instead
+    of being rejected.
+    """
+
+    def render(self, data : Any, accepted_media_type : Optional[str] = None, renderer_context : Optional[dict] = None) -> bytes:
+        """Render data into JSON, returning a bytestring."""
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        content = dumps(data, self.encoder_class().default)
+        # Searching the lead byte first is much faster than searching the separators themselves
+        if LINE_SEPARATOR_LEAD in content:
+            for separator, escaped in LINE_SEPARATORS:
+                content = content.replace(separator, escaped)
+        return content
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser parsing with orjson, which only reads UTF-8, the charset of every request of the API."""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type : Optional[str] = None, parser_context : Optional[dict] = None) -> Any:
+        """Parse the incoming bytestream as JSON and return the resulting data."""
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer of one Server-Sent Event, given as an (event, data) pair whose data is rendered in JSON."""
+
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data : Tuple[str, Any], accepted_media_type : Optional[str] = None, renderer_context : Optional[dict] = None) -> bytes:
+        """Render an event, returning a bytestring."""
+        event, payload = data
+        return b'event: ' + event.encode() + b'\ndata: ' + dumps(payload, DjangoJSONEncoder().default) + b'\n\n'
+
+
+class JsonResponse(HttpResponse):
+    """
+    Drop-in for django.http.JsonResponse rendering with orjson, for the views not built on DRF.
+
+    The output is that of the encoder, DjangoJSONEncoder by default as for JsonResponse.
+    """
+
+    def __init__(self, data : Any, encoder : type = DjangoJSONEncoder, safe : bool = True, **kwargs : Any):
+        """
+        Initialize the response.
+
+        Args:
+            data: The data to render.
+            encoder (type): json.JSONEncoder subclass converting the values JSON has no representation for.
+            safe (bool): Whether only dictionaries are allowed, as for django.http.JsonResponse.
+            **kwargs: Arguments of HttpResponse, like status.
+
+        Raises:
+            TypeError: If safe is set and data is not a dictionary.
+        """
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data, encoder().default), **kwargs)
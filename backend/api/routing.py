@@ -0,0 +1,213 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM
+
+
+# Order of the time_of_day slots within a day, unknown slots are visited last
+TIME_OF_DAY_ORDER = {'morning': 0, 'afternoon': 1, 'evening': 2}
+
+# Upper bound on 2-opt improvement passes over one slot of a day
+MAX_TWO_OPT_PASSES = 50
+
+# Number of outlying stops tried as the start of the first path of a day
+MAX_START_CANDIDATES = 8
+
+
+def haversine_matrix(latitudes : np.ndarray, longitudes : np.ndarray) -> np.ndarray:
+    """
+    Compute the great-circle distance in kilometres between every pair of points.
+
+    Args:
+        latitudes (np.ndarray): Latitudes in degrees, shape (n,).
+        longitudes (np.ndarray): Longitudes in degrees, shape (n,).
+
+    Returns:
+        np.ndarray: Symmetric distance matrix of shape (n, n).
+    """
+    phi = np.radians(latitudes)[:, None]
+    lam = np.radians(longitudes)[:, None]
+    a = np.sin((phi.T - phi) / 2) ** 2 + np.cos(phi) * np.cos(phi.T) * np.sin((lam.T - lam) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def optimize_route(stops : List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Regroup the stops of an itinerary into days and order each day to shorten travel.
+
+    Every day keeps as many stops in each time_of_day slot as it was planned with, and
+    every stop keeps its slot. Stops are clustered geographically into days under those
+    capacities, then each day is ordered slot by slot with a nearest-neighbour tour
+    improved by 2-opt. Stops without coordinates stay on their planned day, at the end
+    of their slot.
+
+    Args:
+        stops (list): Dictionaries with day, time_of_day, latitude and longitude keys.
+
+    Returns:
+        list: For each stop, in input order, a dictionary with its day, its position
+            within the day and travel_distance_km from the previous stop of the day
+            (None for the first stop of a day and for stops without coordinates).
+    """
+    planned_days = [int(stop['day']) for stop in stops]
+    slots = [TIME_OF_DAY_ORDER.get(str(stop['time_of_day']).lower(), len(TIME_OF_DAY_ORDER)) for stop in stops]
+    located = [
+        index for index, stop in enumerate(stops)
+        if stop.get('latitude') is not None and stop.get('longitude') is not None
+    ]
+    if not located:
+        return _order_days(np.zeros((0, 0)), planned_days, slots, located)
+
+    distances = haversine_matrix(
+        np.array([float(stops[index]['latitude']) for index in located]),
+        np.array([float(stops[index]['longitude']) for index in located]),
+    )
+    clustered_days = list(planned_days)
+    for position, day in enumerate(_cluster_into_days(
+        distances,
+        [planned_days[index] for index in located],
+        [slots[index] for index in located],
+    )):
+        clustered_days[located[position]] = day
+
+    # Clustering minimizes the spread of each day, not the travelled distance, so keep the planned days when shorter
+    candidates = [planned_days] if clustered_days == planned_days else [planned_days, clustered_days]
+    return min(
+        (_order_days(distances, days, slots, located) for days in candidates),
+        key=lambda route: sum(stop['travel_distance_km'] or 0.0 for stop in route),
+    )
+
+
+def _order_days(distances : np.ndarray, days : List[int], slots : List[int], located : List[int]) -> List[Dict[str, Any]]:
+    """Order the stops of every day slot by slot, see optimize_route for the result format."""
+    located_positions = {index: position for position, index in enumerate(located)}
+    route = [None] * len(days)
+    for day in sorted(set(days)):
+        day_stops = [index for index in range(len(days)) if days[index] == day]
+        previous = None
+        position = 0
+        for slot in sorted({slots[index] for index in day_stops}):
+            slot_stops = [index for index in day_stops if slots[index] == slot]
+            tour = _order_slot(
+                distances,
+                [located_positions[index] for index in slot_stops if index in located_positions],
+                previous,
+            )
+            for located_position in tour:
+                index = located[located_position]
+                travel_distance = None if previous is None else round(float(distances[previous, located_position]), 3)
+                route[index] = {'day': day, 'position': position, 'travel_distance_km': travel_distance}
+                previous = located_position
+                position += 1
+            for index in slot_stops:
+                if index not in located_positions:
+                    route[index] = {'day': day, 'position': position, 'travel_distance_km': None}
+                    position += 1
+    return route
+
+
+def _cluster_into_days(distances : np.ndarray, days : List[int], slots : List[int]) -> List[int]:
+    """
+    Assign stops to days by capacity-constrained k-medoids.
+
+    Each day starts from the stops planned on it and is represented by its medoid, the stop
+    closest to all others of the day. Stops are then reassigned, closest pairs first, to the
+    nearest medoid whose day still has room in their slot, until the assignment is stable.
+    """
+    unique_days = sorted(set(days))
+    capacity = {}
+    for day, slot in zip(days, slots):
+        capacity[day, slot] = capacity.get((day, slot), 0) + 1
+
+    assignment = np.array(days)
+    for _ in range(10):
+        medoids = []
+        for day in unique_days:
+            members = np.flatnonzero(assignment == day)
+            medoids.append(members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))])
+        to_medoid = distances[:, medoids]
+
+        remaining = dict(capacity)
+        new_assignment = np.empty_like(assignment)
+        assigned = np.zeros(len(days), dtype=bool)
+        for flat_index in np.argsort(to_medoid, axis=None, kind='stable'):
+            stop, day_index = divmod(int(flat_index), len(unique_days))
+            day = unique_days[day_index]
+            if assigned[stop] or remaining.get((day, slots[stop]), 0) == 0:
+                continue
+            new_assignment[stop] = day
+            assigned[stop] = True
+            remaining[day, slots[stop]] -= 1
+
+        if np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+    return assignment.tolist()
+
+
+def _order_slot(distances : np.ndarray, stops : List[int], previous : Optional[int]) -> List[int]:
+    """
+    Order the stops of one slot as an open path starting after the previous stop of the day.
+
+    The path is built by nearest neighbour, from the previous stop if there is one or else from
+    the outlying stop giving the shortest path, then improved with 2-opt segment reversals.
+    """
+    if len(stops) <= 1:
+        return list(stops)
+
+    if previous is not None:
+        tour = _nearest_neighbour(distances, stops, previous)[1:]
+    else:
+        # Open paths tend to start at an extremity, so only the most outlying stops are tried
+        spread = distances[np.ix_(stops, stops)].sum(axis=1)
+        starts = [stops[index] for index in np.argsort(-spread, kind='stable')[:MAX_START_CANDIDATES]]
+        tour = min(
+            (_nearest_neighbour(distances, stops, start) for start in starts),
+            key=lambda tour: _path_length(distances, tour),
+        )
+    return _two_opt(distances, tour, previous)
+
+
+def _nearest_neighbour(distances : np.ndarray, stops : List[int], start : int) -> List[int]:
+    """Build a path from start by always moving to the closest unvisited stop."""
+    unvisited = [stop for stop in stops if stop != start]
+    tour = [start]
+    while unvisited:
+        nearest = int(np.argmin(distances[tour[-1], unvisited]))
+        tour.append(unvisited.pop(nearest))
+    return tour
+
+
+def _two_opt(distances : np.ndarray, tour : List[int], previous : Optional[int]) -> List[int]:
+    """
+    Improve an open path by reversing segments while that shortens it.
+
+    When previous is given, the path is anchored after it: the first stop may change,
+    but the path is measured from previous.
+    """
+    path = ([previous] if previous is not None else []) + list(tour)
+    offset = 1 if previous is not None else 0
+    nodes = np.array(path)
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(offset, len(nodes) - 1):
+            # Reverse nodes[i:j + 1] for every j > i at once: compare the edges around the segment
+            j = np.arange(i + 1, len(nodes))
+            before = distances[nodes[i - 1], nodes[i]] if i > 0 else 0.0
+            after = np.append(distances[nodes[j[:-1]], nodes[j[:-1] + 1]], 0.0)
+            new_before = distances[nodes[i - 1], nodes[j]] if i > 0 else np.zeros(len(j))
+            new_after = np.append(distances[nodes[i], nodes[j[:-1] + 1]], 0.0)
+            gains = before + after - new_before - new_after
+            best = int(np.argmax(gains))
+            if gains[best] > 1e-9:
+                nodes[i:j[best] + 1] = nodes[i:j[best] + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return nodes[offset:].tolist()
+
+
+def _path_length(distances : np.ndarray, tour : List[int]) -> float:
+    """Length of an open path."""
+    return float(distances[tour[:-1], tour[1:]].sum()) if len(tour) > 1 else 0.0
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import User, Itinerary, Activity, LocationDetails, Image
+from .models import User, Itinerary, Activity, LocationDetails, Image, ItineraryJob
+from .images import IMAGE_SIZES, split_image_urls
 from collections import defaultdict
 from typing import Dict, List, Any
 from django.utils import timezone
@@ -51,6 +52,7 @@ class ItineraryRequestSerializer(serializers.Serializer):
     must_includes = serializers.ListField(child=serializers.CharField(max_length=255))
     start_date = serializers.DateField(format='%Y-%m-%d')
     end_date = serializers.DateField(format='%Y-%m-%d')
+    use_cache = serializers.BooleanField(default=True)
 
     def validate(self, data):
         if data['end_date'] <= data['start_date']:
@@ -62,22 +64,59 @@ class ItineraryRequestSerializer(serializers.Serializer):
         return data
     
 
+class NearbyLocationsRequestSerializer(serializers.Serializer):
+    """
+    Serializer for nearby locations request.
+    """
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(min_value=0, max_value=100, default=5)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
 class LocationDetailsSerializer(serializers.ModelSerializer):
     """
     Serializer for LocationDetails model.
     """
     class Meta:
         model = LocationDetails
-        fields = ['id', 'name', 'street1', 'city', 'state', 'country', 'postalcode', 'address_string', 'latitude', 'longitude', 'ranking', 'rating']
+        fields = ['id', 'name', 'street1', 'city', 'state', 'country', 'postalcode', 'address_string', 'latitude', 'longitude', 'ranking', 'ranking_position', 'rating']
+
+
+class NearbyLocationSerializer(LocationDetailsSerializer):
+    """
+    Serializer for LocationDetails model with the distance to the searched point.
+    """
+    distance_km = serializers.FloatField(read_only=True)
+
+    class Meta(LocationDetailsSerializer.Meta):
+        fields = LocationDetailsSerializer.Meta.fields + ['distance_km']
 
 
 class ImageSerializer(serializers.ModelSerializer):
     """
-    Serializer for Image model.
+    Serializer for Image model, representing an image by the URL of each of its sizes.
+
+    The URLs are split into the compact fields of the model when saved, and rebuilt when serialized.
     """
+    thumbnail = serializers.URLField(allow_null=True, required=False)
+    small = serializers.URLField(allow_null=True, required=False)
+    medium = serializers.URLField(allow_null=True, required=False)
+    large = serializers.URLField(allow_null=True, required=False)
+    original = serializers.URLField(allow_null=True, required=False)
+
     class Meta:
         model = Image
-        fields = ['location', 'thumbnail', 'small', 'medium', 'large', 'original']
+        fields = ['location', *IMAGE_SIZES]
+
+    def validate(self, attrs: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the URLs of the sizes by their shared prefix and suffix and the variant of each size."""
+        urls = {size: attrs.pop(size, None) for size in IMAGE_SIZES}
+        return {**attrs, **split_image_urls(urls)}
+
+    def to_representation(self, instance: Image) -> Dict[str, Any]:
+        """Represent the image by its location and the URL of every size."""
+        return {'location': instance.location_id, **instance.urls()}
 
 
 class ActivitySerializer(serializers.ModelSerializer):
@@ -86,7 +125,53 @@ class ActivitySerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = Activity
-        fields = ['name', 'itinerary', 'day', 'time_of_day', 'duration', 'description', 'location']
+        fields = ['name', 'itinerary', 'day', 'time_of_day', 'position', 'travel_distance_km', 'duration', 'description', 'location']
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """
+    List serializer saving all items with a single bulk_create.
+
+    Set ignore_conflicts = True in the Meta of the child serializer to skip rows
+    whose primary key already exists.
+    """
+    def create(self, validated_data: List[Dict[str, Any]]) -> List[Any]:
+        model = self.child.Meta.model
+        return model.objects.bulk_create(
+            [model(**item) for item in validated_data],
+            ignore_conflicts=getattr(self.child.Meta, 'ignore_conflicts', False)
+        )
+
+
+class LocationDetailsBulkSerializer(LocationDetailsSerializer):
+    """
+    Serializer for inserting LocationDetails in bulk, skipping ids that already exist.
+    """
+    class Meta(LocationDetailsSerializer.Meta):
+        list_serializer_class = BulkCreateListSerializer
+        extra_kwargs = {'id': {'validators': []}}
+        ignore_conflicts = True
+
+
+class ImageBulkSerializer(ImageSerializer):
+    """
+    Serializer for inserting Image rows in bulk, without a lookup per location.
+    """
+    location = serializers.IntegerField(source='location_id')
+
+    class Meta(ImageSerializer.Meta):
+        list_serializer_class = BulkCreateListSerializer
+
+
+class ActivityBulkSerializer(ActivitySerializer):
+    """
+    Serializer for inserting Activity rows in bulk, without a lookup per itinerary and location.
+    """
+    itinerary = serializers.IntegerField(source='itinerary_id')
+    location = serializers.IntegerField(source='location_id')
+
+    class Meta(ActivitySerializer.Meta):
+        list_serializer_class = BulkCreateListSerializer
 
 
 class ItinerarySerializer(serializers.ModelSerializer):
@@ -98,6 +183,15 @@ class ItinerarySerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'start_date', 'end_date', 'total_days', 'destination', 'image_url', 'name']
 
 
+class ItineraryListSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the lightweight Itinerary representation used in lists.
+    """
+    class Meta:
+        model = Itinerary
+        fields = ['id', 'start_date', 'end_date', 'total_days', 'destination', 'image_url', 'name', 'createdAt']
+
+
 class ActivityResponseSerializer(serializers.ModelSerializer):
     """
     Serializer for Activity model with additional place details and images.
@@ -107,12 +201,12 @@ class ActivityResponseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Activity
-        fields = ['name', 'itinerary', 'day', 'time_of_day', 'duration', 'description', 'place_details', 'place_images']
+        fields = ['name', 'itinerary', 'day', 'time_of_day', 'position', 'travel_distance_km', 'duration', 'description', 'place_details', 'place_images']
 
 
 class ItineraryResponseSerializer(serializers.ModelSerializer):
     """
-    Serializer for Itinerary model with grouped activities.
+    Serializer for Itinerary model with grouped activities and the travel distance of each day.
     """
     activities = serializers.SerializerMethodField()
     
@@ -123,20 +217,40 @@ class ItineraryResponseSerializer(serializers.ModelSerializer):
     def get_activities(self, obj: Itinerary) -> Dict[int, List[Dict[str, Any]]]:
         """
         Group activities by day for the itinerary.
+
+        Locations are joined and their images prefetched, so the number of queries
+        does not depend on the number of activities.
         """
-        activities = Activity.objects.filter(itinerary=obj)
+        activities = (
+            Activity.objects.filter(itinerary=obj)
+            .select_related('location')
+            .prefetch_related('location__image_set')
+            .order_by('position', 'id')
+        )
         grouped_activities = defaultdict(list)
 
-        for activity in activities:
-            day = int(activity.day)
-            grouped_activities[day].append(ActivityResponseSerializer(activity).data)
+        for activity in ActivityResponseSerializer(activities, many=True).data:
+            day = int(activity['day'])
+            grouped_activities[day].append(activity)
 
         return dict(grouped_activities)  # Convert defaultdict to regular dict for serialization
 
     def to_representation(self, instance: Itinerary) -> Dict[str, Any]:
         """
-        Custom representation of the Itinerary instance.
+        Custom representation of the Itinerary instance, adding the kilometres travelled each day.
         """
         representation = super().to_representation(instance)
-        representation['activities'] = self.get_activities(instance)
+        representation['day_distances'] = {
+            day: round(sum(activity['travel_distance_km'] or 0 for activity in activities), 3)
+            for day, activities in representation['activities'].items()
+        }
         return representation
+
+
+class ItineraryJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for ItineraryJob model.
+    """
+    class Meta:
+        model = ItineraryJob
+        fields = ['id', 'status', 'stage', 'progress_completed', 'progress_total', 'error', 'itinerary', 'createdAt', 'updatedAt']
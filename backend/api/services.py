@@ -1,22 +1,281 @@
 import requests
+import httpx
+import asyncio
 import json
+import logging
+import hashlib
+import random
+import re
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, List, Optional
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from fuzzywuzzy import fuzz
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import gemini_response_cache
+from .instrumentation import span
+from .json_stream import JsonArrayStreamParser
+from .models import OutboundEmail
+from .outbox import EmailOutbox, email_outbox
+from .ratelimit import RateLimiter, RateLimitExceeded
+from rapidfuzz import fuzz, process
+
+
+logger = logging.getLogger(__name__)
+
+# Rate limited endpoint of each upstream URL path, see RateLimiter
+UPSTREAM_ENDPOINTS = (
+    (re.compile(r':(?:streamG|g)enerateContent'), 'gemini.generate'),
+    (re.compile(r'/location/search'), 'tripadvisor.search'),
+    (re.compile(r'/location/\d+/details'), 'tripadvisor.details'),
+    (re.compile(r'/location/\d+/photos'), 'tripadvisor.images'),
+)
+
+
+def upstream_endpoint(url : str) -> Optional[str]:
+    """Return the rate limited endpoint of an upstream URL, or None if it is not limited."""
+    for pattern, endpoint in UPSTREAM_ENDPOINTS:
+        if pattern.search(url):
+            return endpoint
+    return None
+
+
+class UpstreamRetry(Retry):
+    """
+    Retry policy of the upstream API sessions.
+
+    Idempotent requests are retried on connection and read errors, 429 and 5xx responses.
+    A POST, like a Gemini generation, may have been processed once it was sent, so it is only
+    retried when it could not connect, or was answered with 429 or 503, which tell that it was
+    not processed. A POST timing out is never retried, so it holds its worker for one read
+    timeout at most.
+
+    Retries are requests to the upstream APIs like any other, so each one takes a token of
+    its endpoint from the rate limiter after the backoff.
+    """
+
+    POST_RETRY_STATUSES = frozenset({429, 503})
+
+    def __init__(self, *args, rate_limiter : RateLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+        # Endpoint of the request being retried, set by increment
+        self.endpoint = None
+
+    def new(self, **kwargs) -> 'UpstreamRetry':
+        """Copy the policy for the next attempt, keeping the rate limiter."""
+        kwargs.setdefault('rate_limiter', self.rate_limiter)
+        return super().new(**kwargs)
+
+    def increment(self, method : str = None, url : str = None, *args, **kwargs) -> 'UpstreamRetry':
+        """Count a failed attempt, remembering the endpoint to throttle the retry on."""
+        retry = super().increment(method, url, *args, **kwargs)
+        retry.endpoint = upstream_endpoint(url) if url else None
+        return retry
+
+    def sleep(self, response = None) -> None:
+        """
+        Wait before retrying, then until the retry fits the rate limit of its endpoint.
+
+        Raises:
+            RateLimitExceeded: If the retry would be queued for longer than the max_wait of the limiter.
+        """
+        super().sleep(response)
+        if self.rate_limiter and self.endpoint:
+            self.rate_limiter.acquire(self.endpoint)
+
+    def is_retry(self, method : str, status_code : int, has_retry_after : bool = False) -> bool:
+        """Whether a response with this status is retried."""
+        if method.upper() == 'POST':
+            return status_code in self.POST_RETRY_STATUSES and status_code in (self.status_forcelist or ())
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def create_session(pool_size : int, max_retries : int, backoff_factor : float, rate_limiter : RateLimiter = None) -> requests.Session:
+    """
+    Create a pooled keep-alive session that retries throttled and failed requests.
+
+    Args:
+        pool_size (int): Maximum number of connections kept open per host.
+        max_retries (int): Number of retries on connection errors, 429 and 5xx responses, see UpstreamRetry.
+        backoff_factor (float): Base delay of the exponential backoff, also used as the jitter range.
+        rate_limiter (RateLimiter): Budgets the retries are counted against, if any.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = UpstreamRetry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_factor,
+        backoff_max=10,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=False,  # A long Retry-After must not pin the worker
+        raise_on_status=False,
+        rate_limiter=rate_limiter,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class AsyncHTTPClient:
+    """
+    Pooled keep-alive asyncio HTTP client that retries throttled and failed requests, like create_session.
+
+    httpx connection pools belong to the event loop they were opened in, so one
+    httpx.AsyncClient is kept per running loop; under ASGI that is one per process.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # A POST is only retried when it was not processed, see UpstreamRetry
+    POST_RETRY_STATUSES = (429, 503)
+    POST_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+    def __init__(self, max_connections : int, max_keepalive_connections : int, max_retries : int, backoff_factor : float, rate_limiter : RateLimiter = None):
+        """
+        Initialize the client.
+
+        Args:
+            max_connections (int): Maximum number of connections open at once, in flight or idle.
+            max_keepalive_connections (int): Maximum number of idle connections kept open.
+            max_retries (int): Number of retries on transport errors, 429 and 5xx responses, see UpstreamRetry.
+            backoff_factor (float): Base delay of the exponential backoff, also used as the jitter range.
+            rate_limiter (RateLimiter): Budgets the retries are counted against, if any.
+        """
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = rate_limiter
+        self._clients = weakref.WeakKeyDictionary()
+
+    async def request(self, method : str, url : str, timeout : tuple, **kwargs) -> httpx.Response:
+        """
+        Send a request, retrying it with exponential backoff.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL to request.
+            timeout (tuple): (connect, read) timeout in seconds.
+            **kwargs: Passed to httpx.AsyncClient.request, e.g. params or json.
+
+        Returns:
+            httpx.Response: The last response, which may still have a 429 or 5xx status.
+
+        Raises:
+            httpx.TransportError: If the last attempt failed without a response.
+            RateLimitExceeded: If a retry was queued too long by the rate limiter.
+        """
+        connect_timeout, read_timeout = timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._client().request(
+                    method, url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs
+                )
+                if attempt == self.max_retries or not self._retries_status(method, response.status_code):
+                    return response
+            except httpx.TransportError as e:
+                if attempt == self.max_retries or not self._retries_error(method, e):
+                    raise
+            await self._wait_retry(url, attempt)
+
+    @asynccontextmanager
+    async def stream(self, method : str, url : str, timeout : tuple, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Send a request and yield its response before its body is read, retrying like request.
+
+        Only opening the response is retried; errors while reading the body are raised.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL to request.
+            timeout (tuple): (connect, read) timeout in seconds, the read timeout applying between chunks.
+            **kwargs: Passed to httpx.AsyncClient.build_request, e.g. params or json.
+
+        Yields:
+            httpx.Response: The last response, which may still have a 429 or 5xx status.
+
+        Raises:
+            httpx.TransportError: If the last attempt failed without a response.
+            RateLimitExceeded: If a retry was queued too long by the rate limiter.
+        """
+        connect_timeout, read_timeout = timeout
+        client = self._client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.send(
+                    client.build_request(method, url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs),
+                    stream=True,
+                )
+            except httpx.TransportError as e:
+                if attempt == self.max_retries or not self._retries_error(method, e):
+                    raise
+            else:
+                if attempt == self.max_retries or not self._retries_status(method, response.status_code):
+                    try:
+                        yield response
+                    finally:
+                        await response.aclose()
+                    return
+                await response.aclose()
+            await self._wait_retry(url, attempt)
+
+    def _retries_status(self, method : str, status_code : int) -> bool:
+        """Whether a response with this status is retried."""
+        return status_code in (self.POST_RETRY_STATUSES if method.upper() == 'POST' else self.RETRY_STATUSES)
+
+    def _retries_error(self, method : str, error : httpx.TransportError) -> bool:
+        """Whether a request failing with this error is retried."""
+        return method.upper() != 'POST' or isinstance(error, self.POST_RETRY_ERRORS)
+
+    async def _wait_retry(self, url : str, attempt : int) -> None:
+        """Wait before retrying after a failed attempt, then until the retry fits its rate limit, like UpstreamRetry.sleep."""
+        await asyncio.sleep(self._backoff(attempt))
+        endpoint = upstream_endpoint(url)
+        if self.rate_limiter and endpoint:
+            await self.rate_limiter.aacquire(endpoint)
+
+    def _backoff(self, attempt : int) -> float:
+        """Seconds to wait before retrying after a failed attempt, with jitter."""
+        return min(10, self.backoff_factor * 2 ** attempt + random.uniform(0, self.backoff_factor))
+
+    def _client(self) -> httpx.AsyncClient:
+        """Return the httpx client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(limits=self.limits)
+        return client
 
 
 class GeminiAPIClient:
     """Client for interacting with the Gemini API to generate itinerary content."""
 
     BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+    # Same model, answering with Server-Sent Events as the text is generated
+    STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:streamGenerateContent"
     
-    def __init__(self, api_key : str):
-        """Initialize the client with the API key."""
+    def __init__(self, api_key : str, session : requests.Session = None, timeout : tuple = (3.05, 60), cache = None, rate_limiter : RateLimiter = None):
+        """
+        Initialize the client with the API key.
+
+        Args:
+            api_key (str): The Gemini API key.
+            session (requests.Session): Pooled session used for every request.
+            timeout (tuple): (connect, read) timeout in seconds for the generation endpoint.
+            cache (GeminiResponseCache): Cache of parsed responses keyed by prompt fingerprint.
+            rate_limiter (RateLimiter): Budget of the gemini.generate endpoint, if any.
+        """
         self.api_key = api_key
+        self.session = session or create_session(pool_size=1, max_retries=2, backoff_factor=0.5)
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter
 
-    def get_places_to_visit(self, destination:str, num_of_days:int, must_includes:list) -> dict:
+    def get_places_to_visit(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> dict:
         """
         Generate a list of places to visit based on the given parameters.
 
@@ -24,24 +283,111 @@ class GeminiAPIClient:
             destination (str): The travel destination.
             num_of_days (int): Number of days for the trip.
             must_includes (list): List of places that must be included in the itinerary.
+            use_cache (bool): Whether a cached response for the same prompt may be returned.
+                A fresh response is cached either way.
 
         Returns:
             dict: A dictionary containing the generated itinerary, or None if an error occurs.
         """
-        prompt = self._create_prompt(destination, num_of_days, must_includes)
-        request_body = {"contents": [{"parts": [{"text": prompt}]}]}
-        params = {"key": self.api_key}
-        
         try:
-            response = requests.post(self.BASE_URL, params=params, json=request_body)
-            response.raise_for_status()
-            text_with_json = response.json()['candidates'][0]['content']['parts'][0]['text']
-            json_string = text_with_json.replace('```json\n', '').replace('\n```', '')
-            return json.loads(json_string)
-        except (requests.RequestException, json.JSONDecodeError) as e:
-            print(f"Error in Gemini API request: {str(e)}")
+            return {"itinerary": list(self.stream_places_to_visit(destination, num_of_days, must_includes, use_cache))}
+        except (requests.RequestException, RateLimitExceeded, ValueError) as e:
+            logger.warning("Error in Gemini API request: %s", e)
             return None
 
+    def stream_places_to_visit(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> Iterator[dict]:
+        """
+        Generate the places to visit, yielding each activity as soon as Gemini has written it.
+
+        Args:
+            destination (str): The travel destination.
+            num_of_days (int): Number of days for the trip.
+            must_includes (list): List of places that must be included in the itinerary.
+            use_cache (bool): Whether a cached response for the same prompt may be returned.
+
+        Yields:
+            dict: An activity of the itinerary.
+
+        Raises:
+            requests.RequestException: If the request failed.
+            RateLimitExceeded: If the request was queued too long by the rate limiter.
+            ValueError: If the answer is not a valid JSON itinerary.
+        """
+        for activities in self.stream_activity_batches(destination, num_of_days, must_includes, use_cache):
+            yield from activities
+
+    def stream_activity_batches(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> Iterator[List[dict]]:
+        """
+        Generate the places to visit, yielding the activities as soon as Gemini has written them.
+
+        The answer is streamed and parsed incrementally, so that the first activities can be
+        looked up while the next ones are still being generated. Activities come in batches:
+        those completed by one event of the stream, or the whole itinerary when it is cached,
+        so that callers can look up each batch at once. The whole itinerary is cached once
+        the stream ended.
+
+        Args:
+            destination (str): The travel destination.
+            num_of_days (int): Number of days for the trip.
+            must_includes (list): List of places that must be included in the itinerary.
+            use_cache (bool): Whether a cached response for the same prompt may be returned.
+
+        Yields:
+            list: The activities completed since the previous batch, never empty.
+
+        Raises:
+            requests.RequestException: If the request failed.
+            RateLimitExceeded: If the request was queued too long by the rate limiter.
+            ValueError: If the answer is not a valid JSON itinerary.
+        """
+        prompt = self._create_prompt(destination, num_of_days, must_includes)
+        fingerprint = self._fingerprint(prompt)
+        if self.cache and use_cache:
+            cached_itinerary = self.cache.get(fingerprint)
+            if cached_itinerary is not None:
+                if cached_itinerary.get('itinerary'):
+                    yield cached_itinerary['itinerary']
+                return
+
+        request_body = {"contents": [{"parts": [{"text": prompt}]}]}
+        params = {"key": self.api_key, "alt": "sse"}
+
+        parser = JsonArrayStreamParser()
+        activities = []
+        self._throttle('gemini.generate')
+        # Only the request and the reads of the stream are timed, not the caller consuming each batch
+        with span('gemini.generate') as timer:
+            with self.session.post(self.STREAM_URL, params=params, json=request_body, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    batch = parser.feed(self._parse_stream_event(line))
+                    if batch:
+                        activities.extend(batch)
+                        with timer.paused():
+                            yield batch
+        parser.close()
+
+        if self.cache:
+            self.cache.set(fingerprint, {"itinerary": activities})
+
+    @staticmethod
+    def _parse_stream_event(line : str) -> str:
+        """Extract the generated text from a line of the Server-Sent Events stream, if any."""
+        if not line or not line.startswith('data:'):
+            return ''
+        candidates = json.loads(line[len('data:'):]).get('candidates') or [{}]
+        parts = candidates[0].get('content', {}).get('parts', [])
+        return ''.join(part.get('text', '') for part in parts)
+
+    def _fingerprint(self, prompt : str) -> str:
+        """Fingerprint a prompt together with the model endpoint it is sent to."""
+        return hashlib.sha256(f"{self.BASE_URL}\n{prompt}".encode()).hexdigest()
+
+    def _throttle(self, endpoint : str) -> None:
+        """Wait until a request to an endpoint fits its rate limit, if any."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire(endpoint)
+
     @staticmethod
     def _create_prompt(destination : str, num_of_days : int, must_includes : list) -> str:
         """
@@ -83,24 +429,63 @@ class TripAdvisorAPIClient:
     BASE_DETAILS_URL = "https://api.content.tripadvisor.com/api/v1/location/{place_id}/details"
     BASE_IMAGE_URL = "https://api.content.tripadvisor.com/api/v1/location/{place_id}/photos"
 
-    def __init__(self, api_key : str):
-        """Initialize the client with the API key."""
+    def __init__(self, api_key : str, session : requests.Session = None, timeouts : dict = None, rate_limiter : RateLimiter = None):
+        """
+        Initialize the client with the API key.
+
+        Args:
+            api_key (str): The TripAdvisor API key.
+            session (requests.Session): Pooled session used for every request.
+            timeouts (dict): (connect, read) timeout in seconds keyed by endpoint: search, details and images.
+            rate_limiter (RateLimiter): Budgets of the tripadvisor.search, tripadvisor.details and
+                tripadvisor.images endpoints, if any.
+        """
         self.api_key = api_key
-        
+        self.session = session or create_session(pool_size=10, max_retries=2, backoff_factor=0.5)
+        self.timeouts = {"search": (3.05, 10), "details": (3.05, 10), "images": (3.05, 10), **(timeouts or {})}
+        self.rate_limiter = rate_limiter
+
     @staticmethod
-    def is_match_place_name(query : str, result : str, threshold : int = 50) -> bool:
+    def match_place_names(place_names : list[str], candidates : list[list[str]], threshold : int = 50) -> list[dict]:
         """
-        Check if the query matches the result using fuzzy string matching.
+        Find the best matching candidate for every place name in a single batch.
+
+        All (place name, candidate) pairs are scored in one call to the C implementation
+        of fuzz.ratio on lowercase strings, and the highest scoring candidate of each place wins.
 
         Args:
-            query (str): The search query.
-            result (str): The result to compare against.
+            place_names (list): The searched place names.
+            candidates (list): For each place name, the names of its search results.
             threshold (int): The minimum similarity score to consider a match.
 
         Returns:
-            bool: True if the strings match, False otherwise.
+            list: For each place name, a dictionary with the index of the best candidate
+                (None if no candidate reaches the threshold), its score, and the scores of
+                all candidates in order.
         """
-        return fuzz.ratio(query.lower(), result.lower()) >= threshold
+        # Pair every candidate with its own place name, so that only those pairs are scored.
+        # A plan has a few dozen pairs at most, fewer than it takes for worker threads to pay off
+        paired_names = [place_name for place_name, names in zip(place_names, candidates) for _ in names]
+        all_candidates = [name for names in candidates for name in names]
+        scores = (
+            process.cpdist(paired_names, all_candidates, scorer=fuzz.ratio, processor=str.lower, workers=1)
+            if all_candidates else None
+        )
+
+        matches = []
+        offset = 0
+        for names in candidates:
+            place_scores = scores[offset:offset + len(names)].tolist() if names else []
+            offset += len(names)
+            best = max(range(len(place_scores)), key=place_scores.__getitem__, default=None)
+            if best is not None and place_scores[best] < threshold:
+                best = None
+            matches.append({
+                "index": best,
+                "score": place_scores[best] if best is not None else None,
+                "scores": place_scores,
+            })
+        return matches
 
     def get_tourist_place_id(self, place_name : str, destination : str) -> str:
         """
@@ -113,18 +498,56 @@ class TripAdvisorAPIClient:
         Returns:
             str: The TripAdvisor location ID if found, None otherwise.
         """
-        params = {"key": self.api_key, "searchQuery": f"{place_name}, {destination}"}
         try:
-            response = requests.get(self.BASE_SEARCH_URL, params=params, timeout=10)
-            response.raise_for_status()
-            results = response.json().get('data', [])
-            for result in results:
-                if self.is_match_place_name(place_name, result['name']):
-                    return result['location_id']
-        except requests.RequestException as e:
-            print(f"Error in TripAdvisor search request: {str(e)}")
+            return self.search_tourist_place_id(place_name, destination)
+        except (requests.RequestException, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor search request: %s", e)
         return None
 
+    def search_tourist_place_id(self, place_name : str, destination : str) -> str:
+        """
+        Search the TripAdvisor location ID for a given place name and destination.
+
+        Unlike get_tourist_place_id, request errors are raised so that callers can tell
+        a failed search apart from a search without a match.
+
+        Args:
+            place_name (str): The name of the place to search for.
+            destination (str): The destination to search within.
+
+        Returns:
+            str: The TripAdvisor location ID of the best match if found, None otherwise.
+
+        Raises:
+            requests.RequestException: If the search request fails.
+            RateLimitExceeded: If the search was queued too long by the rate limiter.
+        """
+        results = self.search_places(place_name, destination)
+        match = self.match_place_names([place_name], [[result['name'] for result in results]])[0]
+        return results[match['index']]['location_id'] if match['index'] is not None else None
+
+    def search_places(self, place_name : str, destination : str) -> list[dict]:
+        """
+        Search TripAdvisor locations for a given place name and destination.
+
+        Args:
+            place_name (str): The name of the place to search for.
+            destination (str): The destination to search within.
+
+        Returns:
+            list: The raw search results, each with at least a location_id and a name.
+
+        Raises:
+            requests.RequestException: If the search request fails.
+            RateLimitExceeded: If the search was queued too long by the rate limiter.
+        """
+        params = {"key": self.api_key, "searchQuery": f"{place_name}, {destination}"}
+        self._throttle('tripadvisor.search')
+        with span('tripadvisor.search'):
+            response = self.session.get(self.BASE_SEARCH_URL, params=params, timeout=self.timeouts["search"])
+            response.raise_for_status()
+        return response.json().get('data', [])
+
     def get_place_details(self, place_id : str) -> dict:
         """
         Get details for a specific place using its TripAdvisor location ID.
@@ -138,12 +561,14 @@ class TripAdvisorAPIClient:
         url = self.BASE_DETAILS_URL.format(place_id=place_id)
         params = {"key": self.api_key}
         try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
+            self._throttle('tripadvisor.details')
+            with span('tripadvisor.details'):
+                response = self.session.get(url, params=params, timeout=self.timeouts["details"])
+                response.raise_for_status()
             data = response.json()
             return self._parse_place_details(data)
-        except requests.RequestException as e:
-            print(f"Error in TripAdvisor details request: {str(e)}")
+        except (requests.RequestException, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor details request: %s", e)
         return None
 
     @staticmethod
@@ -172,9 +597,28 @@ class TripAdvisorAPIClient:
             "longitude": place_details.get('longitude',None),
             "ranking": (place_details.get('ranking_data', {}).get('ranking_string')
                                if place_details.get('ranking_data') else None),
+            "ranking_position": TripAdvisorAPIClient._parse_ranking_position(place_details.get('ranking_data')),
             "rating": place_details.get('rating',None),
         }
 
+    @staticmethod
+    def _parse_ranking_position(ranking_data : dict) -> int:
+        """
+        Parse the position of a place in its TripAdvisor ranking.
+
+        Args:
+            ranking_data (dict): The raw ranking data, e.g. {"ranking": "3", "ranking_string": "#3 of 250 things to do"}.
+
+        Returns:
+            int: The ranking position, or None if it is not available.
+        """
+        if not ranking_data:
+            return None
+        if str(ranking_data.get('ranking', '')).isdigit():
+            return int(ranking_data['ranking'])
+        match = re.search(r'#\s*([\d,]+)', ranking_data.get('ranking_string') or '')
+        return int(match.group(1).replace(',', '')) if match else None
+
     def get_place_images(self, place_id : str) -> list[dict]:
         """
         Get images for a specific place using its TripAdvisor location ID.
@@ -188,12 +632,14 @@ class TripAdvisorAPIClient:
         url = self.BASE_IMAGE_URL.format(place_id=place_id)
         params = {"key": self.api_key}
         try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
+            self._throttle('tripadvisor.images')
+            with span('tripadvisor.images'):
+                response = self.session.get(url, params=params, timeout=self.timeouts["images"])
+                response.raise_for_status()
             data = response.json().get('data', [])
             return [self._parse_image(image,place_id) for image in data]
-        except requests.RequestException as e:
-            print(f"Error in TripAdvisor image request: {str(e)}")
+        except (requests.RequestException, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor image request: %s", e)
         return None
     
     @staticmethod
@@ -219,46 +665,288 @@ class TripAdvisorAPIClient:
 
         return parsed_image
 
+    def _throttle(self, endpoint : str) -> None:
+        """Wait until a request to an endpoint fits its rate limit, if any."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire(endpoint)
+
+
+class AsyncGeminiAPIClient(GeminiAPIClient):
+    """Asyncio counterpart of GeminiAPIClient, sharing its prompt and response cache."""
+
+    def __init__(self, api_key : str, http : AsyncHTTPClient = None, timeout : tuple = (3.05, 60), cache = None, rate_limiter : RateLimiter = None):
+        """
+        Initialize the client with the API key.
+
+        Args:
+            api_key (str): The Gemini API key.
+            http (AsyncHTTPClient): Pooled client used for every request.
+            timeout (tuple): (connect, read) timeout in seconds for the generation endpoint.
+            cache (GeminiResponseCache): Cache of parsed responses keyed by prompt fingerprint.
+            rate_limiter (RateLimiter): Budget of the gemini.generate endpoint, if any.
+        """
+        self.api_key = api_key
+        self.http = http or AsyncHTTPClient(max_connections=10, max_keepalive_connections=1, max_retries=2, backoff_factor=0.5)
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+    async def get_places_to_visit(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> dict:
+        """
+        Generate a list of places to visit based on the given parameters, see GeminiAPIClient.
+
+        Returns:
+            dict: A dictionary containing the generated itinerary, or None if an error occurs.
+        """
+        try:
+            return {"itinerary": [
+                activity async for activity in self.stream_places_to_visit(destination, num_of_days, must_includes, use_cache)
+            ]}
+        except (httpx.HTTPError, RateLimitExceeded, ValueError) as e:
+            logger.warning("Error in Gemini API request: %s", e)
+            return None
+
+    async def stream_places_to_visit(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> AsyncIterator[dict]:
+        """
+        Generate the places to visit, yielding each activity as soon as Gemini has written it, see GeminiAPIClient.
+
+        Raises:
+            httpx.HTTPError: If the request failed.
+            RateLimitExceeded: If the request was queued too long by the rate limiter.
+            ValueError: If the answer is not a valid JSON itinerary.
+        """
+        async for activities in self.stream_activity_batches(destination, num_of_days, must_includes, use_cache):
+            for activity in activities:
+                yield activity
+
+    async def stream_activity_batches(self, destination:str, num_of_days:int, must_includes:list, use_cache:bool = True) -> AsyncIterator[List[dict]]:
+        """
+        Generate the places to visit, yielding the activities in batches as soon as Gemini has written them, see GeminiAPIClient.
+
+        Raises:
+            httpx.HTTPError: If the request failed.
+            RateLimitExceeded: If the request was queued too long by the rate limiter.
+            ValueError: If the answer is not a valid JSON itinerary.
+        """
+        prompt = self._create_prompt(destination, num_of_days, must_includes)
+        fingerprint = self._fingerprint(prompt)
+        if self.cache and use_cache:
+            cached_itinerary = await sync_to_async(self.cache.get)(fingerprint)
+            if cached_itinerary is not None:
+                if cached_itinerary.get('itinerary'):
+                    yield cached_itinerary['itinerary']
+                return
+
+        request_body = {"contents": [{"parts": [{"text": prompt}]}]}
+        params = {"key": self.api_key, "alt": "sse"}
+
+        parser = JsonArrayStreamParser()
+        activities = []
+        await self._throttle('gemini.generate')
+        with span('gemini.generate') as timer:
+            async with self.http.stream("POST", self.STREAM_URL, self.timeout, params=params, json=request_body) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    batch = parser.feed(self._parse_stream_event(line))
+                    if batch:
+                        activities.extend(batch)
+                        with timer.paused():
+                            yield batch
+        parser.close()
+
+        if self.cache:
+            await sync_to_async(self.cache.set)(fingerprint, {"itinerary": activities})
+
+    async def _throttle(self, endpoint : str) -> None:
+        """Wait on the event loop until a request to an endpoint fits its rate limit, if any."""
+        if self.rate_limiter:
+            await self.rate_limiter.aacquire(endpoint)
+
+
+class AsyncTripAdvisorAPIClient(TripAdvisorAPIClient):
+    """Asyncio counterpart of TripAdvisorAPIClient, sharing its matching and parsing."""
+
+    def __init__(self, api_key : str, http : AsyncHTTPClient = None, timeouts : dict = None, rate_limiter : RateLimiter = None):
+        """
+        Initialize the client with the API key.
+
+        Args:
+            api_key (str): The TripAdvisor API key.
+            http (AsyncHTTPClient): Pooled client used for every request.
+            timeouts (dict): (connect, read) timeout in seconds keyed by endpoint: search, details and images.
+            rate_limiter (RateLimiter): Budgets of the TripAdvisor endpoints, if any.
+        """
+        self.api_key = api_key
+        self.http = http or AsyncHTTPClient(max_connections=10, max_keepalive_connections=10, max_retries=2, backoff_factor=0.5)
+        self.timeouts = {"search": (3.05, 10), "details": (3.05, 10), "images": (3.05, 10), **(timeouts or {})}
+        self.rate_limiter = rate_limiter
+
+    async def get_tourist_place_id(self, place_name : str, destination : str) -> str:
+        """
+        Get the TripAdvisor location ID for a given place name and destination, see TripAdvisorAPIClient.
+
+        Returns:
+            str: The TripAdvisor location ID if found, None otherwise.
+        """
+        try:
+            return await self.search_tourist_place_id(place_name, destination)
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor search request: %s", e)
+        return None
+
+    async def search_tourist_place_id(self, place_name : str, destination : str) -> str:
+        """
+        Search the TripAdvisor location ID for a given place name and destination.
+
+        Returns:
+            str: The TripAdvisor location ID of the best match if found, None otherwise.
+
+        Raises:
+            httpx.HTTPError: If the search request fails.
+        """
+        results = await self.search_places(place_name, destination)
+        match = self.match_place_names([place_name], [[result['name'] for result in results]])[0]
+        return results[match['index']]['location_id'] if match['index'] is not None else None
+
+    async def search_places(self, place_name : str, destination : str) -> list[dict]:
+        """
+        Search TripAdvisor locations for a given place name and destination.
+
+        Returns:
+            list: The raw search results, each with at least a location_id and a name.
+
+        Raises:
+            httpx.HTTPError: If the search request fails.
+        """
+        params = {"key": self.api_key, "searchQuery": f"{place_name}, {destination}"}
+        await self._throttle('tripadvisor.search')
+        with span('tripadvisor.search'):
+            response = await self.http.request("GET", self.BASE_SEARCH_URL, self.timeouts["search"], params=params)
+            response.raise_for_status()
+        return response.json().get('data', [])
+
+    async def get_place_details(self, place_id : str) -> dict:
+        """
+        Get details for a specific place using its TripAdvisor location ID.
+
+        Returns:
+            dict: A dictionary containing place details, or None if an error occurs.
+        """
+        url = self.BASE_DETAILS_URL.format(place_id=place_id)
+        params = {"key": self.api_key}
+        try:
+            await self._throttle('tripadvisor.details')
+            with span('tripadvisor.details'):
+                response = await self.http.request("GET", url, self.timeouts["details"], params=params)
+                response.raise_for_status()
+            return self._parse_place_details(response.json())
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor details request: %s", e)
+        return None
+
+    async def get_place_images(self, place_id : str) -> list[dict]:
+        """
+        Get images for a specific place using its TripAdvisor location ID.
+
+        Returns:
+            list: A list of dictionaries containing image details, or None if an error occurs.
+        """
+        url = self.BASE_IMAGE_URL.format(place_id=place_id)
+        params = {"key": self.api_key}
+        try:
+            await self._throttle('tripadvisor.images')
+            with span('tripadvisor.images'):
+                response = await self.http.request("GET", url, self.timeouts["images"], params=params)
+                response.raise_for_status()
+            data = response.json().get('data', [])
+            return [self._parse_image(image, place_id) for image in data]
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            logger.warning("Error in TripAdvisor image request: %s", e)
+        return None
+
+    async def _throttle(self, endpoint : str) -> None:
+        """Wait on the event loop until a request to an endpoint fits its rate limit, if any."""
+        if self.rate_limiter:
+            await self.rate_limiter.aacquire(endpoint)
+
 
 class EmailService:
-    """Service for sending verification emails."""
+    """Service for composing the emails sent to users."""
 
-    @staticmethod
-    def send_verification_email(email_to : str, token : str) -> bool:
+    def __init__(self, outbox : EmailOutbox):
+        """
+        Initialize the service.
+
+        Args:
+            outbox (EmailOutbox): The outbox emails are queued in.
+        """
+        self.outbox = outbox
+
+    def queue_verification_email(self, email_to : str, token : str) -> OutboundEmail:
         """
-        Send a verification email to the user.
+        Queue a verification email to the user, sent by the send_queued_emails command.
 
         Args:
             email_to (str): The recipient's email address.
             token (str): The verification token.
 
         Returns:
-            bool: True if the email was sent successfully, False otherwise.
+            OutboundEmail: The pending email.
         """
-        smtp_server = settings.EMAIL_HOST
-        smtp_port = settings.EMAIL_PORT
-
-        msg = MIMEMultipart()
-        msg['From'] = settings.EMAIL_HOST_USER
-        msg['To'] = email_to
-        msg['Subject'] = "Email Verification for PlanMyItinerary"
-
         verification_link = f"{settings.BACKEND_URL}/api/user/verify-email/{token}/"
         body = f'Click the link below to verify your email:\n\n{verification_link}'
-        msg.attach(MIMEText(body, 'plain'))
+        return self.outbox.enqueue(email_to, "Email Verification for PlanMyItinerary", body)
+
 
-        try:
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-                server.send_message(msg)
-            return True
-        except smtplib.SMTPException as e:
-            print(f"Failed to send verification email to {email_to}: {str(e)}")
-            return False
-        
-        
 # Initialize service instances
-email_service = EmailService()
-gemini_client = GeminiAPIClient(settings.GEMINI_API_KEY)
-trip_advisor_client = TripAdvisorAPIClient(settings.TRIPADVISOR_API_KEY)
\ No newline at end of file
+email_service = EmailService(email_outbox)
+upstream_rate_limiter = RateLimiter(
+    {
+        'gemini.generate': settings.GEMINI_RATE_LIMIT,
+        'tripadvisor.search': settings.TRIPADVISOR_SEARCH_RATE_LIMIT,
+        'tripadvisor.details': settings.TRIPADVISOR_DETAILS_RATE_LIMIT,
+        'tripadvisor.images': settings.TRIPADVISOR_IMAGES_RATE_LIMIT,
+    },
+    burst=settings.RATE_LIMIT_BURST,
+    max_wait=settings.RATE_LIMIT_MAX_WAIT,
+    directory=settings.RATE_LIMIT_DIR,
+)
+gemini_client = GeminiAPIClient(
+    settings.GEMINI_API_KEY,
+    session=create_session(settings.HTTP_POOL_SIZE, settings.HTTP_MAX_RETRIES, settings.HTTP_BACKOFF_FACTOR, upstream_rate_limiter),
+    timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.GEMINI_READ_TIMEOUT),
+    cache=gemini_response_cache,
+    rate_limiter=upstream_rate_limiter,
+)
+trip_advisor_client = TripAdvisorAPIClient(
+    settings.TRIPADVISOR_API_KEY,
+    session=create_session(settings.HTTP_POOL_SIZE, settings.HTTP_MAX_RETRIES, settings.HTTP_BACKOFF_FACTOR, upstream_rate_limiter),
+    timeouts={
+        endpoint: (settings.HTTP_CONNECT_TIMEOUT, settings.TRIPADVISOR_READ_TIMEOUT)
+        for endpoint in ("search", "details", "images")
+    },
+    rate_limiter=upstream_rate_limiter,
+)
+async_http_client = AsyncHTTPClient(
+    max_connections=settings.HTTP_ASYNC_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.HTTP_POOL_SIZE,
+    max_retries=settings.HTTP_MAX_RETRIES,
+    backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+    rate_limiter=upstream_rate_limiter,
+)
+async_gemini_client = AsyncGeminiAPIClient(
+    settings.GEMINI_API_KEY,
+    http=async_http_client,
+    timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.GEMINI_READ_TIMEOUT),
+    cache=gemini_response_cache,
+    rate_limiter=upstream_rate_limiter,
+)
+async_trip_advisor_client = AsyncTripAdvisorAPIClient(
+    settings.TRIPADVISOR_API_KEY,
+    http=async_http_client,
+    timeouts={
+        endpoint: (settings.HTTP_CONNECT_TIMEOUT, settings.TRIPADVISOR_READ_TIMEOUT)
+        for endpoint in ("search", "details", "images")
+    },
+    rate_limiter=upstream_rate_limiter,
+)
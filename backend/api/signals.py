@@ -0,0 +1,35 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Itinerary, Activity, LocationDetails, Image
+from .cache import itinerary_payload_cache
+from .instrumentation import install_query_timer
+
+
+# Time every ORM query as a db span of the current trace
+connection_created.connect(install_query_timer, dispatch_uid='api.install_query_timer')
+
+
+@receiver([post_save, post_delete], sender=Itinerary)
+def invalidate_itinerary_payload(sender, instance: Itinerary, **kwargs) -> None:
+    """Drop the stored payload of a changed itinerary."""
+    itinerary_payload_cache.invalidate([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Activity)
+def invalidate_activity_payload(sender, instance: Activity, **kwargs) -> None:
+    """Drop the stored payload of the itinerary of a changed activity."""
+    itinerary_payload_cache.invalidate([instance.itinerary_id])
+
+
+@receiver([post_save, post_delete], sender=LocationDetails)
+def invalidate_location_payloads(sender, instance: LocationDetails, **kwargs) -> None:
+    """Drop the stored payloads of the itineraries visiting a changed location."""
+    itinerary_payload_cache.invalidate_locations([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Image)
+def invalidate_image_payloads(sender, instance: Image, **kwargs) -> None:
+    """Drop the stored payloads of the itineraries visiting the location of a changed image."""
+    itinerary_payload_cache.invalidate_locations([instance.location_id])
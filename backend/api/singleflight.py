@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable
+
+from .instrumentation import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    The first caller of a key runs the call and the callers arriving while it is in flight wait
+    for its result, or its exception, instead of repeating it. Nothing is kept once the call
+    returned: this deduplicates work in flight, it is not a cache. Thread-safe.
+    """
+
+    def __init__(self, name : str):
+        """
+        Initialize the group.
+
+        Args:
+            name (str): Name of the coalesced calls in the metrics, e.g. tripadvisor.details.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key : Hashable, fn : Callable[..., Any], *args : Any) -> Any:
+        """
+        Call fn(*args), unless a call for the same key is in flight, and return its result.
+
+        Args:
+            key (Hashable): Identifies calls returning the same result, e.g. a place_id.
+            fn (Callable): The call to make.
+            *args: Arguments of the call.
+
+        Returns:
+            The result of the call, shared by every caller of the key while it was in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            metrics.increment('planmyitinerary_coalesced_calls_total', {'call': self.name})
+            return call.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """
+    Asyncio counterpart of SingleFlight.
+
+    The call runs as its own task, so that a caller being cancelled, like a client closing
+    its stream, does not cancel the call for the other callers.
+    """
+
+    def __init__(self, name : str):
+        """
+        Initialize the group.
+
+        Args:
+            name (str): Name of the coalesced calls in the metrics, e.g. tripadvisor.details.
+        """
+        self.name = name
+        # Tasks belong to the event loop they were created in, so calls are grouped by loop
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key : Hashable, fn : Callable[..., Awaitable[Any]], *args : Any) -> Any:
+        """Await fn(*args), unless a call for the same key is in flight, see SingleFlight.do."""
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            metrics.increment('planmyitinerary_coalesced_calls_total', {'call': self.name})
+        return await asyncio.shield(task)
+
+
+metrics.describe('planmyitinerary_coalesced_calls_total', "Calls that waited for an identical call in flight instead of repeating it.")
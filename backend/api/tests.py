@@ -1,3 +1,1925 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import gzip
+import json
+import io
+import multiprocessing
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse, JsonResponse as DjangoJsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+import httpx
+import requests
+from rapidfuzz import fuzz
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+from .benchmark import StubUpstreamServer, load_cassette, run_load, stub_upstreams
+from .conditional import encoded_etag, make_etag, not_modified, set_etag
+from .cache import MAX_QUERY_LENGTH, GeminiResponseCache, PlaceSearchCache, gemini_response_cache, itinerary_payload_cache, place_search_cache
+from .generation import ItineraryGenerator, PlaceLookups
+from .geo import bounding_box, haversine_km, nearby_locations
+from .jobs import ItineraryJobQueue
+from .outbox import EmailOutbox
+from .pagination import KeysetPagination
+from .routing import optimize_route
+from .images import split_image_urls
+from .instrumentation import metrics, trace
+from .json_stream import JsonArrayStreamParser
+from .middleware import MIN_COMPRESSED_SIZE, CompressionMiddleware, brotli
+from .models import Itinerary, Activity, LocationDetails, Image, PlaceSearchResult, GeminiResponse, ItineraryJob, ItineraryPayload, OutboundEmail
+from .renderers import FastJSONParser, FastJSONRenderer, JsonResponse
+from .serializers import ItineraryResponseSerializer
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .services import AsyncGeminiAPIClient, AsyncHTTPClient, GeminiAPIClient, TripAdvisorAPIClient, create_session, upstream_rate_limiter
+from .views.base import AsyncAPIView
+from .views.itineraries import _generation_tasks
+
+
+def create_itinerary(user: User, num_of_activities: int) -> Itinerary:
+    """Create an itinerary whose activities each visit their own location with two images."""
+    itinerary = Itinerary.objects.create(
+        user=user,
+        start_date=date(2030, 1, 1),
+        end_date=date(2030, 1, 3),
+        total_days=3,
+        destination="Paris, France",
+        name="Paris Itinerary for 3 days",
+    )
+    last_location_id = LocationDetails.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for index in range(num_of_activities):
+        location = LocationDetails.objects.create(id=last_location_id + index + 1, name=f"Place {index}")
+        for size in ("small", "large"):
+            Image.objects.create(location=location, **split_image_urls({"original": f"https://media.example.com/{location.id}/{size}.jpg"}))
+        Activity.objects.create(
+            name=f"Place {index}",
+            itinerary=itinerary,
+            description="A place to visit.",
+            location=location,
+            duration="2 hours",
+            day=str(index % 3 + 1),
+            time_of_day="morning",
+        )
+    return itinerary
+
+
+class ItineraryResponseSerializerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+
+    def count_queries(self, itinerary: Itinerary) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            ItineraryResponseSerializer(itinerary).data
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_number_of_activities(self):
+        small_itinerary = create_itinerary(self.user, 2)
+        large_itinerary = create_itinerary(self.user, 12)
+
+        self.assertEqual(self.count_queries(small_itinerary), self.count_queries(large_itinerary))
+        with self.assertNumQueries(2):
+            ItineraryResponseSerializer(large_itinerary).data
+
+    def test_activities_are_grouped_by_day_with_place_details_and_images(self):
+        itinerary = create_itinerary(self.user, 4)
+
+        activities = ItineraryResponseSerializer(itinerary).data['activities']
+
+        self.assertEqual(sorted(activities), [1, 2, 3])
+        self.assertEqual([activity['name'] for activity in activities[1]], ["Place 0", "Place 3"])
+        self.assertEqual(activities[1][0]['place_details']['name'], "Place 0")
+        self.assertEqual(len(activities[1][0]['place_images']), 2)
+
+    def test_detail_view_query_count_is_constant(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        small_itinerary = create_itinerary(self.user, 2)
+        large_itinerary = create_itinerary(self.user, 12)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            client.get(f"/api/itinerary/{small_itinerary.id}/")
+        with CaptureQueriesContext(connection) as large_queries:
+            response = client.get(f"/api/itinerary/{large_itinerary.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_detail_view_returns_selected_image_sizes(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        itinerary = create_itinerary(self.user, 2)
+        location_id = itinerary.activity_set.get(name="Place 0").location_id
+
+        response = client.get(f"/api/itinerary/{itinerary.id}/?image_sizes=original&max_images=1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['activities']['1'][0]['place_images'], [
+            {'location': location_id, 'original': f"https://media.example.com/{location_id}/small.jpg"},
+        ])
+        self.assertEqual(client.get(f"/api/itinerary/{itinerary.id}/?image_sizes=huge").status_code, 400)
+
+    def test_detail_view_answers_unchanged_itinerary_with_304(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        itinerary = create_itinerary(self.user, 2)
+        url = f"/api/itinerary/{itinerary.id}/"
+
+        response = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        revalidated = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response['ETag'])
+        itinerary.activity_set.first().save()
+        changed = client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+
+class QueryPlanTests(TestCase):
+    """
+    Check that the hot lookups are answered from their composite index without a sort.
+
+    Sequential scans are disabled on PostgreSQL so that the planner picks the index even
+    on the near-empty test tables. The expected plans are, for the recent itineraries:
+
+        Limit
+          ->  Index Scan using itinerary_user_created_idx on api_itinerary
+                Index Cond: (user_id = 1)
+
+    and for the activities of one day of an itinerary:
+
+        Index Scan using activity_itinerary_day_idx on api_activity
+          Index Cond: ((itinerary_id = 1) AND ((day)::text = '1'::text))
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.itinerary = create_itinerary(self.user, 3)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertPlanUsesIndex(self, plan: str, index_name: str) -> None:
+        self.assertIn(index_name, plan)
+        if connection.vendor == 'postgresql':
+            self.assertNotIn("Sort", plan)
+        elif connection.vendor == 'sqlite':
+            self.assertNotIn("USE TEMP B-TREE", plan)
+
+    def test_recent_itineraries_use_user_created_index(self):
+        plan = Itinerary.objects.filter(user=self.user).order_by('-createdAt', '-id')[:5].explain()
+
+        self.assertPlanUsesIndex(plan, "itinerary_user_created_idx")
+
+    def test_activities_of_a_day_use_itinerary_day_index(self):
+        plan = Activity.objects.filter(itinerary=self.itinerary, day="1").order_by('time_of_day').explain()
+
+        self.assertPlanUsesIndex(plan, "activity_itinerary_day_idx")
+
+
+class RejectingThrottle(BaseThrottle):
+    """Throttle rejecting every request for 30 seconds."""
+
+    def allow_request(self, request, view):
+        return False
+
+    def wait(self):
+        return 30
+
+
+class AsyncAPIViewPolicyTests(TestCase):
+    """Check that the async itinerary views apply the DRF policies of the API."""
+
+    ENDPOINTS = [
+        ('post', "/api/itinerary/generate/"),
+        ('post', "/api/itinerary/generate/stream/"),
+        ('get', f"/api/itinerary/jobs/{uuid.uuid4()}/"),
+        ('get', "/api/itinerary/recent/"),
+        ('get', "/api/itinerary/1/"),
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.client = APIClient()
+
+    def test_requests_without_credentials_get_401_with_authenticate_header(self):
+        for method, url in self.ENDPOINTS:
+            with self.subTest(url=url):
+                response = getattr(self.client, method)(url)
+
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+                self.assertEqual(response.json(), {'detail': "Authentication credentials were not provided."})
+
+    def test_requests_with_invalid_token_get_401_with_drf_error_body(self):
+        for method, url in self.ENDPOINTS:
+            with self.subTest(url=url):
+                response = getattr(self.client, method)(url, HTTP_AUTHORIZATION="Bearer invalid")
+
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+                self.assertEqual(response.json()['code'], "token_not_valid")
+                self.assertEqual(response.json()['detail'], "Given token not valid for any token type")
+                self.assertIsInstance(response.json()['messages'], list)
+
+    def test_requests_without_permission_get_403(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        for method, url in self.ENDPOINTS:
+            with self.subTest(url=url), mock.patch.object(AsyncAPIView, 'permission_classes', [IsAdminUser]):
+                response = getattr(self.client, method)(url)
+
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(response.json(), {'detail': "You do not have permission to perform this action."})
+
+    def test_throttled_requests_get_429_with_retry_after(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        for method, url in self.ENDPOINTS:
+            with self.subTest(url=url), mock.patch.object(AsyncAPIView, 'throttle_classes', [RejectingThrottle]):
+                response = getattr(self.client, method)(url)
+
+                self.assertEqual(response.status_code, 429)
+                self.assertEqual(response['Retry-After'], "30")
+
+    def test_requests_accepting_no_rendered_media_type_get_406(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+        self.assertEqual(self.client.get("/api/itinerary/recent/", HTTP_ACCEPT="text/html").status_code, 406)
+        self.assertEqual(self.client.get("/api/itinerary/recent/", HTTP_ACCEPT="application/json").status_code, 200)
+
+
+class AsyncAPIViewParsingTests(TestCase):
+    """Check that the async itinerary views parse bodies with the DRF parsers of the API."""
+
+    BODY_ENDPOINTS = ["/api/itinerary/generate/", "/api/itinerary/generate/stream/"]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        start_date = timezone.now().date() + timedelta(days=1)
+        self.params = {
+            'destination': "Paris, France",
+            'num_of_days': 3,
+            'must_includes': ["Louvre Museum", "Eiffel Tower"],
+            'start_date': start_date.isoformat(),
+            'end_date': (start_date + timedelta(days=2)).isoformat(),
+        }
+
+    def test_unsupported_content_type_gets_415(self):
+        for url in self.BODY_ENDPOINTS:
+            with self.subTest(url=url):
+                response = self.client.post(url, "destination=Paris", content_type="text/plain")
+
+                self.assertEqual(response.status_code, 415)
+                self.assertEqual(response.json(), {'detail': 'Unsupported media type "text/plain" in request.'})
+
+    def test_malformed_json_gets_drf_parse_error(self):
+        for url in self.BODY_ENDPOINTS:
+            with self.subTest(url=url):
+                response = self.client.post(url, '{"destination": ', content_type="application/json")
+
+                self.assertEqual(response.status_code, 400)
+                self.assertTrue(response.json()['detail'].startswith("JSON parse error - "))
+
+    def test_form_and_json_bodies_are_accepted(self):
+        for format in ('json', 'multipart'):
+            with self.subTest(format=format):
+                response = self.client.post("/api/itinerary/generate/", self.params, format=format)
+
+                self.assertEqual(response.status_code, 202)
+                job = ItineraryJob.objects.get(pk=response.json()['data']['id'])
+                self.assertEqual(
+                    (job.params['destination'], job.params['num_of_days'], job.params['must_includes']),
+                    ("Paris, France", 3, ["Louvre Museum", "Eiffel Tower"])
+                )
+
+    def test_empty_body_is_validated_as_empty_data(self):
+        response = self.client.post("/api/itinerary/generate/")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('destination', response.json())
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    BODY = json.dumps([{"name": f"Place {index}", "description": "A place to visit."} for index in range(20)]).encode()
+    ETAG = make_etag('itinerary', 1)
+
+    def view(self, request):
+        """A JSON view answering conditional requests like the itinerary views."""
+        response = not_modified(request, self.ETAG)
+        if response is None:
+            response = set_etag(HttpResponse(self.BODY, content_type="application/json"), self.ETAG)
+        return response
+
+    def get(self, accept_encoding=None, view=None, **headers):
+        if accept_encoding is not None:
+            headers['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        return CompressionMiddleware(view or self.view)(RequestFactory().get("/api/itinerary/1/", **headers))
+
+    def assertEncoded(self, response, encoding):
+        self.assertEqual(response.get('Content-Encoding'), encoding)
+        self.assertEqual(response['Vary'], "Accept-Encoding")
+        if encoding is None:
+            self.assertEqual(response.content, self.BODY)
+            self.assertEqual(response['ETag'], self.ETAG)
+        else:
+            decompress = brotli.decompress if encoding == 'br' else gzip.decompress
+            self.assertEqual(decompress(response.content), self.BODY)
+            self.assertEqual(response['Content-Length'], str(len(response.content)))
+            self.assertEqual(response['ETag'], encoded_etag(self.ETAG, encoding))
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli_is_preferred_unless_gzip_has_a_higher_quality(self):
+        for accept_encoding, encoding in [
+            ("gzip, deflate, br", 'br'),
+            ("br;q=0.8, gzip;q=0.8", 'br'),
+            ("br;q=0.5, gzip", 'gzip'),
+            ("*", 'br'),
+            ("gzip;q=0.2, *;q=0.1", 'gzip'),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEncoded(self.get(accept_encoding), encoding)
+
+    def test_codings_refused_with_q_0_are_not_used(self):
+        for accept_encoding, encoding in [
+            ("br;q=0, gzip", 'gzip'),
+            ("br;q=0, *", 'gzip'),
+            ("gzip;q=0, br;q=0", None),
+            ("*;q=0", None),
+            ("gzip, br;q=invalid", 'gzip'),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEncoded(self.get(accept_encoding), encoding)
+
+    def test_identity_is_sent_when_no_supported_coding_is_accepted(self):
+        for accept_encoding in [None, "", "identity", "deflate, identity;q=0.5", "compress"]:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEncoded(self.get(accept_encoding), None)
+
+    def test_gzip_is_used_without_brotli(self):
+        with mock.patch('api.middleware.brotli', None):
+            self.assertEncoded(self.get("br, gzip;q=0.5"), 'gzip')
+            self.assertEncoded(self.get("br"), None)
+
+    def test_bodies_below_the_threshold_or_incompressible_are_sent_as_they_are(self):
+        for body, compressed in [
+            (b"a" * (MIN_COMPRESSED_SIZE - 1), False),
+            (b"a" * MIN_COMPRESSED_SIZE, True),
+            (os.urandom(512), False),
+        ]:
+            with self.subTest(size=len(body), compressed=compressed):
+                response = self.get("gzip", view=lambda request: HttpResponse(body))
+                self.assertEqual(response.has_header('Content-Encoding'), compressed)
+                self.assertEqual(gzip.decompress(response.content) if compressed else response.content, body)
+
+    def test_streaming_responses_are_not_compressed(self):
+        def stream(request):
+            return StreamingHttpResponse(iter([b"event: progress\ndata: {}\n\n"] * 50), content_type="text/event-stream")
+
+        async def astream(request):
+            return stream(request)
+
+        response = self.get("gzip, br", view=stream)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), b"event: progress\ndata: {}\n\n" * 50)
+
+        request = RequestFactory().get("/api/itinerary/generate/stream/", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = asyncio.run(CompressionMiddleware(astream)(request))
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_encoded_and_no_transform_responses_are_left_alone(self):
+        def encoded(request):
+            return HttpResponse(gzip.compress(self.BODY), headers={'Content-Encoding': "gzip"})
+
+        def no_transform(request):
+            return HttpResponse(self.BODY, headers={'Cache-Control': "no-transform"})
+
+        self.assertEqual(gzip.decompress(self.get("br", view=encoded).content), self.BODY)
+        self.assertFalse(self.get("br", view=no_transform).has_header('Content-Encoding'))
+
+    def test_weak_etags_are_not_tagged(self):
+        def weak(request):
+            return HttpResponse(self.BODY, headers={'ETag': 'W/"1"'})
+
+        response = self.get("gzip", view=weak)
+        self.assertEqual((response['Content-Encoding'], response['ETag']), ("gzip", 'W/"1"'))
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_revalidation_with_the_etag_of_any_coding_gets_304(self):
+        for encoding in ('br', 'gzip', None):
+            with self.subTest(encoding=encoding):
+                etag = self.get(encoding or "identity")['ETag']
+
+                response = self.get(encoding or "identity", HTTP_IF_NONE_MATCH=etag)
+
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class MetricsViewTests(TestCase):
+    def test_metrics_are_disabled_without_token(self):
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get("/api/metrics/")
+
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN="scraper-token")
+    def test_metrics_require_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+        self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer other-token").status_code, 401)
+
+        response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scraper-token")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE planmyitinerary_email_queue_depth gauge", response.content)
+
+
+class PlaceSearchCacheTests(TestCase):
+    def setUp(self):
+        self.cache = PlaceSearchCache(maxsize=100, ttl=3600, negative_ttl=60)
+
+    def age_rows(self, seconds: int) -> None:
+        """Make the stored searches older, and forget them in memory."""
+        PlaceSearchResult.objects.update(updatedAt=timezone.now() - timedelta(seconds=seconds))
+        self.cache.memory.clear()
+
+    def test_match_is_answered_from_memory_then_from_database(self):
+        query = self.cache.normalize("  Eiffel   Tower", "Paris, FRANCE")
+        self.cache.set_many({query: "188151"})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get_many([query]), {query: "188151"})
+        self.cache.memory.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_many([query, "unknown|paris"]), {query: "188151"})
+
+    def test_miss_expires_after_negative_ttl_and_match_after_ttl(self):
+        matched, missed = "louvre|paris", "nowhere|paris"
+        self.cache.set_many({matched: "188757", missed: None})
+        self.assertEqual(self.cache.get_many([matched, missed]), {matched: "188757", missed: None})
+
+        self.age_rows(120)
+        self.assertEqual(self.cache.get_many([matched, missed]), {matched: "188757"})
+
+        self.age_rows(7200)
+        self.assertEqual(self.cache.get_many([matched, missed]), {})
+
+    def test_rows_loaded_into_memory_keep_their_remaining_ttl(self):
+        matched, missed = "louvre|paris", "nowhere|paris"
+        self.cache.set_many({matched: "188757", missed: None})
+        PlaceSearchResult.objects.filter(query=matched).update(updatedAt=timezone.now() - timedelta(seconds=3500))
+        PlaceSearchResult.objects.filter(query=missed).update(updatedAt=timezone.now() - timedelta(seconds=50))
+        self.cache.memory.clear()
+
+        with mock.patch('api.cache.time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertEqual(self.cache.get_many([matched, missed]), {matched: "188757", missed: None})
+            clock.monotonic.return_value = 1015.0
+            with self.assertNumQueries(0):
+                self.assertEqual(self.cache.get_many([matched]), {matched: "188757"})
+            # The miss had 10 seconds left, so memory no longer answers it, only the database does
+            with self.assertNumQueries(1):
+                self.assertEqual(self.cache.get_many([missed]), {missed: None})
+            clock.monotonic.return_value = 1105.0
+            with self.assertNumQueries(1):
+                self.assertEqual(self.cache.get_many([matched]), {matched: "188757"})
+
+    def test_long_place_names_are_cached_under_bounded_keys(self):
+        first = self.cache.normalize("Cathedral " * 100 + "One", "Paris")
+        second = self.cache.normalize("Cathedral " * 100 + "Two", "Paris")
+
+        self.assertLessEqual(len(first), MAX_QUERY_LENGTH)
+        self.assertNotEqual(first, second)
+        self.cache.set_many({first: "1", second: None})
+        self.cache.memory.clear()
+        self.assertEqual(self.cache.get_many([first, second]), {first: "1", second: None})
+
+    def test_batch_of_activities_is_looked_up_at_once(self):
+        place_search_cache.memory.clear()
+        names = ["Place 0", "Place 1", "Place 2"]
+        for index, name in enumerate(names):
+            location = LocationDetails.objects.create(id=index + 1, name=name)
+            Image.objects.create(location=location, **split_image_urls({"original": f"https://media.example.com/{location.id}.jpg"}))
+        place_search_cache.set_many({place_search_cache.normalize(name, "Paris"): str(index + 1) for index, name in enumerate(names)})
+        place_search_cache.memory.clear()
+
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                mock.patch.object(place_search_cache, 'get_many', wraps=place_search_cache.get_many) as get_many:
+            lookups = PlaceLookups(executor, "Paris")
+            lookups.add_many(names + ["Place 0"])
+
+        get_many.assert_called_once()
+        self.assertEqual(lookups.activity_place_ids(), ["1", "2", "3", "1"])
+        self.assertEqual(lookups.search_count, 0)
+        self.assertEqual(lookups.fetches, {})
+
+
+class PlaceNameMatchingTests(TestCase):
+    PLACE_NAMES = {
+        "Eiffel Tower": ["Eiffel Tower", "Eiffel Tower Summit Access", "Tour Montparnasse"],
+        "louvre museum": ["Musée du Louvre", "The Louvre Museum", "Louvre Pyramid"],
+        "Notre-Dame Cathedral": ["Cathédrale Notre-Dame de Paris", "Notre Dame", "Sainte-Chapelle"],
+        "Sacré-Cœur": ["Basilique du Sacré-Cœur de Montmartre", "Montmartre"],
+        "Seine River Cruise": ["Bateaux Parisiens", "Vedettes du Pont Neuf"],
+        "Unknown Place": [],
+    }
+
+    def test_matches_agree_with_threshold_on_every_pair(self):
+        place_names = list(self.PLACE_NAMES)
+        matches = TripAdvisorAPIClient.match_place_names(place_names, list(self.PLACE_NAMES.values()))
+
+        for place_name, match in zip(place_names, matches):
+            with self.subTest(place_name=place_name):
+                candidates = self.PLACE_NAMES[place_name]
+                # The matching before batching: fuzz.ratio of the lowercase names against the threshold
+                above_threshold = [fuzz.ratio(place_name.lower(), name.lower()) >= 50 for name in candidates]
+                self.assertEqual([score >= 50 for score in match['scores']], above_threshold)
+                if any(above_threshold):
+                    self.assertTrue(above_threshold[match['index']])
+                    self.assertEqual(match['score'], max(match['scores']))
+                else:
+                    self.assertIsNone(match['index'])
+
+    def test_best_candidate_wins(self):
+        matches = TripAdvisorAPIClient.match_place_names(
+            ["Eiffel Tower", "Seine River Cruise"],
+            [["Tour Eiffel", "Eiffel Tower", "Eiffel Tower Summit Access"], ["Bateaux Parisiens"]],
+        )
+
+        self.assertEqual(matches[0]['index'], 1)
+        self.assertEqual(matches[0]['score'], 100)
+        self.assertIsNone(matches[1]['index'])
+
+
+class UpstreamRetryTests(SimpleTestCase):
+    URL = "/v1beta/models/gemini-1.5-flash:streamGenerateContent"
+
+    def setUp(self):
+        self.retry = create_session(pool_size=1, max_retries=2, backoff_factor=0).get_adapter("https://").max_retries
+
+    def test_idempotent_requests_are_retried_on_errors_and_5xx(self):
+        self.assertTrue(self.retry.is_retry('GET', 500))
+        self.assertTrue(self.retry.is_retry('GET', 429))
+        self.assertEqual(self.retry.increment('GET', self.URL, error=ReadTimeoutError(None, self.URL, "timed out")).total, 1)
+
+    def test_post_is_only_retried_when_it_was_not_processed(self):
+        self.assertTrue(self.retry.is_retry('POST', 429))
+        self.assertTrue(self.retry.is_retry('POST', 503))
+        self.assertFalse(self.retry.is_retry('POST', 500))
+        self.assertFalse(self.retry.is_retry('POST', 504))
+        self.assertEqual(self.retry.increment('POST', self.URL, error=ConnectTimeoutError("timed out")).total, 1)
+        with self.assertRaises(ReadTimeoutError):
+            self.retry.increment('POST', self.URL, error=ReadTimeoutError(None, self.URL, "timed out"))
+
+
+class AsyncHTTPClientRetryTests(SimpleTestCase):
+    def client_answering(self, *outcomes):
+        """An AsyncHTTPClient whose requests get the given statuses or raise the given errors, in turn."""
+        http = AsyncHTTPClient(max_connections=1, max_keepalive_connections=1, max_retries=2, backoff_factor=0)
+        self.attempts = 0
+
+        def handler(request):
+            outcome = outcomes[self.attempts]
+            self.attempts += 1
+            if isinstance(outcome, Exception):
+                raise outcome
+            return httpx.Response(outcome)
+
+        mock.patch.object(http, '_client', return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler))).start()
+        self.addCleanup(mock.patch.stopall)
+        return http
+
+    async def test_get_is_retried_on_read_errors_and_5xx(self):
+        http = self.client_answering(httpx.ReadTimeout("timed out"), 500, 200)
+
+        response = await http.request("GET", "https://api.example.com/", (1, 1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.attempts, 3)
+
+    async def test_post_is_not_retried_after_read_errors_or_500(self):
+        with self.assertRaises(httpx.ReadTimeout):
+            await self.client_answering(httpx.ReadTimeout("timed out"), 200).request("POST", "https://api.example.com/", (1, 1))
+        self.assertEqual(self.attempts, 1)
+
+        response = await self.client_answering(500, 200).request("POST", "https://api.example.com/", (1, 1))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.attempts, 1)
+
+    async def test_post_is_retried_when_it_was_not_processed(self):
+        http = self.client_answering(httpx.ConnectError("refused"), 503, 200)
+
+        async with http.stream("POST", "https://api.example.com/", (1, 1)) as response:
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.attempts, 3)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # 2 requests per second with 1 second of burst, queueing for 1 second at most
+        self.limiter = RateLimiter({'tripadvisor.search': 2, 'gemini.generate': 0}, burst=1, max_wait=1, directory=directory.name)
+        self.now = 1000.0
+        patcher = mock.patch('api.ratelimit.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_is_served_at_once_then_requests_are_queued_at_the_rate(self):
+        self.assertEqual([self.limiter.reserve('tripadvisor.search') for _ in range(4)], [0, 0, 0.5, 1.0])
+
+        # Two tokens later, the queue is empty and the bucket too
+        self.now += 1.0
+        self.assertEqual(self.limiter.reserve('tripadvisor.search'), 0.5)
+
+    def test_request_queued_beyond_max_wait_is_rejected_without_taking_a_token(self):
+        for _ in range(4):
+            self.limiter.reserve('tripadvisor.search')
+
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.reserve('tripadvisor.search')
+        self.now += 0.5
+        self.assertEqual(self.limiter.reserve('tripadvisor.search'), 1.0)
+
+    def test_endpoints_without_a_rate_are_not_limited(self):
+        self.assertEqual([self.limiter.reserve('gemini.generate') for _ in range(10)], [0] * 10)
+
+    def test_bucket_is_shared_with_other_processes(self):
+        process = multiprocessing.get_context('fork').Process(target=self.limiter.reserve, args=('tripadvisor.search',))
+        process.start()
+        process.join()
+
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.limiter.reserve('tripadvisor.search'), 0)
+        self.assertEqual(self.limiter.reserve('tripadvisor.search'), 0.5)
+
+    async def test_aacquire_reserves_off_the_event_loop(self):
+        loop_thread = threading.current_thread()
+        reserving_threads = []
+
+        def reserve(endpoint):
+            reserving_threads.append(threading.current_thread())
+            return 0
+
+        with mock.patch.object(self.limiter, 'reserve', side_effect=reserve):
+            await self.limiter.aacquire('tripadvisor.search')
+
+        self.assertEqual(len(reserving_threads), 1)
+        self.assertIsNot(reserving_threads[0], loop_thread)
+
+
+class RetryRateLimitTests(SimpleTestCase):
+    def test_session_retries_take_a_token_of_their_endpoint(self):
+        rate_limiter = mock.Mock(spec=RateLimiter)
+        retry = create_session(pool_size=1, max_retries=2, backoff_factor=0, rate_limiter=rate_limiter).get_adapter("https://").max_retries
+
+        retry = retry.increment('GET', '/api/v1/location/123/details?key=secret', error=ConnectTimeoutError("timed out"))
+        retry.sleep()
+        retry = retry.increment('POST', '/v1beta/models/gemini-1.5-flash:streamGenerateContent', error=ConnectTimeoutError("timed out"))
+        retry.sleep()
+
+        self.assertEqual(rate_limiter.acquire.call_args_list, [mock.call('tripadvisor.details'), mock.call('gemini.generate')])
+
+    async def test_async_client_retries_take_a_token_of_their_endpoint(self):
+        rate_limiter = mock.Mock(spec=RateLimiter)
+        http = AsyncHTTPClient(max_connections=1, max_keepalive_connections=1, max_retries=2, backoff_factor=0, rate_limiter=rate_limiter)
+        responses = iter([500, 500, 200])
+        transport = httpx.MockTransport(lambda request: httpx.Response(next(responses)))
+
+        with mock.patch.object(http, '_client', return_value=httpx.AsyncClient(transport=transport)):
+            response = await http.request("GET", "https://api.content.tripadvisor.com/api/v1/location/search", (1, 1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(rate_limiter.aacquire.await_args_list, [mock.call('tripadvisor.search')] * 2)
+
+
+def gemini_stream_lines(activities):
+    """Server-Sent Events lines of a Gemini stream writing the activities, one event per activity."""
+    texts = [("," if index else "[") + json.dumps(activity) for index, activity in enumerate(activities)] + ["]"]
+    return ['data: ' + json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}) for text in texts]
+
+
+class JsonArrayStreamParserTests(SimpleTestCase):
+    ACTIVITIES = [
+        {"name": "Caf\u00e9 \"de Flore\"", "description": "A [famous] {caf\u00e9}, \\ on the left bank."},
+        {"name": "Louvre Museum", "tags": ["art", {"nested": [1, 2]}]},
+    ]
+    DOCUMENT = '```json\n{"notes": [{"name": "Not an activity"}], "summary": "itinerary", "itinerary": %s}\n```' % json.dumps(ACTIVITIES)
+
+    def parse(self, chunks, parser=None):
+        """The objects parsed from the chunks of a document, and the chunk index at which each was yielded."""
+        parser = parser or JsonArrayStreamParser()
+        objects = [(index, item) for index, chunk in enumerate(chunks) for item in parser.feed(chunk)]
+        parser.close()
+        return objects
+
+    def test_every_split_of_the_document_parses_the_itinerary(self):
+        # Splits fall inside strings, escapes, keys and objects at every position
+        for split in range(len(self.DOCUMENT) + 1):
+            with self.subTest(split=split):
+                objects = self.parse([self.DOCUMENT[:split], self.DOCUMENT[split:]])
+                self.assertEqual([item for _, item in objects], self.ACTIVITIES)
+
+    def test_one_character_chunks_yield_each_object_once_its_brace_arrives(self):
+        objects = self.parse(list(self.DOCUMENT))
+
+        first_end = self.DOCUMENT.index(json.dumps(self.ACTIVITIES[0])) + len(json.dumps(self.ACTIVITIES[0])) - 1
+        self.assertEqual(objects[0], (first_end, self.ACTIVITIES[0]))
+        self.assertEqual([item for _, item in objects], self.ACTIVITIES)
+
+    def test_top_level_array_is_parsed(self):
+        self.assertEqual([item for _, item in self.parse(['[{"a": 1},', ' {"b": [2]}]'])], [{"a": 1}, {"b": [2]}])
+
+    def test_arrays_of_other_keys_and_nested_itineraries_are_skipped(self):
+        document = '{"notes": [{"a": 1}], "plan": {"itinerary": [{"b": 2}]}, "itinerary": [{"c": 3}], "itinerary": [{"d": 4}]}'
+        self.assertEqual([item for _, item in self.parse([document])], [{"c": 3}])
+        self.assertEqual([item for _, item in self.parse([document], JsonArrayStreamParser(key='notes'))], [{"a": 1}])
+        self.assertEqual(self.parse(['{"notes": [{"a": 1}]}']), [])
+
+    def test_cut_off_document_is_rejected(self):
+        parser = JsonArrayStreamParser()
+        self.assertEqual(parser.feed('```json\n{"itinerary": [{"a": 1}, {"b": "}'), [{"a": 1}])
+        with self.assertRaisesMessage(ValueError, "Incomplete JSON document"):
+            parser.close()
+        with self.assertRaisesMessage(ValueError, "Incomplete JSON document"):
+            JsonArrayStreamParser().close()
+
+    def test_mismatched_brackets_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, "Unexpected ']' in JSON document"):
+            JsonArrayStreamParser().feed('{"itinerary": [{"a": 1]}')
+
+    def test_text_is_extracted_from_stream_events(self):
+        event = {"candidates": [{"content": {"parts": [{"text": '[{"a"'}, {"text": ': 1}'}]}}]}
+        self.assertEqual(GeminiAPIClient._parse_stream_event('data: ' + json.dumps(event)), '[{"a": 1}')
+        self.assertEqual(GeminiAPIClient._parse_stream_event('data: {"candidates": [{"finishReason": "STOP"}]}'), '')
+        self.assertEqual(GeminiAPIClient._parse_stream_event('data: {"usageMetadata": {}}'), '')
+        self.assertEqual(GeminiAPIClient._parse_stream_event(''), '')
+        self.assertEqual(GeminiAPIClient._parse_stream_event(': keep-alive'), '')
+        with self.assertRaises(ValueError):
+            GeminiAPIClient._parse_stream_event('data: {"candidates": [')
+
+    def test_stream_events_split_inside_strings_are_parsed(self):
+        texts = ['```json\n{"itinerary": [{"name": "Caf', 'e \\', '"de Flore\\""}, {"na', 'me": "Louvre"}]}', '\n```']
+        lines = ['data: ' + json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}) for text in texts] + ['']
+        objects = self.parse([GeminiAPIClient._parse_stream_event(line) for line in lines])
+        self.assertEqual(objects, [(2, {"name": 'Cafe "de Flore"'}), (3, {"name": "Louvre"})])
+
+
+class GeminiResponseCacheTests(TestCase):
+    ITINERARY = {"itinerary": [{"name": "Louvre Museum", "day": "Day 1", "time_of_day": "Morning"}]}
+
+    def setUp(self):
+        self.cache = GeminiResponseCache(maxsize=10, max_entries=2, ttl=3600)
+
+    def test_stored_response_is_returned_as_a_copy(self):
+        self.assertIsNone(self.cache.get('a' * 64))
+
+        self.cache.set('a' * 64, self.ITINERARY)
+        self.cache.get('a' * 64)['itinerary'].clear()
+        self.assertEqual(self.cache.get('a' * 64), self.ITINERARY)
+
+        self.cache.memory.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get('a' * 64), self.ITINERARY)
+
+    def test_expired_response_is_not_returned(self):
+        self.cache.set('a' * 64, self.ITINERARY)
+        GeminiResponse.objects.update(updatedAt=timezone.now() - timedelta(seconds=3601))
+        self.cache.memory.clear()
+
+        self.assertIsNone(self.cache.get('a' * 64))
+
+    def test_expired_and_oldest_responses_beyond_max_entries_are_evicted(self):
+        for index, fingerprint in enumerate(['a' * 64, 'b' * 64, 'c' * 64, 'd' * 64]):
+            self.cache.set(fingerprint, self.ITINERARY)
+            GeminiResponse.objects.filter(fingerprint=fingerprint).update(updatedAt=timezone.now() - timedelta(seconds=4000 - index * 1000))
+
+        self.cache.evict()
+
+        self.assertEqual(sorted(GeminiResponse.objects.values_list('fingerprint', flat=True)), ['c' * 64, 'd' * 64])
+
+    def test_eviction_runs_every_eviction_interval_writes(self):
+        with mock.patch.object(GeminiResponseCache, 'EVICTION_INTERVAL', 3), mock.patch.object(self.cache, 'evict') as evict:
+            for fingerprint in ['a' * 64, 'b' * 64, 'c' * 64, 'd' * 64]:
+                self.cache.set(fingerprint, self.ITINERARY)
+
+        evict.assert_called_once_with()
+
+    def test_response_loaded_into_memory_keeps_its_remaining_ttl(self):
+        self.cache.set('a' * 64, self.ITINERARY)
+        GeminiResponse.objects.update(updatedAt=timezone.now() - timedelta(seconds=3590))
+        self.cache.memory.clear()
+
+        with mock.patch('api.cache.time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertEqual(self.cache.get('a' * 64), self.ITINERARY)
+            clock.monotonic.return_value = 1005.0
+            with self.assertNumQueries(0):
+                self.assertEqual(self.cache.get('a' * 64), self.ITINERARY)
+            clock.monotonic.return_value = 1015.0
+            GeminiResponse.objects.update(updatedAt=timezone.now() - timedelta(seconds=3601))
+            with self.assertNumQueries(1):
+                self.assertIsNone(self.cache.get('a' * 64))
+
+    def test_client_skips_the_cache_when_use_cache_is_false(self):
+        fresh = [{"name": "Eiffel Tower", "day": "Day 1", "time_of_day": "Morning"}]
+        session = mock.MagicMock()
+        session.post.return_value.__enter__.return_value.iter_lines.return_value = gemini_stream_lines(fresh)
+        client = GeminiAPIClient("key", session=session, cache=self.cache)
+        client.cache.set(client._fingerprint(client._create_prompt("Paris", 1, [])), self.ITINERARY)
+
+        self.assertEqual(client.get_places_to_visit("Paris", 1, []), self.ITINERARY)
+        session.post.assert_not_called()
+
+        self.assertEqual(client.get_places_to_visit("Paris", 1, [], use_cache=False), {"itinerary": fresh})
+        self.assertEqual(client.get_places_to_visit("Paris", 1, []), {"itinerary": fresh})
+        session.post.assert_called_once()
+
+
+class GeminiSpanTests(SimpleTestCase):
+    """The gemini.generate span times the upstream stream, not the caller consuming its batches."""
+    ACTIVITIES = [{"name": "Louvre Museum"}, {"name": "Eiffel Tower"}]
+
+    def slow_lines(self):
+        for line in gemini_stream_lines(self.ACTIVITIES):
+            time.sleep(0.05)
+            yield line
+
+    def assertSpanExcludesConsumer(self, job_trace, outcome_count):
+        count, seconds = job_trace.spans['gemini.generate']
+        self.assertEqual(count, 1)
+        # Three reads of 50 ms upstream, while the caller spent 300 ms on each of the two batches
+        self.assertGreaterEqual(seconds, 0.15)
+        self.assertLess(seconds, 0.5)
+        self.assertEqual(outcome_count(), 1)
+
+    def outcome_count(self, outcome):
+        before = self.observations(outcome)
+        return lambda: self.observations(outcome) - before
+
+    def observations(self, outcome):
+        return sum(
+            int(line.rsplit(' ', 1)[1]) for line in metrics.render().splitlines()
+            if line.startswith('planmyitinerary_span_seconds_count') and 'span="gemini.generate"' in line and f'outcome="{outcome}"' in line
+        )
+
+    def test_sync_span_excludes_the_consumer(self):
+        session = mock.MagicMock()
+        session.post.return_value.__enter__.return_value.iter_lines.return_value = self.slow_lines()
+        client = GeminiAPIClient("key", session=session)
+        ok_count = self.outcome_count('ok')
+
+        with trace('test') as job_trace:
+            for batch in client.stream_activity_batches("Paris", 1, []):
+                time.sleep(0.3)
+
+        self.assertSpanExcludesConsumer(job_trace, ok_count)
+
+    def test_async_span_excludes_the_consumer(self):
+        client = AsyncGeminiAPIClient("key", http=mock.MagicMock())
+        slow_lines = self.slow_lines
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+            async def aiter_lines(self):
+                for line in slow_lines():
+                    yield line
+
+        @contextlib.asynccontextmanager
+        async def stream(*args, **kwargs):
+            yield Response()
+
+        client.http.stream = stream
+        ok_count = self.outcome_count('ok')
+
+        async def consume():
+            with trace('test') as job_trace:
+                async for batch in client.stream_activity_batches("Paris", 1, []):
+                    await asyncio.sleep(0.3)
+            return job_trace
+
+        self.assertSpanExcludesConsumer(asyncio.run(consume()), ok_count)
+
+    def test_consumer_stopping_early_is_not_an_upstream_error(self):
+        session = mock.MagicMock()
+        session.post.return_value.__enter__.return_value.iter_lines.return_value = self.slow_lines()
+        client = GeminiAPIClient("key", session=session)
+        ok_count = self.outcome_count('ok')
+
+        batches = client.stream_activity_batches("Paris", 1, [])
+        next(batches)
+        batches.close()
+
+        self.assertEqual(ok_count(), 1)
+
+
+class StubAsyncGeminiClient:
+    """Async Gemini client generating fixed batches of activities, or failing."""
+
+    def __init__(self, batches, error=None):
+        self.batches = batches
+        self.error = error
+
+    async def stream_activity_batches(self, destination, num_of_days, must_includes, use_cache=True):
+        for batch in self.batches:
+            yield batch
+        if self.error:
+            raise self.error
+
+
+class StubAsyncTripAdvisorClient:
+    """Async TripAdvisor client finding every place, with one image each."""
+
+    def __init__(self, location_ids):
+        self.location_ids = location_ids
+
+    async def search_places(self, place_name, destination):
+        return [{'location_id': self.location_ids[place_name], 'name': place_name}]
+
+    async def get_place_details(self, place_id):
+        return {'id': place_id, 'name': f"Place {place_id}", 'latitude': 48.86, 'longitude': 2.35}
+
+    async def get_place_images(self, place_id):
+        return [{'location': place_id, 'original': f"https://media.example.com/{place_id}.jpg"}]
+
+
+def parse_event_stream(content: bytes):
+    """The (event, data) pairs of a text/event-stream body, leaving out comments."""
+    events = []
+    for message in content.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class GenerateItineraryStreamViewTests(TransactionTestCase):
+    URL = "/api/itinerary/generate/stream/"
+    ACTIVITIES = [
+        {'place_name': "Louvre Museum", 'day_number': 1, 'time_of_day': "morning", 'description': "Art.", 'duration': "3 hours"},
+        {'place_name': "Eiffel Tower", 'day_number': 1, 'time_of_day': "afternoon", 'description': "Views.", 'duration': "2 hours"},
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(self.user)}"}
+        start_date = timezone.now().date() + timedelta(days=1)
+        self.params = {
+            'destination': "Paris, France",
+            'num_of_days': 2,
+            'must_includes': [],
+            'start_date': start_date.isoformat(),
+            'end_date': (start_date + timedelta(days=1)).isoformat(),
+        }
+        place_search_cache.memory.clear()
+        trip_advisor = StubAsyncTripAdvisorClient({"Louvre Museum": "101", "Eiffel Tower": "102"})
+        patcher = mock.patch('api.generation.async_trip_advisor_client', trip_advisor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def stream(self, gemini):
+        with mock.patch('api.generation.async_gemini_client', gemini):
+            response = await self.client.post(self.URL, self.params, content_type="application/json", headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], "text/event-stream")
+            return parse_event_stream(b''.join([chunk async for chunk in response.streaming_content]))
+
+    async def test_events_are_sent_in_order_until_the_saved_itinerary(self):
+        events = await self.stream(StubAsyncGeminiClient([self.ACTIVITIES[:1], self.ACTIVITIES[1:]]))
+        names = [event for event, _ in events]
+
+        self.assertEqual(names[0], 'progress')
+        self.assertEqual(events[0][1], {'stage': 'planning', 'completed': 0, 'total': 1})
+        self.assertLess(names.index('plan'), names.index('activity'))
+        self.assertEqual(events[names.index('plan')][1], {'activities': self.ACTIVITIES})
+        self.assertEqual(
+            sorted((data['index'], data['place_details']['id']) for event, data in events if event == 'activity'),
+            [(0, 101), (1, 102)]
+        )
+        self.assertEqual(names[-1], 'itinerary')
+        itinerary = await Itinerary.objects.aget(user=self.user)
+        self.assertEqual(events[-1][1], await sync_to_async(itinerary_payload_cache.get)(itinerary.id))
+        self.assertEqual(
+            [name async for name in Activity.objects.filter(itinerary=itinerary).order_by('position').values_list('name', flat=True)],
+            ["Louvre Museum", "Eiffel Tower"]
+        )
+        # The generation task is released once it is done
+        self.assertFalse(_generation_tasks)
+
+    async def test_failed_generation_ends_with_an_error_event(self):
+        with self.assertLogs('api.generation', 'WARNING'):
+            events = await self.stream(StubAsyncGeminiClient([], error=ValueError("Invalid JSON")))
+
+        self.assertEqual(events[-1], ('error', {'message': "Failed to generate itinerary"}))
+        self.assertNotIn('itinerary', [event for event, _ in events])
+        self.assertFalse(await Itinerary.objects.aexists())
+
+
+    def test_generation_outliving_a_disconnected_client_leaves_no_thread_or_connection(self):
+        gemini = StubAsyncGeminiClient([self.ACTIVITIES[:1], self.ACTIVITIES[1:]])
+        batches = gemini.stream_activity_batches
+        opened = []
+
+        def record_connection(sender, connection, **kwargs):
+            opened.append((threading.current_thread(), connection))
+
+        async def scenario():
+            released, first_chunk = asyncio.Event(), asyncio.Event()
+
+            async def gated_batches(*args, **kwargs):
+                async for batch in batches(*args, **kwargs):
+                    yield batch
+                    await released.wait()
+
+            body = json.dumps(self.params).encode()
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+                'path': self.URL, 'raw_path': self.URL.encode(), 'query_string': b'', 'root_path': '',
+                'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+                'headers': [
+                    (b'host', b'testserver'),
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                    (b'authorization', self.headers['Authorization'].encode()),
+                ],
+            }
+            requests = iter([{'type': 'http.request', 'body': body, 'more_body': False}])
+
+            async def receive():
+                message = next(requests, None)
+                if message is None:
+                    # The client disconnects once the first event arrived
+                    await first_chunk.wait()
+                    return {'type': 'http.disconnect'}
+                return message
+
+            async def send(message):
+                if message['type'] == 'http.response.body' and message.get('body'):
+                    first_chunk.set()
+
+            gemini.stream_activity_batches = gated_batches
+            with mock.patch('api.generation.async_gemini_client', gemini):
+                await ASGIHandler()(scope, receive, send)
+                # The request is over, its thread is gone, and the generation goes on
+                self.assertEqual(len(_generation_tasks), 1)
+                task = next(iter(_generation_tasks))
+                released.set()
+                await task
+
+        threads = set(threading.enumerate())
+        # Closing the in-memory test database is a no-op, so calls are recorded instead
+        closed = []
+        close = type(connections['default']).close
+
+        def record_close(wrapper):
+            closed.append(wrapper)
+            close(wrapper)
+
+        connection_created.connect(record_connection)
+        try:
+            with mock.patch.object(type(connections['default']), 'close', autospec=True, side_effect=record_close):
+                asyncio.run(scenario())
+        finally:
+            connection_created.disconnect(record_connection)
+
+        self.assertTrue(Itinerary.objects.filter(user=self.user).exists())
+        self.assertFalse(SyncToAsync.context_to_thread_executor)
+        # Executors are shut down by short-lived threads joining their workers
+        for thread in set(threading.enumerate()) - threads:
+            thread.join(timeout=5)
+        self.assertEqual(set(threading.enumerate()) - threads, set())
+        # The connections of the request's thread and of the generation's thread
+        worker_connections = [wrapper for thread, wrapper in opened if thread is not threading.main_thread()]
+        self.assertEqual(len(worker_connections), 2)
+        self.assertEqual([wrapper in closed for wrapper in worker_connections], [True, True])
+
+
+class ItineraryJobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.queue = ItineraryJobQueue(stale_timeout=300, max_attempts=2)
+        start_date = timezone.now().date() + timedelta(days=1)
+        self.params = {
+            'destination': "Paris, France",
+            'num_of_days': 3,
+            'must_includes': [],
+            'start_date': start_date.isoformat(),
+            'end_date': (start_date + timedelta(days=2)).isoformat(),
+        }
+
+    def test_enqueued_job_is_claimed_run_and_succeeds(self):
+        response = self.client.post("/api/itinerary/generate/", self.params, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['status'], ItineraryJob.PENDING)
+
+        job = self.queue.claim()
+        self.assertEqual((str(job.pk), job.status, job.attempts), (response.json()['data']['id'], ItineraryJob.RUNNING, 1))
+        self.assertIsNone(self.queue.claim())
+
+        itinerary = create_itinerary(self.user, 2)
+
+        def generate(user, params):
+            generator.call_args.kwargs['on_progress']('saving', 1, 1)
+            return itinerary
+
+        with mock.patch('api.jobs.ItineraryGenerator') as generator:
+            generator.return_value.generate.side_effect = generate
+            job = self.queue.run(job)
+
+        self.assertEqual(generator.return_value.generate.call_args.args, (self.user, {**self.params, 'use_cache': True}))
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual((data['status'], data['stage'], data['progress_completed'], data['itinerary']), (ItineraryJob.SUCCEEDED, 'saving', 1, itinerary.id))
+        self.assertEqual(data['itinerary_details']['id'], itinerary.id)
+
+    def test_failed_job_is_final(self):
+        self.queue.enqueue(self.user, self.params)
+        job = self.queue.claim()
+
+        with mock.patch('api.jobs.ItineraryGenerator') as generator, self.assertLogs('api.jobs', 'ERROR'):
+            generator.return_value.generate.side_effect = Exception("Failed to generate itinerary")
+            self.queue.run(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error, job.itinerary), (ItineraryJob.FAILED, "Failed to generate itinerary", None))
+        self.assertIsNone(self.queue.claim())
+        response = self.client.get(f"/api/itinerary/jobs/{job.pk}/")
+        self.assertEqual(response.json()['message'], "Itinerary generation failed")
+        self.assertNotIn('itinerary_details', response.json()['data'])
+
+    def test_stale_job_is_requeued_until_it_ran_out_of_attempts(self):
+        stale = self.queue.enqueue(self.user, self.params)
+        running = self.queue.enqueue(self.user, self.params)
+        self.assertEqual([self.queue.claim().pk, self.queue.claim().pk], [stale.pk, running.pk])
+        ItineraryJob.objects.filter(pk=stale.pk).update(updatedAt=timezone.now() - timedelta(seconds=301))
+
+        self.assertEqual(self.queue.requeue_stale(), 1)
+        self.assertEqual(ItineraryJob.objects.get(pk=running.pk).status, ItineraryJob.RUNNING)
+        self.assertEqual(self.queue.claim().pk, stale.pk)
+
+        ItineraryJob.objects.filter(pk=stale.pk).update(updatedAt=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(self.queue.requeue_stale(), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts, stale.error), (ItineraryJob.FAILED, 2, "Itinerary generation did not complete"))
+
+    def test_job_of_another_user_is_not_found(self):
+        other_user = User.objects.create_user(username="other@example.com", password="password")
+        job = self.queue.enqueue(other_user, self.params)
+
+        response = self.client.get(f"/api/itinerary/jobs/{job.pk}/")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"message": "Job not found"})
+
+
+class ItineraryJobHeartbeatTests(TransactionTestCase):
+    def test_job_in_a_long_stage_is_not_requeued_past_the_stale_timeout(self):
+        user = User.objects.create_user(username="traveller@example.com", password="password")
+        queue = ItineraryJobQueue(stale_timeout=0.3, max_attempts=2)
+        queue.enqueue(user, {'destination': "Paris, France"})
+        job = queue.claim()
+        itinerary = create_itinerary(user, 0)
+        requeued = []
+
+        def generate(user, params):
+            generator.call_args.kwargs['on_progress']('planning', 0, 1)
+            for _ in range(4):
+                time.sleep(0.25)
+                requeued.append(queue.requeue_stale())
+            return itinerary
+
+        with mock.patch('api.jobs.ItineraryGenerator') as generator:
+            generator.return_value.generate.side_effect = generate
+            job = queue.run(job)
+
+        self.assertEqual(requeued, [0, 0, 0, 0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.itinerary), (ItineraryJob.SUCCEEDED, 1, itinerary))
+        self.assertEqual([thread.name for thread in threading.enumerate() if thread.name.startswith("itinerary-job-heartbeat")], [])
+
+    def test_heartbeat_stops_once_the_job_was_claimed_again(self):
+        user = User.objects.create_user(username="traveller@example.com", password="password")
+        queue = ItineraryJobQueue(stale_timeout=0.3, max_attempts=3)
+        queue.enqueue(user, {'destination': "Paris, France"})
+        job = queue.claim()
+        ItineraryJob.objects.filter(pk=job.pk).update(attempts=2)
+        stale_at = timezone.now() - timedelta(seconds=1)
+        ItineraryJob.objects.filter(pk=job.pk).update(updatedAt=stale_at)
+
+        with queue.heartbeat(job):
+            time.sleep(0.25)
+
+        self.assertEqual(ItineraryJob.objects.get(pk=job.pk).updatedAt, stale_at)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.itineraries = [create_itinerary(self.user, 0) for _ in range(7)]
+        # The five oldest itineraries were created at the same time, their order is decided by id
+        created_at = timezone.now() - timedelta(days=1)
+        Itinerary.objects.filter(id__in=[itinerary.id for itinerary in self.itineraries[:5]]).update(createdAt=created_at)
+        self.newest_first = [itinerary.id for itinerary in reversed(self.itineraries)]
+
+    def walk(self, page_size):
+        """The ids of every page and the number of pages, following the cursors of the view."""
+        ids, pages, cursor = [], 0, None
+        while True:
+            params = {'page_size': page_size, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get("/api/itinerary/recent/", params)
+            self.assertEqual(response.status_code, 200)
+            ids += [itinerary['id'] for itinerary in response.json()['data']]
+            pages += 1
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_cover_every_itinerary_once_across_equal_creation_times(self):
+        for page_size, expected_pages in [(1, 7), (2, 4), (3, 3), (7, 1)]:
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(page_size), (self.newest_first, expected_pages))
+
+    def test_page_size_is_capped_and_aliased_by_num_of_itinerary(self):
+        pagination = KeysetPagination(default_page_size=5, max_page_size=3)
+        self.assertEqual(pagination.get_page_size(None), 5)
+        self.assertEqual(pagination.get_page_size("2"), 2)
+        self.assertEqual(pagination.get_page_size("100"), 3)
+
+        response = self.client.get("/api/itinerary/recent/", {'num_of_itinerary': 2})
+        self.assertEqual([itinerary['id'] for itinerary in response.json()['data']], self.newest_first[:2])
+        response = self.client.get("/api/itinerary/recent/", {'page_size': 3, 'num_of_itinerary': 2})
+        self.assertEqual(len(response.json()['data']), 3)
+
+    def test_invalid_page_size_or_cursor_is_rejected(self):
+        for params in [{'page_size': 0}, {'page_size': -1}, {'num_of_itinerary': "many"}, {'cursor': "not-a-cursor"}, {'cursor': KeysetPagination.encode_cursor(timezone.now(), 1)[:-4]}]:
+            with self.subTest(params=params):
+                response = self.client.get("/api/itinerary/recent/", params)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Invalid value", response.json()['error'])
+
+    def test_cursor_round_trips_the_key_of_a_row(self):
+        created_at = timezone.now()
+
+        self.assertEqual(KeysetPagination.decode_cursor(KeysetPagination.encode_cursor(created_at, 42)), (created_at, 42))
+
+
+class GeoTests(TestCase):
+    def test_haversine_distances(self):
+        for points, distance_km in [
+            ((48.8584, 2.2945, 48.8584, 2.2945), 0),
+            ((48.8584, 2.2945, 48.8606, 2.3376), 3.16),  # Eiffel Tower to the Louvre
+            ((0, 179.5, 0, -179.5), 111.20),  # Across the antimeridian
+            ((90, 0, 90, 120), 0),  # Every longitude meets at the pole
+            ((90, 0, -90, 0), 20015.11),
+        ]:
+            with self.subTest(points=points):
+                self.assertAlmostEqual(haversine_km(*points), distance_km, places=2)
+
+    def test_bounding_box_encloses_the_circle(self):
+        min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(48.8584, 2.2945, 10)
+
+        self.assertAlmostEqual(max_latitude - 48.8584, 48.8584 - min_latitude)
+        self.assertAlmostEqual(haversine_km(48.8584, 2.2945, max_latitude, 2.2945), 10)
+        self.assertAlmostEqual(haversine_km(48.8584, 2.2945, 48.8584, max_longitude), 10, places=3)
+        self.assertAlmostEqual(max_longitude - 2.2945, 2.2945 - min_longitude)
+        # Every point of the east edge is about the radius away or further, so the circle does not cross it
+        for step in range(-9, 10):
+            latitude = 48.8584 + step * (max_latitude - 48.8584) / 10
+            self.assertGreater(haversine_km(48.8584, 2.2945, latitude, max_longitude), 10 - 1e-3)
+
+    def test_bounding_box_crosses_the_antimeridian_and_spans_the_poles(self):
+        self.assertLess(bounding_box(0, -179.95, 50)[2], -180)
+        self.assertGreater(bounding_box(0, 179.95, 50)[3], 180)
+        self.assertEqual(bounding_box(89.99, 10, 50)[1:], (90, -180.0, 180.0))
+        self.assertEqual(bounding_box(-89.99, 10, 50)[::2], (-90, -180.0))
+
+    def test_nearby_locations_are_filtered_by_exact_distance_and_sorted(self):
+        for location_id, latitude, longitude in [
+            (1, 0, 179.9), (2, 0, -179.9), (3, 0, 179.0),  # Around the antimeridian
+            (4, 89.9, 0), (5, 89.9, 180),  # Around the north pole
+            (6, None, None),
+        ]:
+            LocationDetails.objects.create(id=location_id, name=f"Place {location_id}", latitude=latitude, longitude=longitude)
+
+        for point, radius_km, limit, expected_ids in [
+            ((0, -179.95), 50, 10, [2, 1]),
+            ((0, 179.95), 50, 10, [1, 2]),
+            ((0, 179.95), 50, 1, [1]),
+            ((0, 179.95), 200, 10, [1, 2, 3]),
+            ((90, 0), 20, 10, [4, 5]),
+            ((89.9, 90), 5, 10, []),
+        ]:
+            with self.subTest(point=point, radius_km=radius_km, limit=limit):
+                locations = nearby_locations(*point, radius_km, limit)
+
+                self.assertEqual([location.id for location in locations], expected_ids)
+                self.assertTrue(all(location.distance_km <= radius_km for location in locations))
+
+    def test_nearby_endpoint(self):
+        user = User.objects.create_user(username="traveller@example.com", password="password")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        LocationDetails.objects.create(id=1, name="Eiffel Tower", latitude=48.8584, longitude=2.2945)
+        LocationDetails.objects.create(id=2, name="Louvre Museum", latitude=48.8606, longitude=2.3376)
+        LocationDetails.objects.create(id=3, name="Palace of Versailles", latitude=48.8049, longitude=2.1204)
+
+        response = client.get("/api/locations/nearby/", {'latitude': 48.8584, 'longitude': 2.2945})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([location['name'] for location in response.json()['data']], ["Eiffel Tower", "Louvre Museum"])
+        self.assertAlmostEqual(response.json()['data'][1]['distance_km'], 3.16, places=2)
+
+        response = client.get("/api/locations/nearby/", {'latitude': 48.8584, 'longitude': 2.2945, 'radius_km': 20, 'limit': 1})
+        self.assertEqual([location['name'] for location in response.json()['data']], ["Eiffel Tower"])
+
+        for params in [
+            {'latitude': 91, 'longitude': 0},
+            {'latitude': 0, 'longitude': 181},
+            {'latitude': 0, 'longitude': 0, 'radius_km': 101},
+            {'latitude': 0, 'longitude': 0, 'radius_km': -1},
+            {'latitude': 0, 'longitude': 0, 'limit': 0},
+            {'latitude': 0, 'longitude': 0, 'limit': 101},
+            {'latitude': 0},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(client.get("/api/locations/nearby/", params).status_code, 400)
+
+
+class NumericGeoColumnsMigrationTests(TransactionTestCase):
+    """Check the backfill of the numeric columns of LocationDetails by migration 0018, and its reverse."""
+
+    BEFORE = [('api', '0017_remove_itinerary_itinerary_user_created_idx_and_more')]
+    AFTER = [('api', '0018_locationdetails_numeric_geo_columns')]
+
+    def migrate(self, targets):
+        """Migrate the database to the targets, returning the historical models at that state."""
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_text_columns_are_parsed_and_restored(self):
+        LocationDetails = self.migrate(self.BEFORE).get_model('api', 'LocationDetails')
+        LocationDetails.objects.create(id=1, name="Eiffel Tower", latitude="48.8584", longitude="2.2945", rating="4.55", ranking="#1,024 of 3,250 things to do")
+        LocationDetails.objects.create(id=2, name="Unknown", latitude="", longitude="n/a", rating=None, ranking="")
+
+        LocationDetails = self.migrate(self.AFTER).get_model('api', 'LocationDetails')
+        self.assertEqual(
+            list(LocationDetails.objects.order_by('id').values_list('latitude', 'longitude', 'rating', 'ranking_position')),
+            [(48.8584, 2.2945, Decimal('4.6'), 1024), (None, None, None, None)]
+        )
+
+        LocationDetails = self.migrate(self.BEFORE).get_model('api', 'LocationDetails')
+        self.assertEqual(
+            list(LocationDetails.objects.order_by('id').values_list('latitude', 'longitude', 'rating')),
+            [("48.8584", "2.2945", "4.6"), (None, None, None)]
+        )
+
+
+class StubGeminiClient:
+    """Gemini client generating fixed batches of activities."""
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def stream_activity_batches(self, destination, num_of_days, must_includes, use_cache=True):
+        yield from self.batches
+
+
+class StubTripAdvisorClient(TripAdvisorAPIClient):
+    """TripAdvisor client finding every place, with one image each, after an optional delay or failing."""
+
+    def __init__(self, location_ids, delays=None, failing=()):
+        super().__init__("key")
+        self.location_ids = location_ids
+        self.delays = delays or {}
+        self.failing = failing
+        # (endpoint, place name or id) of every request
+        self.requests = []
+
+    def search_places(self, place_name, destination):
+        self.requests.append(('search', place_name))
+        time.sleep(self.delays.get(place_name, 0))
+        if place_name in self.failing:
+            raise requests.ConnectionError("Connection refused")
+        return [{'location_id': self.location_ids[place_name], 'name': place_name}]
+
+    def get_place_details(self, place_id):
+        self.requests.append(('details', place_id))
+        return {'id': place_id, 'name': f"Place {place_id}", 'latitude': 48.86, 'longitude': 2.35}
+
+    def get_place_images(self, place_id):
+        self.requests.append(('images', place_id))
+        return [{'location': place_id, 'original': f"https://media.example.com/{place_id}.jpg"}]
+
+
+class ItineraryGeneratorTests(TestCase):
+    ACTIVITIES = [
+        {'place_name': "Louvre Museum", 'day_number': 1, 'time_of_day': "morning", 'description': "Art.", 'duration': "3 hours"},
+        {'place_name': "Eiffel Tower", 'day_number': 1, 'time_of_day': "afternoon", 'description': "Views.", 'duration': "2 hours"},
+        {'place_name': "Closed Museum", 'day_number': 2, 'time_of_day': "morning", 'description': "Closed.", 'duration': "1 hour"},
+        {'place_name': "Arc de Triomphe", 'day_number': 2, 'time_of_day': "evening", 'description': "Arch.", 'duration': "1 hour"},
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.params = {
+            'destination': "Paris, France",
+            'num_of_days': 2,
+            'must_includes': [],
+            'start_date': "2030-01-01",
+            'end_date': "2030-01-02",
+        }
+        place_search_cache.memory.clear()
+
+    def test_lookups_finishing_out_of_order_keep_the_activity_order_and_survive_a_failed_search(self):
+        trip_advisor = StubTripAdvisorClient(
+            {"Louvre Museum": "101", "Eiffel Tower": "102", "Arc de Triomphe": "103"},
+            # The first search finishes last
+            delays={"Louvre Museum": 0.2},
+            failing={"Closed Museum"},
+        )
+        events = []
+
+        with mock.patch('api.generation.gemini_client', StubGeminiClient([self.ACTIVITIES[:2], self.ACTIVITIES[2:]])), \
+                mock.patch('api.generation.trip_advisor_client', trip_advisor), \
+                self.assertLogs('api.generation', 'WARNING'):
+            itinerary = ItineraryGenerator(on_event=lambda event, data: events.append((event, data))).generate(self.user, self.params)
+
+        self.assertEqual(events[0], ('plan', {'activities': self.ACTIVITIES}))
+        self.assertEqual(
+            sorted((data['index'], data['place_name'], data['place_details']['id']) for event, data in events if event == 'activity'),
+            [(0, "Louvre Museum", 101), (1, "Eiffel Tower", 102), (3, "Arc de Triomphe", 103)]
+        )
+        self.assertEqual(
+            dict(Activity.objects.filter(itinerary=itinerary).values_list('name', 'location_id')),
+            {"Louvre Museum": 101, "Eiffel Tower": 102, "Arc de Triomphe": 103}
+        )
+        # The failed search is not cached, so that the next generation retries it
+        self.assertEqual(
+            sorted(PlaceSearchResult.objects.values_list('location_id', flat=True)),
+            [101, 102, 103]
+        )
+
+
+class ItineraryPayloadCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.itinerary = create_itinerary(self.user, 2)
+        self.other_itinerary = create_itinerary(self.user, 1)
+        self.activity = Activity.objects.filter(itinerary=self.itinerary).select_related('location').first()
+
+    def build_payloads(self):
+        itinerary_payload_cache.get(self.itinerary.id)
+        itinerary_payload_cache.get(self.other_itinerary.id)
+
+    def stored_payloads(self):
+        return set(ItineraryPayload.objects.values_list('itinerary_id', flat=True))
+
+    def test_payload_is_built_once_and_served_from_storage(self):
+        payload = itinerary_payload_cache.get(self.itinerary.id)
+
+        self.assertEqual(payload, ItineraryResponseSerializer(self.itinerary).data)
+        with self.assertNumQueries(1):
+            stored = itinerary_payload_cache.get(self.itinerary.id)
+        # Stored as JSON, with the days as string keys
+        self.assertEqual(stored, json.loads(json.dumps(payload)))
+
+    def test_changes_invalidate_the_payloads_of_the_itineraries_they_affect(self):
+        image = Image.objects.filter(location=self.activity.location).first()
+        changes = [
+            ("itinerary saved", lambda: self.itinerary.save()),
+            ("activity saved", lambda: self.activity.save()),
+            ("location saved", lambda: self.activity.location.save()),
+            ("image saved", lambda: image.save()),
+            ("image added", lambda: Image.objects.create(location=self.activity.location, url_prefix="https://media.example.com/new")),
+            ("image deleted", lambda: image.delete()),
+        ]
+        for change, apply_change in changes:
+            with self.subTest(change=change):
+                self.build_payloads()
+
+                apply_change()
+
+                self.assertEqual(self.stored_payloads(), {self.other_itinerary.id})
+                self.assertEqual(itinerary_payload_cache.get(self.itinerary.id), ItineraryResponseSerializer(self.itinerary).data)
+
+    def test_deleted_activity_is_left_out_of_the_rebuilt_payload(self):
+        self.build_payloads()
+
+        self.activity.delete()
+
+        self.assertEqual(self.stored_payloads(), {self.other_itinerary.id})
+        activities = itinerary_payload_cache.get(self.itinerary.id)['activities']
+        self.assertEqual(sum(len(day) for day in activities.values()), 1)
+
+
+class BulkSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="traveller@example.com", password="password")
+        self.params = {'destination': "Paris, France", 'num_of_days': 2, 'start_date': "2030-01-01", 'end_date': "2030-01-02"}
+
+    def save(self, num_of_places, first_id):
+        """Save an itinerary of new places, returning it with the number of queries it took."""
+        place_ids = [str(first_id + index) for index in range(num_of_places)]
+        activities = [
+            {'place_name': f"Place {place_id}", 'day_number': index % 2 + 1, 'time_of_day': "morning", 'description': "A place.", 'duration': "1 hour"}
+            for index, place_id in enumerate(place_ids)
+        ]
+        trip_advisor = StubTripAdvisorClient({})
+        location_details = {place_id: {**trip_advisor.get_place_details(place_id), 'latitude': 48.8 + int(place_id) / 1000} for place_id in place_ids}
+        place_images = {place_id: trip_advisor.get_place_images(place_id) * 2 for place_id in place_ids}
+        with CaptureQueriesContext(connection) as queries:
+            itinerary = ItineraryGenerator()._save(self.user, self.params, activities, place_ids, location_details, place_images)
+        return itinerary, len(queries)
+
+    def test_query_count_does_not_depend_on_number_of_activities(self):
+        _, small_count = self.save(2, first_id=100)
+        itinerary, large_count = self.save(12, first_id=200)
+
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(Activity.objects.filter(itinerary=itinerary).count(), 12)
+        self.assertEqual(LocationDetails.objects.filter(id__gte=200).count(), 12)
+        self.assertEqual(Image.objects.filter(location_id__gte=200).count(), 24)
+        self.assertEqual(itinerary.image_url, "https://media.example.com/200.jpg")
+
+    def test_places_fetched_again_are_not_duplicated(self):
+        self.save(2, first_id=100)
+
+        self.save(2, first_id=100)
+
+        self.assertEqual(LocationDetails.objects.count(), 2)
+        self.assertEqual(Image.objects.count(), 4)
+
+
+class OptimizeRouteTests(SimpleTestCase):
+    def stop(self, day, time_of_day, latitude=None, longitude=None):
+        return {'day': day, 'time_of_day': time_of_day, 'latitude': latitude, 'longitude': longitude}
+
+    def test_empty_and_single_stop(self):
+        self.assertEqual(optimize_route([]), [])
+        self.assertEqual(
+            optimize_route([self.stop(1, "morning", 48.8584, 2.2945)]),
+            [{'day': 1, 'position': 0, 'travel_distance_km': None}]
+        )
+
+    def test_stops_without_coordinates_stay_on_their_day_at_the_end_of_their_slot(self):
+        route = optimize_route([
+            self.stop(1, "morning"),
+            self.stop(1, "morning", 48.8584, 2.2945),
+            self.stop(1, "afternoon", 48.8606, 2.3376),
+            self.stop(2, "evening"),
+        ])
+
+        self.assertEqual(route, [
+            {'day': 1, 'position': 1, 'travel_distance_km': None},
+            {'day': 1, 'position': 0, 'travel_distance_km': None},
+            {'day': 1, 'position': 2, 'travel_distance_km': 3.163},
+            {'day': 2, 'position': 0, 'travel_distance_km': None},
+        ])
+
+    def test_no_stop_has_coordinates(self):
+        route = optimize_route([self.stop(2, "morning"), self.stop(1, "evening"), self.stop(1, "morning")])
+
+        self.assertEqual(route, [
+            {'day': 2, 'position': 0, 'travel_distance_km': None},
+            {'day': 1, 'position': 1, 'travel_distance_km': None},
+            {'day': 1, 'position': 0, 'travel_distance_km': None},
+        ])
+
+    def test_stops_are_regrouped_by_area_keeping_their_slots(self):
+        # Each day was planned with one stop in Paris and one in Versailles
+        route = optimize_route([
+            self.stop(1, "morning", 48.8584, 2.2945),
+            self.stop(1, "afternoon", 48.8049, 2.1204),
+            self.stop(2, "morning", 48.8047, 2.1215),
+            self.stop(2, "afternoon", 48.8606, 2.3376),
+        ])
+
+        self.assertEqual([stop['day'] for stop in route], [1, 2, 2, 1])
+        self.assertEqual([stop['position'] for stop in route], [0, 1, 0, 1])
+        self.assertLess(sum(stop['travel_distance_km'] or 0 for stop in route), 4)
+
+
+class BenchmarkTests(TestCase):
+    def test_cassette_is_replayed_through_the_upstream_clients(self):
+        user = User.objects.create_user(username="benchmark@example.com", password="benchmark")
+        params = {
+            'destination': "Paris, France",
+            'num_of_days': 3,
+            'must_includes': ["Museums"],
+            'start_date': "2030-01-01",
+            'end_date': "2030-01-03",
+            'use_cache': False,
+        }
+        place_search_cache.memory.clear()
+
+        with StubUpstreamServer(load_cassette('paris'), 0, 0) as server, stub_upstreams(server.url), \
+                mock.patch.dict(upstream_rate_limiter.rates, clear=True):
+            itinerary = ItineraryGenerator().generate(user, params)
+
+        self.assertEqual(server.request_counts['gemini'], 1)
+        self.assertGreater(server.request_counts['tripadvisor'], 0)
+        self.assertGreater(Activity.objects.filter(itinerary=itinerary).count(), 0)
+        self.assertFalse(Activity.objects.filter(itinerary=itinerary, location__latitude__isnull=True).exists())
+
+    def test_run_load_counts_failed_and_raising_requests(self):
+        def request(index):
+            if index == 3:
+                raise ValueError("Unexpected response")
+            return index != 5
+
+        with self.assertLogs('api.benchmark', 'WARNING'):
+            result = run_load(request, num_requests=8, concurrency=4)
+
+        self.assertEqual((result['requests'], result['failed']), (8, 2))
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertGreater(result['throughput'], 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        group = SingleFlight('test')
+        calls = []
+        joined = threading.Semaphore(0)
+
+        def fetch(place_id):
+            calls.append(place_id)
+            # Return once the three other callers wait for this call
+            for _ in range(3):
+                self.assertTrue(joined.acquire(timeout=5))
+            return {'id': place_id}
+
+        with mock.patch('api.singleflight.metrics') as metrics, ThreadPoolExecutor(max_workers=4) as executor:
+            metrics.increment.side_effect = lambda name, labels: joined.release()
+            results = list(executor.map(lambda _: group.do('101', fetch, '101'), range(4)))
+
+        self.assertEqual(calls, ['101'])
+        self.assertEqual(results, [{'id': '101'}] * 4)
+        self.assertEqual(metrics.increment.call_count, 3)
+        # Nothing is kept once the call returned
+        self.assertEqual(group.do('101', lambda place_id: {'id': place_id, 'fetched': 'again'}, '101'), {'id': '101', 'fetched': 'again'})
+
+    def test_exception_is_raised_to_every_caller(self):
+        group = SingleFlight('test')
+        joined = threading.Semaphore(0)
+
+        def fetch():
+            self.assertTrue(joined.acquire(timeout=5))
+            raise requests.ConnectionError("Connection refused")
+
+        def call(_):
+            with self.assertRaises(requests.ConnectionError):
+                group.do('101', fetch)
+
+        with mock.patch('api.singleflight.metrics') as metrics, ThreadPoolExecutor(max_workers=2) as executor:
+            metrics.increment.side_effect = lambda name, labels: joined.release()
+            list(executor.map(call, range(2)))
+
+    async def test_async_callers_share_one_call_which_survives_a_cancelled_caller(self):
+        group = AsyncSingleFlight('test')
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch(place_id):
+            calls.append(place_id)
+            await release.wait()
+            return {'id': place_id}
+
+        callers = [asyncio.create_task(group.do('101', fetch, '101')) for _ in range(4)]
+        await asyncio.sleep(0)
+        callers[0].cancel()
+        release.set()
+        results = await asyncio.gather(*callers[1:])
+
+        self.assertEqual(calls, ['101'])
+        self.assertEqual(results, [{'id': '101'}] * 3)
+        self.assertTrue(callers[0].cancelled())
+        self.assertEqual(await group.do('101', fetch, '102'), {'id': '102'})
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.outbox = EmailOutbox(max_attempts=3, retry_delay=30, lease_timeout=300)
+        self.email = self.outbox.enqueue("traveller@example.com", "Email Verification", "Click the link below.")
+
+    def failing_connection(self, *errors):
+        """A mail server connection raising the given errors in turn, then sending."""
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [*errors, 1]
+        return connection
+
+    def send_due(self, connection):
+        """Make every pending email due, then claim and send them."""
+        OutboundEmail.objects.filter(status=OutboundEmail.PENDING).update(next_attempt_at=timezone.now())
+        return self.outbox.send(self.outbox.claim(10), connection)
+
+    def test_email_is_sent_once(self):
+        self.assertEqual(self.outbox.depth(), 1)
+
+        self.assertEqual(self.send_due(mail.get_connection()), {'sent': 1, 'retried': 0, 'failed': 0})
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual((mail.outbox[0].to, mail.outbox[0].subject), (["traveller@example.com"], "Email Verification"))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts, self.email.error), (OutboundEmail.SENT, 1, None))
+        self.assertEqual(self.outbox.depth(), 0)
+        self.assertEqual(self.outbox.claim(10), [])
+
+    def test_claimed_email_is_leased(self):
+        self.assertEqual(self.outbox.claim(10), [self.email])
+        self.assertEqual(self.outbox.claim(10), [])
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.outbox.claim(10), [self.email])
+
+    def test_transient_errors_are_retried_with_backoff_until_max_attempts(self):
+        connection = self.failing_connection(*[smtplib.SMTPDataError(451, "Try again later")] * 3)
+
+        with self.assertLogs('api.outbox', 'WARNING') as logs:
+            for attempt, delay in [(1, 30), (2, 60)]:
+                before = timezone.now()
+                self.assertEqual(self.send_due(connection), {'sent': 0, 'retried': 1, 'failed': 0})
+                self.email.refresh_from_db()
+                self.assertEqual((self.email.status, self.email.attempts), (OutboundEmail.PENDING, attempt))
+                self.assertGreaterEqual(self.email.next_attempt_at, before + timedelta(seconds=delay))
+                self.assertLess(self.email.next_attempt_at, before + timedelta(seconds=delay + 5))
+
+            self.assertEqual(self.send_due(connection), {'sent': 0, 'retried': 0, 'failed': 1})
+
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutboundEmail.FAILED, 3))
+        self.assertIn("Try again later", self.email.error)
+        self.assertEqual(logs.records[-1].levelname, 'ERROR')
+        self.assertEqual(self.send_due(connection), {'sent': 0, 'retried': 0, 'failed': 0})
+
+    def test_permanent_errors_are_not_retried(self):
+        errors = [
+            smtplib.SMTPRecipientsRefused({"traveller@example.com": (550, b"No such user")}),
+            smtplib.SMTPDataError(554, "Message rejected"),
+        ]
+        for error in errors:
+            with self.subTest(error=error):
+                OutboundEmail.objects.all().delete()
+                self.outbox.enqueue("traveller@example.com", "Email Verification", "Click the link below.")
+
+                with self.assertLogs('api.outbox', 'ERROR'):
+                    self.assertEqual(self.send_due(self.failing_connection(error)), {'sent': 0, 'retried': 0, 'failed': 1})
+                self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.FAILED)
+
+    def test_dropped_connection_is_reopened_once(self):
+        connection = self.failing_connection(smtplib.SMTPServerDisconnected("Connection closed"))
+
+        self.assertEqual(self.send_due(connection), {'sent': 1, 'retried': 0, 'failed': 0})
+        self.assertEqual(connection.open.call_count, 2)
+
+    def test_unreachable_server_retries_the_batch(self):
+        self.outbox.enqueue("other@example.com", "Email Verification", "Click the link below.")
+        connection = mock.Mock()
+        connection.open.side_effect = ConnectionRefusedError("Connection refused")
+
+        with self.assertLogs('api.outbox', 'WARNING'):
+            self.assertEqual(self.send_due(connection), {'sent': 0, 'retried': 2, 'failed': 0})
+
+        connection.send_messages.assert_not_called()
+        self.assertEqual(self.outbox.depth(), 2)
+
+
+class WarmDestinationsTests(TransactionTestCase):
+    """Warm plans from threads of the command, which need their writes committed."""
+
+    def setUp(self):
+        gemini_response_cache.memory.clear()
+        place_search_cache.memory.clear()
+        self.session = mock.MagicMock()
+        self.session.post.return_value.__enter__.return_value.iter_lines.side_effect = (
+            lambda decode_unicode: gemini_stream_lines(ItineraryGeneratorTests.ACTIVITIES)
+        )
+        self.trip_advisor = StubTripAdvisorClient({
+            activity['place_name']: str(101 + index) for index, activity in enumerate(ItineraryGeneratorTests.ACTIVITIES)
+        })
+        for target, client in [
+            ('api.generation.gemini_client', GeminiAPIClient("key", session=self.session, cache=gemini_response_cache)),
+            ('api.generation.trip_advisor_client', self.trip_advisor),
+        ]:
+            patcher = mock.patch(target, client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def warm(self, *args):
+        stdout = io.StringIO()
+        call_command('warm_destinations', "Paris, France", "--days", "2", *args, stdout=stdout)
+        self.trip_advisor.requests.clear()
+        return stdout.getvalue()
+
+    def stored(self):
+        return LocationDetails.objects.count(), Image.objects.count(), PlaceSearchResult.objects.count(), GeminiResponse.objects.count()
+
+    def test_warming_again_is_served_from_caches_and_stores_nothing_new(self):
+        output = self.warm()
+        self.assertIn("4 activities at 4 places, 4 searches and 8 place requests", output)
+        self.assertIn("Warmed 1 of 1 plan(s)", output)
+        self.assertEqual(self.stored(), (4, 4, 4, 1))
+        self.assertFalse(Itinerary.objects.exists())
+
+        gemini_response_cache.memory.clear()
+        place_search_cache.memory.clear()
+        output = self.warm()
+
+        self.assertIn("4 activities at 4 places, 0 searches and 0 place requests", output)
+        self.assertEqual(self.session.post.call_count, 1)
+        self.assertEqual(self.stored(), (4, 4, 4, 1))
+
+    def test_refresh_generates_a_new_plan(self):
+        self.warm()
+
+        output = self.warm("--refresh")
+
+        self.assertIn("4 activities at 4 places, 0 searches and 0 place requests", output)
+        self.assertEqual(self.session.post.call_count, 2)
+        self.assertEqual(self.stored(), (4, 4, 4, 1))
+
+
+class FastJSONTests(SimpleTestCase):
+    DATA = {
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'rating': Decimal('4.5'),
+        'created': datetime(2030, 1, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'local': datetime(2030, 1, 1, 9, 30),
+        'offset': datetime(2030, 1, 1, 9, 30, tzinfo=dt_timezone(timedelta(hours=2))),
+        'day': date(2030, 1, 1),
+        'time': dt_time(9, 30, 15, 500),
+        'duration': timedelta(hours=2),
+        'message': gettext_lazy("Not found."),
+        'text': "Caf\u00e9 \u2028 line \u2029 paragraph \U0001F5FC",
+        'activities': {1: [{'distance_km': 3.163, 'position': 0, 'visited': True, 'image': None}]},
+        'list': [1, 2.5, "three", [], {}],
+    }
+
+    def test_renderer_matches_drf_json_renderer(self):
+        for data in [self.DATA, [self.DATA, self.DATA], {}, [], "text", 0]:
+            with self.subTest(data=data):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_renderer_leaves_empty_and_indented_output_to_drf(self):
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        self.assertEqual(
+            FastJSONRenderer().render(self.DATA, 'application/json; indent=2'),
+            JSONRenderer().render(self.DATA, 'application/json; indent=2')
+        )
+
+    def test_json_response_matches_django_json_response(self):
+        self.assertEqual(
+            json.loads(JsonResponse(self.DATA).content),
+            json.loads(DjangoJsonResponse(self.DATA).content)
+        )
+        with self.assertRaises(TypeError):
+            JsonResponse([self.DATA])
+
+    def test_parser_reads_rendered_json_and_rejects_invalid_json(self):
+        content = FastJSONRenderer().render(self.DATA)
+
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(content)), json.loads(content))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"destination": '))
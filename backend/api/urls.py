@@ -6,9 +6,13 @@ from .views.user import (
 )
 from .views.itineraries import (
     GenerateItineraryView,
+    GenerateItineraryStreamView,
     RecentItinerariesView,
-    ItineraryDetailView
+    ItineraryDetailView,
+    ItineraryJobView
 )
+from .views.locations import NearbyLocationsView
+from .views.metrics import MetricsView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
@@ -24,6 +28,14 @@ urlpatterns = [
 
     # Itinerary-related endpoints
     path("itinerary/generate/", GenerateItineraryView.as_view(), name="generate_itinerary"),
+    path("itinerary/generate/stream/", GenerateItineraryStreamView.as_view(), name="generate_itinerary_stream"),
+    path("itinerary/jobs/<uuid:job_id>/", ItineraryJobView.as_view(), name="itinerary_job"),
     path("itinerary/recent/", RecentItinerariesView.as_view(), name="recent_itineraries"),
     path("itinerary/<int:itinerary_id>/", ItineraryDetailView.as_view(), name="itinerary_detail"),
+
+    # Location-related endpoints
+    path("locations/nearby/", NearbyLocationsView.as_view(), name="nearby_locations"),
+
+    # Monitoring endpoints
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
\ No newline at end of file
@@ -0,0 +1,141 @@
+from typing import Any, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from ..renderers import FastJSONRenderer, JsonResponse
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    Base of the async API views.
+
+    DRF views are synchronous, so these are plain Django views that apply the same policies
+    as APIView before calling their handler: authentication, permissions, throttling and
+    content negotiation, configured by the same attributes and DRF settings. Request bodies
+    are parsed by the DRF parsers of the view, see parse_data. Errors are answered like DRF
+    does, with a WWW-Authenticate header on 401s and Retry-After on 429s. Handlers answer in
+    JSON. Under ASGI they run on the event loop; ORM work must go through sync_to_async.
+    """
+
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    content_negotiation_class = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    # Media types the handlers answer with, for content negotiation only
+    renderer_classes = [FastJSONRenderer]
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """
+        Check the request against the policies of the view, setting request.user, before calling its handler.
+
+        The DRF request wrapping the HttpRequest is kept as self.request, like in APIView. APIExceptions raised
+        by the handler, such as a ParseError of parse_data, are answered like the rejections of the policies.
+        """
+        drf_request = Request(
+            request,
+            parsers=self.get_parsers(),
+            authenticators=self.get_authenticators(),
+            negotiator=self.content_negotiation_class(),
+            parser_context={'view': self, 'args': args, 'kwargs': kwargs},
+        )
+        self.request = drf_request
+        try:
+            await sync_to_async(self.initial)(drf_request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as e:
+            return self.handle_exception(drf_request, e)
+
+    def initial(self, request: Request) -> None:
+        """
+        Authenticate, negotiate, and check permissions and throttles, like APIView.initial.
+
+        Raises:
+            APIException: If the request is not allowed.
+        """
+        # Authenticating sets user and auth on the wrapped HttpRequest as well
+        request.user
+        self.content_negotiation_class().select_renderer(request, [renderer() for renderer in self.renderer_classes])
+        self.check_permissions(request)
+        self.check_throttles(request)
+
+    def get_parsers(self) -> List[Any]:
+        """Instantiate the parsers of the view."""
+        return [parser() for parser in self.parser_classes]
+
+    def get_authenticators(self) -> List[Any]:
+        """Instantiate the authenticators of the view."""
+        return [auth() for auth in self.authentication_classes]
+
+    def check_permissions(self, request: Request) -> None:
+        """
+        Check every permission of the view, see APIView.check_permissions.
+
+        Raises:
+            NotAuthenticated: If a permission is missing and the request is not authenticated.
+            PermissionDenied: If a permission is missing.
+        """
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(
+                    detail=getattr(permission, 'message', None),
+                    code=getattr(permission, 'code', None)
+                )
+
+    def check_throttles(self, request: Request) -> None:
+        """
+        Check every throttle of the view, see APIView.check_throttles.
+
+        Raises:
+            Throttled: If a throttle rejects the request, with the longest wait of the throttles.
+        """
+        durations = []
+        for throttle in [throttle() for throttle in self.throttle_classes]:
+            if not throttle.allow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            raise exceptions.Throttled(max((duration for duration in durations if duration is not None), default=None))
+
+    def handle_exception(self, request: Request, exc: exceptions.APIException) -> HttpResponse:
+        """Answer a rejected request like DRF's exception handler, in JSON."""
+        headers = {}
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # WWW-Authenticate header for 401 responses, else coerce to 403
+            auth_header = self.get_authenticate_header(request)
+            if auth_header:
+                headers['WWW-Authenticate'] = auth_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        if getattr(exc, 'wait', None):
+            headers['Retry-After'] = '%d' % exc.wait
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return JsonResponse(data, safe=False, status=exc.status_code, headers=headers)
+
+    def get_authenticate_header(self, request: Request) -> Optional[str]:
+        """The WWW-Authenticate header of the first authenticator, for 401 responses."""
+        authenticators = self.get_authenticators()
+        if authenticators:
+            return authenticators[0].authenticate_header(request)
+        return None
+
+    async def parse_data(self) -> Any:
+        """
+        Parse the body of the request with the parsers of the view, like request.data in APIView.
+
+        An empty body is parsed as an empty dict.
+
+        Raises:
+            ParseError: If the body is malformed.
+            UnsupportedMediaType: If no parser of the view accepts the content type of the body.
+        """
+        return await sync_to_async(lambda: self.request.data)()
@@ -1,226 +1,306 @@
-from django.contrib.auth.models import User
+import asyncio
+import contextvars
+import logging
+from datetime import datetime
 from rest_framework import status
-from rest_framework.response import Response
-from rest_framework.views import APIView
-from django.db import transaction
-from rest_framework.request import Request
-from typing import Dict, Any, List, Optional
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import User
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max
+from typing import Dict, Any, AsyncIterator, Optional, Set
 
+from .base import AsyncAPIView
 from ..serializers import (
-    ItinerarySerializer,
+    ItineraryListSerializer,
     ItineraryRequestSerializer,
-    ImageSerializer,
-    ActivitySerializer,
-    LocationDetailsSerializer,
-    ItineraryResponseSerializer
+    ItineraryJobSerializer
 )
-from ..models import Itinerary, LocationDetails, Image
-from ..services import gemini_client, trip_advisor_client
+from ..models import Itinerary, ItineraryJob
+from ..jobs import itinerary_job_queue
+from ..cache import itinerary_payload_cache
+from ..images import ImageSelection
+from ..conditional import make_etag, not_modified, set_etag
+from ..pagination import KeysetPagination
+from ..generation import AsyncItineraryGenerator, ItineraryGenerationError
+from ..instrumentation import trace
+from ..renderers import EventStreamRenderer, FastJSONRenderer, JsonResponse
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds without events after which a comment is sent to keep the stream open through proxies
+STREAM_KEEPALIVE_INTERVAL = 15
 
+# Streamed generations running on the event loop; the loop only keeps weak references to tasks
+_generation_tasks: Set[asyncio.Task] = set()
 
-class GenerateItineraryView(APIView):
+
+class GenerateItineraryView(AsyncAPIView):
     """
-    View for generating and saving itineraries.
-    
-    Terms:
-    - Itinerary: Represents the overall trip plan, which includes multiple activities..
-    - Activity: A single activity in the itinerary, like visiting a place at a specific time.
-    - Location: A place visited during the trip.
-    - Image: Photo of a location.
+    View for queueing itinerary generation.
+
+    Generation runs in the process_itinerary_jobs worker, see ItineraryGenerator.
     """
 
-    @transaction.atomic
-    def post(self, request: Request) -> Response:
+    async def post(self, request: HttpRequest) -> HttpResponse:
         """
-        Generate and save an itinerary based on user input.
+        Queue the generation of an itinerary based on user input.
 
         Args:
             request: The HTTP request object containing itinerary parameters.
 
         Returns:
-            Response: HTTP response with generated itinerary data or error message.
+            HttpResponse: HTTP response with the queued job or error message.
         """
-        validated_request = self._validate_request(request.data)
-        if not validated_request.is_valid():
-            return Response(validated_request.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        itinerary_params = validated_request.validated_data
-        # This is where the itinerary is generated
-        generated_itinerary = self._generate_itinerary(itinerary_params)
-        
-        if generated_itinerary is None:
-            return Response({"message": "Failed to generate itinerary"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        created_itinerary = self._create_itinerary(request.user, itinerary_params)
-        self._process_activities(created_itinerary, generated_itinerary, itinerary_params['destination'])
-        return self._create_response(created_itinerary)
+        validated_request = self._validate_request(await self.parse_data())
+        if not await sync_to_async(validated_request.is_valid)():
+            return JsonResponse(validated_request.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        job = await sync_to_async(itinerary_job_queue.enqueue)(request.user, validated_request.data)
+        response = JsonResponse({
+            "message": "Itinerary generation started",
+            "data": ItineraryJobSerializer(job).data
+        }, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = reverse("itinerary_job", args=[job.pk])
+        return response
 
     def _validate_request(self, request_data: Dict[str, Any]) -> ItineraryRequestSerializer:
         """Validate the incoming request data."""
         return ItineraryRequestSerializer(data=request_data)
 
-    def _generate_itinerary(self, itinerary_params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Generate itinerary data using the Gemini API client."""
-        return gemini_client.get_places_to_visit(
-            itinerary_params['destination'],
-            itinerary_params['num_of_days'],
-            itinerary_params['must_includes']
+
+class GenerateItineraryStreamView(AsyncAPIView):
+    """
+    View generating an itinerary while streaming it as Server-Sent Events.
+
+    Unlike GenerateItineraryView, generation runs in this process, on the event loop,
+    and its parts are sent as soon as they are available:
+    - progress: {stage, completed, total}, as in ItineraryJob.
+    - plan: The activities generated by Gemini.
+    - activity: An activity of the plan, by index, with its place details and images.
+    - itinerary: The saved itinerary, as returned by ItineraryDetailView.
+    - error: {message}, if the generation failed.
+
+    Serve the application with ASGI so that events are not buffered.
+    """
+
+    renderer_classes = [EventStreamRenderer, FastJSONRenderer]
+
+    async def post(self, request: HttpRequest) -> HttpResponse:
+        """
+        Generate an itinerary based on user input, streaming its parts.
+
+        Args:
+            request: The HTTP request object containing itinerary parameters.
+
+        Returns:
+            HttpResponse: A text/event-stream response, or a JSON error response.
+        """
+        validated_request = ItineraryRequestSerializer(data=await self.parse_data())
+        if not await sync_to_async(validated_request.is_valid)():
+            return JsonResponse(validated_request.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            self._stream(request.user, validated_request.data),
+            content_type="text/event-stream"
         )
+        response['Cache-Control'] = "no-cache"
+        response['X-Accel-Buffering'] = "no"
+        return response
+
+    async def _stream(self, user: User, itinerary_params: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """Run the generation in a task and relay its events as they arrive."""
+        events = asyncio.Queue()
+
+        def emit(event: Optional[str], data: Optional[Dict[str, Any]]) -> None:
+            events.put_nowait((event, data))
+
+        # The generation completes, and the itinerary is saved, even if the client disconnects. It runs in
+        # a context of its own, so that it does not outlive the request's thread and database connection
+        task = asyncio.create_task(self._generate(user, itinerary_params, emit), context=contextvars.Context())
+        _generation_tasks.add(task)
+        task.add_done_callback(_generation_tasks.discard)
+        while True:
+            try:
+                event, data = await asyncio.wait_for(events.get(), timeout=STREAM_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield EventStreamRenderer().render((event, data))
+
+    async def _generate(self, user: User, itinerary_params: Dict[str, Any], emit) -> None:
+        """
+        Generate the itinerary, emitting its events and finally None.
+
+        Its sync work runs in a thread of its own, whose database connections are closed once it is done.
+        """
+        async with ThreadSensitiveContext():
+            try:
+                with trace('itinerary_stream', user_id=user.id) as stream_trace:
+                    generator = AsyncItineraryGenerator(
+                        on_progress=lambda stage, completed, total: emit(
+                            'progress', {'stage': stage, 'completed': completed, 'total': total}
+                        ),
+                        on_event=emit
+                    )
+                    itinerary = await generator.agenerate(user, itinerary_params)
+                    stream_trace.fields.update(itinerary_id=itinerary.id)
+                    emit('itinerary', await sync_to_async(itinerary_payload_cache.get)(itinerary.id))
+            except ItineraryGenerationError as e:
+                emit('error', {'message': str(e)})
+            except Exception as e:
+                logger.exception("Streaming itinerary generation failed")
+                emit('error', {'message': f"An unexpected error occurred: {str(e)}"})
+            finally:
+                emit(None, None)
+                await sync_to_async(connections.close_all)()
+
 
-    def _create_itinerary(self, user: User, itinerary_params: Dict[str, Any]) -> Itinerary:
-        """Create and save a new Itinerary instance."""
-        itinerary_data = {
-            'user': user.id,
-            'start_date': itinerary_params['start_date'],
-            'end_date': itinerary_params['end_date'],
-            'total_days': itinerary_params['num_of_days'],
-            'destination': itinerary_params['destination'],
-            'image_url': None,
-            'name': (
-                itinerary_params['destination'].split(',')[0] +
-                ' Itinerary for ' +
-                str(itinerary_params['num_of_days']) +
-                ' days'
-            )
-        }
-        serializer = ItinerarySerializer(data=itinerary_data)
-        if serializer.is_valid():
-            return serializer.save()
-        else:
-            raise Exception(serializer.errors)
-
-    def _process_activities(self, itinerary: Itinerary, generated_itinerary: Dict[str, Any], destination: str) -> None:
-        """Process and save activities for the itinerary."""
-        for activity in generated_itinerary['itinerary']:
-            place_id = trip_advisor_client.get_tourist_place_id(activity['place_name'], destination)
-            if place_id:
-                self._get_or_create_location(place_id)
-                self._create_activity(itinerary, activity, place_id)
-                images = self._fetch_and_save_images(place_id)
-                if images and not itinerary.image_url:
-                    for image in images:
-                        itinerary.image_url = image['original']
-                        itinerary.save()
-                        break
-
-    def _get_or_create_location(self, place_id: str) -> LocationDetails:
-        """Get or create a LocationDetails instance for the given place_id."""
+class ItineraryJobView(AsyncAPIView):
+    """View for polling the progress of an itinerary generation job."""
+
+    async def get(self, request: HttpRequest, job_id: str) -> HttpResponse:
+        """
+        Retrieve the status of a job, and the generated itinerary once it succeeded.
+
+        Args:
+            request: The HTTP request object. Accepts the images of the itinerary to include
+                as image_sizes and max_images, see ItineraryDetailView.
+            job_id (str): The ID of the job to retrieve.
+
+        Returns:
+            HttpResponse: HTTP response with job details or error message.
+        """
         try:
-            return LocationDetails.objects.get(id=place_id)
-        except LocationDetails.DoesNotExist:
-            location_data = trip_advisor_client.get_place_details(place_id)
-            if location_data:
-                serializer = LocationDetailsSerializer(data=location_data)
-                if serializer.is_valid():
-                    return serializer.save()
-                else:
-                    raise Exception(serializer.errors)
-            else:
-                raise Exception(f"Could not fetch details for place_id: {place_id}")
-
-    def _create_activity(self, itinerary: Itinerary, activity_data: Dict[str, Any], place_id: str) -> ActivitySerializer:
-        """Create and save an Activity instance."""
-        activity_data = {
-            'name': activity_data['place_name'],
-            'itinerary': itinerary.id,
-            'description': activity_data['description'],
-            'location': int(place_id),
-            'duration': activity_data['duration'],
-            'day': activity_data['day_number'],
-            'time_of_day': activity_data['time_of_day']
-        }
-        serializer = ActivitySerializer(data=activity_data)
-        if serializer.is_valid():
-            return serializer.save()
-        else:
-            raise Exception(serializer.errors)
-
-    def _fetch_and_save_images(self, place_id: str) -> Optional[List[Dict[str, Any]]]:
-        """Fetch and save images for a given place_id."""
-        # Try to get the images from the database
-        existing_images = Image.objects.filter(location_id=place_id)
-        if existing_images.exists():
-            # Return the serialized images if found
-            return ImageSerializer(existing_images, many=True).data
-
-        # Fetch images from TripAdvisor if not in the database
-        images = trip_advisor_client.get_place_images(place_id)
-        if images:
-            # Serialize and save the fetched images
-            serializer = ImageSerializer(data=images, many=True)
-            if serializer.is_valid():
-                serializer.save()  # Save the images to the database
-                return serializer.data  # Return the serialized data
-            else:
-                # Raise an exception if the data is invalid
-                raise Exception(serializer.errors)
-
-        return None
-
-    def _create_response(self, itinerary: Itinerary) -> Response:
-        """Create the HTTP response for the generated itinerary."""
-        itinerary_serializer = ItineraryResponseSerializer(itinerary)
-        return Response({
-            "message": "Itinerary created and saved successfully!",
-            "data": itinerary_serializer.data
-        }, status=status.HTTP_201_CREATED)
-
-
-class RecentItinerariesView(APIView):
-    """View for retrieving recent itineraries for a user."""
-
-    def get(self, request: Request) -> Response:
+            try:
+                image_selection = ImageSelection.from_query(request.GET)
+            except ValueError as e:
+                return JsonResponse({"error": f"Invalid image selection: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            job = await ItineraryJob.objects.aget(id=job_id, user=request.user)
+            data = ItineraryJobSerializer(job).data
+            if job.status == ItineraryJob.SUCCEEDED and job.itinerary_id:
+                data['itinerary_details'] = image_selection.apply(
+                    await sync_to_async(itinerary_payload_cache.get)(job.itinerary_id)
+                )
+            return JsonResponse({
+                "message": f"Itinerary generation {job.status}",
+                "data": data
+            }, status=status.HTTP_200_OK)
+        except ItineraryJob.DoesNotExist:
+            return JsonResponse({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return JsonResponse({"message": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class RecentItinerariesView(AsyncAPIView):
+    """
+    View for retrieving recent itineraries for a user.
+
+    Results are paginated with an opaque cursor: pass the next_cursor of a page as
+    the cursor parameter to retrieve the following one. Pages carry an ETag derived from
+    the number and last update of the user's itineraries, and a request whose If-None-Match
+    matches it is answered with a 304 before the page is fetched.
+    """
+
+    pagination = KeysetPagination(settings.RECENT_ITINERARIES_PAGE_SIZE, settings.RECENT_ITINERARIES_MAX_PAGE_SIZE)
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
         """
         Retrieve recent itineraries for the authenticated user.
 
         Args:
-            request: The HTTP request object.
+            request: The HTTP request object. Accepts the page size as page_size
+                (or num_of_itinerary) and the cursor of the page as cursor.
 
         Returns:
-            Response: HTTP response with recent itineraries data or error message.
+            HttpResponse: HTTP response with recent itineraries data or error message.
         """
         try:
-            num_of_itinerary = request.query_params.get('num_of_itinerary', 5)
+            num_of_itinerary = request.GET.get('page_size', request.GET.get('num_of_itinerary'))
             try:
-                num_of_itinerary = int(num_of_itinerary)
-                if num_of_itinerary <= 0:
-                    raise ValueError("Number of itineraries must be positive")
+                num_of_itinerary = self.pagination.get_page_size(num_of_itinerary)
             except ValueError as e:
-                return Response({"error": f"Invalid value for 'num_of_itinerary': {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+                return JsonResponse({"error": f"Invalid value for 'num_of_itinerary': {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-            recent_itineraries = Itinerary.objects.filter(user=request.user).order_by('-createdAt')[:num_of_itinerary]
-            serializer = ItinerarySerializer(recent_itineraries, many=True)
+            queryset = Itinerary.objects.filter(user=request.user)
+            version = await queryset.aaggregate(count=Count('id'), updated_at=Max('updatedAt'))
+            etag = make_etag('recent', request.user.id, version['count'], version['updated_at'], num_of_itinerary, request.GET.get('cursor'))
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
 
-            return Response({
-                "message": f"Retrieved {len(serializer.data)} recent itineraries",
-                "data": serializer.data
-            }, status=status.HTTP_200_OK)
+            try:
+                data, next_cursor = await sync_to_async(self._page)(
+                    queryset.only(*ItineraryListSerializer.Meta.fields), num_of_itinerary, request.GET.get('cursor')
+                )
+            except ValueError as e:
+                return JsonResponse({"error": f"Invalid value for 'cursor': {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            return set_etag(JsonResponse({
+                "message": f"Retrieved {len(data)} recent itineraries",
+                "data": data,
+                "next_cursor": next_cursor
+            }, status=status.HTTP_200_OK), etag)
         except Exception as e:
-            return Response({"message": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({"message": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _page(self, queryset, page_size: int, cursor: Optional[str]):
+        """Fetch and serialize one page of itineraries, returning it with the cursor of the next one."""
+        recent_itineraries, next_cursor = self.pagination.paginate(queryset, page_size, cursor)
+        return ItineraryListSerializer(recent_itineraries, many=True).data, next_cursor
+
 
+class ItineraryDetailView(AsyncAPIView):
+    """
+    View for retrieving details of a specific itinerary.
 
-class ItineraryDetailView(APIView):
-    """View for retrieving details of a specific itinerary."""
+    Responses carry an ETag derived from the version of the stored payload and the image
+    selection, and a request whose If-None-Match matches it is answered with a 304 before
+    the payload is loaded.
+    """
 
-    def get(self, request: Request, itinerary_id: int) -> Response:
+    async def get(self, request: HttpRequest, itinerary_id: int) -> HttpResponse:
         """
         Retrieve details for a specific itinerary.
 
         Args:
-            request: The HTTP request object.
+            request: The HTTP request object. Accepts the comma-separated image sizes to include
+                as image_sizes (all of them by default) and the maximum number of images by
+                place as max_images (all of them by default).
             itinerary_id (int): The ID of the itinerary to retrieve.
 
         Returns:
-            Response: HTTP response with itinerary details or error message.
+            HttpResponse: HTTP response with itinerary details or error message.
         """
         try:
-            itinerary = Itinerary.objects.get(id=itinerary_id)
-            serializer = ItineraryResponseSerializer(itinerary)
-            return Response({
+            try:
+                image_selection = ImageSelection.from_query(request.GET)
+            except ValueError as e:
+                return JsonResponse({"error": f"Invalid image selection: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            version = await sync_to_async(itinerary_payload_cache.version)(itinerary_id)
+            if version is not None:
+                response = not_modified(request, self._etag(itinerary_id, version, image_selection))
+                if response is not None:
+                    return response
+
+            data, version = await sync_to_async(itinerary_payload_cache.get_versioned)(itinerary_id)
+            return set_etag(JsonResponse({
                 "message": "Itinerary details retrieved successfully",
-                "data": serializer.data
-            }, status=status.HTTP_200_OK)
+                "data": image_selection.apply(data)
+            }, status=status.HTTP_200_OK), self._etag(itinerary_id, version, image_selection))
         except Itinerary.DoesNotExist:
-            return Response({"message": "Itinerary not found"}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse({"message": "Itinerary not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            return Response({"message": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({"message": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def _etag(itinerary_id: int, version: datetime, image_selection: ImageSelection) -> str:
+        """Build the ETag of the detail response of a payload version."""
+        return make_etag('detail', itinerary_id, version, image_selection.sizes, image_selection.max_images)
@@ -0,0 +1,34 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.request import Request
+
+from ..serializers import NearbyLocationsRequestSerializer, NearbyLocationSerializer
+from ..geo import nearby_locations
+
+
+class NearbyLocationsView(APIView):
+    """View for finding stored locations around a point."""
+
+    def get(self, request: Request) -> Response:
+        """
+        Retrieve the locations within a radius of a point, closest first.
+
+        Args:
+            request: The HTTP request object with latitude, longitude and optional
+                radius_km and limit query parameters.
+
+        Returns:
+            Response: HTTP response with nearby locations data or error message.
+        """
+        validated_request = NearbyLocationsRequestSerializer(data=request.query_params)
+        if not validated_request.is_valid():
+            return Response(validated_request.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        params = validated_request.validated_data
+        locations = nearby_locations(params['latitude'], params['longitude'], params['radius_km'], params['limit'])
+        serializer = NearbyLocationSerializer(locations, many=True)
+        return Response({
+            "message": f"Retrieved {len(serializer.data)} nearby locations",
+            "data": serializer.data
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.permissions import AllowAny
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from ..instrumentation import metrics
+from ..outbox import email_outbox
+
+
+class MetricsView(APIView):
+    """
+    View exposing the metrics of this process in the Prometheus text format.
+
+    Scrapers authenticate with the METRICS_TOKEN bearer token. The endpoint is disabled
+    when no token is configured, since the metrics describe the traffic of every user.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request: Request) -> HttpResponse:
+        """
+        Render the metrics.
+
+        Args:
+            request: The HTTP request object.
+
+        Returns:
+            HttpResponse: The Prometheus text exposition, 401 without a valid token,
+                or 404 if the endpoint is disabled.
+        """
+        if not settings.METRICS_TOKEN:
+            return HttpResponse("Not Found\n", status=404, content_type="text/plain")
+        if not constant_time_compare(
+            request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+        # The outbox is drained by another process, so its depth is counted when scraped
+        email_outbox.depth()
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
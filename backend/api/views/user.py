@@ -3,6 +3,7 @@ from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
+from django.db import transaction
 from django.db.utils import IntegrityError
 from rest_framework.request import Request
 
@@ -20,7 +21,7 @@ class CreateUserView(generics.CreateAPIView):
 
     def create(self, request: Request) -> Response:
         """
-        Create a new user account and send a verification email.
+        Create a new user account and queue its verification email.
 
         Args:
             request: The HTTP request object.
@@ -31,13 +32,14 @@ class CreateUserView(generics.CreateAPIView):
         try:
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            user = serializer.save()
-            
-            # Create and save the verification token
-            token = EmailVerificationToken.objects.create(user=user)
-            
-            # Send verification email
-            email_service.send_verification_email(user.email, token.token)
+            with transaction.atomic():
+                user = serializer.save()
+
+                # Create and save the verification token
+                token = EmailVerificationToken.objects.create(user=user)
+
+                # Queue the verification email, sent with the user only once it is committed
+                email_service.queue_verification_email(user.email, token.token)
             
             headers = self.get_success_headers(serializer.data)
             response_data = {
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 from dotenv import load_dotenv
 from datetime import timedelta
 import dj_database_url
@@ -50,6 +52,16 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    # JSON is rendered and parsed with orjson, see api/renderers.py
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SIMPLE_JWT = {
@@ -73,6 +85,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -172,6 +186,89 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 TRIPADVISOR_API_KEY = os.getenv('TRIPADVISOR_API_KEY')
 
+# Maximum number of TripAdvisor lookups resolved in parallel for one itinerary
+TRIPADVISOR_MAX_WORKERS = int(os.getenv('TRIPADVISOR_MAX_WORKERS') or 8)
+
+# Outbound HTTP: connections kept alive per host, retries on 429/5xx and timeouts in seconds
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE') or TRIPADVISOR_MAX_WORKERS)
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES') or 2)
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR') or 0.5)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT') or 3.05)
+GEMINI_READ_TIMEOUT = float(os.getenv('GEMINI_READ_TIMEOUT') or 60)
+TRIPADVISOR_READ_TIMEOUT = float(os.getenv('TRIPADVISOR_READ_TIMEOUT') or 10)
+
+# Async outbound HTTP: connections open at once per process, shared by every in-flight request
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS') or 200)
+
+# Upstream rate limits in requests per second, shared by every process of the host (0 disables one).
+# Any one-second window sees at most rate * (1 + burst) requests: the TripAdvisor budgets add up to 40,
+# which stays within its quota of 50 requests per second. Split the budgets between hosts when scaling out
+GEMINI_RATE_LIMIT = float(os.getenv('GEMINI_RATE_LIMIT') or 12)
+TRIPADVISOR_SEARCH_RATE_LIMIT = float(os.getenv('TRIPADVISOR_SEARCH_RATE_LIMIT') or 16)
+TRIPADVISOR_DETAILS_RATE_LIMIT = float(os.getenv('TRIPADVISOR_DETAILS_RATE_LIMIT') or 12)
+TRIPADVISOR_IMAGES_RATE_LIMIT = float(os.getenv('TRIPADVISOR_IMAGES_RATE_LIMIT') or 12)
+# Seconds of budget saved up while idle, seconds a request may be queued, and where the buckets are kept
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST') or 0.25)
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT') or 30)
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR') or os.path.join(tempfile.gettempdir(), 'planmyitinerary-ratelimit')
+
+# TripAdvisor search cache: in-process entries and time-to-live in seconds of matches and misses
+PLACE_SEARCH_CACHE_SIZE = int(os.getenv('PLACE_SEARCH_CACHE_SIZE') or 10000)
+PLACE_SEARCH_CACHE_TTL = int(os.getenv('PLACE_SEARCH_CACHE_TTL') or 30 * 24 * 60 * 60)
+PLACE_SEARCH_NEGATIVE_CACHE_TTL = int(os.getenv('PLACE_SEARCH_NEGATIVE_CACHE_TTL') or 24 * 60 * 60)
+
+# Gemini response cache: in-process entries, stored entries and time-to-live in seconds
+GEMINI_CACHE_SIZE = int(os.getenv('GEMINI_CACHE_SIZE') or 256)
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES') or 5000)
+GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL') or 7 * 24 * 60 * 60)
+
+# Itinerary generation jobs: seconds without progress before a running job is retried, and attempts per job
+ITINERARY_JOB_STALE_TIMEOUT = int(os.getenv('ITINERARY_JOB_STALE_TIMEOUT') or 300)
+ITINERARY_JOB_MAX_ATTEMPTS = int(os.getenv('ITINERARY_JOB_MAX_ATTEMPTS') or 3)
+
+# Email outbox: emails sent per batch, attempts per email, seconds before the first retry (doubled after
+# each failure), seconds a claimed email waits before another sender retries it, and seconds an idle
+# SMTP connection is kept open
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE') or 50)
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS') or 6)
+EMAIL_OUTBOX_RETRY_DELAY = float(os.getenv('EMAIL_OUTBOX_RETRY_DELAY') or 30)
+EMAIL_OUTBOX_LEASE_TIMEOUT = float(os.getenv('EMAIL_OUTBOX_LEASE_TIMEOUT') or 300)
+EMAIL_OUTBOX_IDLE_TIMEOUT = float(os.getenv('EMAIL_OUTBOX_IDLE_TIMEOUT') or 60)
+
+# Recent itineraries pagination: default and largest page size
+RECENT_ITINERARIES_PAGE_SIZE = int(os.getenv('RECENT_ITINERARIES_PAGE_SIZE') or 5)
+RECENT_ITINERARIES_MAX_PAGE_SIZE = int(os.getenv('RECENT_ITINERARIES_MAX_PAGE_SIZE') or 50)
+
+# Instrumentation: bearer token required by the metrics endpoint (disabled if unset) and log level.
+# Request and job traces are logged at INFO, which is left out while running the tests
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+TESTING = sys.argv[1:2] == ['test']
+LOG_LEVEL = os.getenv('LOG_LEVEL') or ('WARNING' if TESTING else 'INFO')
+
+# Structured logs: one JSON object per line, with the timing spans of every request and job
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'api.instrumentation.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST')
@@ -179,4 +276,6 @@ EMAIL_PORT = int(os.getenv('EMAIL_PORT'))
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+# Seconds before a connection to the SMTP server or one of its replies times out
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT') or 10)
 
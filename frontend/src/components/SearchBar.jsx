@@ -67,9 +67,8 @@ export default function SearchBar() {
   const submitHandler = (e) => {
     setLoader(true);
     handleSearch(e, selectedTag)
-      .then((resp) => resp.json())
-      .then((data) => {
-        setItinerary(data.data);
+      .then((itinerary) => {
+        setItinerary(itinerary);
         setLoader(false);
         navigate("/timeline");
       })
@@ -38,13 +38,42 @@ export default async function handleSearch(event, selectedTag) {
   if (!res.ok)
     throw new Error({ message: "Cannot proceed with the query. try again" });
 
-  return res;
+  const { data: job } = await res.json();
+  return waitForItinerary(job.id);
+}
+
+const JOB_POLL_INTERVAL = 1500;
+// The timeline only shows the original size of the first image of each place
+const TIMELINE_IMAGES = "image_sizes=original&max_images=1";
+
+// Resolves with the details of the generated itinerary, included in the job once it succeeded
+async function waitForItinerary(jobId) {
+  const token = Cookies.get("access_token");
+
+  for (;;) {
+    const resp = await fetch(`${conf.apiUrl}/itinerary/jobs/${jobId}/?${TIMELINE_IMAGES}`, {
+      method: "GET",
+      headers: {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${token}`,
+      },
+    });
+
+    if (!resp.ok)
+      throw new Error({ message: "Cannot proceed with the query. try again" });
+
+    const { data: job } = await resp.json();
+    if (job.status === "succeeded") return job.itinerary_details;
+    if (job.status === "failed") throw new Error({ message: job.error });
+
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+  }
 }
 
 export async function handleRecent(id) {
   const token = Cookies.get("access_token");
 
-  const resp = await fetch(`${conf.apiUrl}/itinerary/${id}/`, {
+  const resp = await fetch(`${conf.apiUrl}/itinerary/${id}/?${TIMELINE_IMAGES}`, {
     method: "GET",
     headers: {
       "Content-Type": "application/json",